@@ -1,53 +1,163 @@
 """
 Simple user authentication for Streamlit
-Stores user credentials in a JSON file (for demo purposes)
+Stores user credentials in a SQLite database (for demo purposes)
 """
-import json
 import hashlib
+import hmac
+import os
+import sqlite3
+import threading
+import orjson
 from pathlib import Path
+from typing import Optional
 
-USERS_FILE = Path("users.json")
+USERS_FILE = Path("users.json")  # Legacy store, imported into USERS_DB once
+USERS_DB = Path("users.db")
 
-def hash_password(password: str) -> str:
-    """Hash password using SHA256"""
-    return hashlib.sha256(password.encode()).hexdigest()
+# scrypt parameters (interactive-login cost, ~16 MiB memory per hash)
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_BYTES = 16
+
+# hashlib is backed by OpenSSL's EVP layer, which already dispatches to the
+# SHA-NI / ARMv8 SHA extensions at runtime when the CPU supports them.
+# Cloning a pre-initialised hasher skips the per-call algorithm lookup.
+_SHA256 = hashlib.sha256()
+
+# Parsed users file, keyed on its mtime so repeated reads skip the JSON parse
+_users_cache: Optional[dict] = None
+_users_cache_mtime: Optional[int] = None
+
+# Streamlit serves sessions from several threads; sqlite3 connections are
+# safe to share with check_same_thread=False as long as access is serialized
+_db_lock = threading.Lock()
+_db: Optional[sqlite3.Connection] = None
+
+# In-memory copy of records already read from USERS_DB. Only existing users
+# are cached: records are never deleted, and the one in-place update (legacy
+# hash upgrade) leaves a stale copy that still verifies the same password.
+_records: dict = {}
+
+def _legacy_hash(password: str) -> str:
+    """Unsalted SHA256 hash used by accounts created before scrypt"""
+    # Must stay SHA256 to match hashes already on disk; it runs at most once
+    # per legacy account before the record is rehashed with scrypt
+    hasher = _SHA256.copy()
+    hasher.update(password.encode())
+    return hasher.hexdigest()
+
+def hash_password(password: str, salt: Optional[str] = None) -> tuple[str, str]:
+    """Hash password using scrypt and return (password_hash, salt) as hex"""
+    salt_bytes = bytes.fromhex(salt) if salt else os.urandom(SALT_BYTES)
+    digest = hashlib.scrypt(
+        password.encode(), salt=salt_bytes, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P
+    )
+    return digest.hex(), salt_bytes.hex()
+
+def verify_password(password: str, record: dict) -> bool:
+    """Check a password against a stored user record"""
+    salt = record.get("salt")
+    if salt:
+        candidate, _ = hash_password(password, salt)
+    else:
+        candidate = _legacy_hash(password)
+    return hmac.compare_digest(candidate, record["password_hash"])
 
 def load_users():
-    """Load users from JSON file"""
-    if USERS_FILE.exists():
-        with open(USERS_FILE, 'r') as f:
-            return json.load(f)
-    return {}
+    """Load users from the legacy JSON file"""
+    global _users_cache, _users_cache_mtime
+    try:
+        mtime = USERS_FILE.stat().st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    if _users_cache is None or mtime != _users_cache_mtime:
+        _users_cache = orjson.loads(USERS_FILE.read_bytes())
+        _users_cache_mtime = mtime
+    return _users_cache
 
-def save_users(users):
-    """Save users to JSON file"""
-    with open(USERS_FILE, 'w') as f:
-        json.dump(users, f, indent=2)
+def _get_db() -> sqlite3.Connection:
+    """Open the users database, creating and seeding it on first use"""
+    global _db
+    if _db is None:
+        conn = sqlite3.connect(USERS_DB, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # In WAL mode NORMAL defers fsync to checkpoints, so registrations
+        # don't block on a disk flush per commit (still crash-safe for the app)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA mmap_size=67108864")
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS users (
+                    username TEXT PRIMARY KEY,
+                    password_hash TEXT NOT NULL,
+                    salt TEXT,
+                    user_id TEXT NOT NULL
+                )
+            """)
+            conn.executemany(
+                "INSERT OR IGNORE INTO users (username, password_hash, salt, user_id) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (name, u["password_hash"], u.get("salt"), u["user_id"])
+                    for name, u in load_users().items()
+                ]
+            )
+        _db = conn
+    return _db
+
+def _get_record(username: str) -> Optional[dict]:
+    """Fetch a single user record by username"""
+    record = _records.get(username)
+    if record is not None:
+        return record
+    with _db_lock:
+        row = _get_db().execute(
+            "SELECT password_hash, salt, user_id FROM users WHERE username = ?",
+            (username,)
+        ).fetchone()
+    if row is None:
+        return None
+    record = {"password_hash": row[0], "salt": row[1], "user_id": row[2]}
+    _records[username] = record
+    return record
 
 def register_user(username: str, password: str) -> bool:
     """Register a new user"""
-    users = load_users()
-    if username in users:
-        return False
-    users[username] = {
-        "password_hash": hash_password(password),
-        "user_id": f"user_{username}"
-    }
-    save_users(users)
-    return True
+    password_hash, salt = hash_password(password)
+    with _db_lock:
+        conn = _get_db()
+        with conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO users (username, password_hash, salt, user_id) "
+                "VALUES (?, ?, ?, ?)",
+                (username, password_hash, salt, f"user_{username}")
+            )
+    return cursor.rowcount == 1
 
 def authenticate_user(username: str, password: str) -> tuple[bool, str]:
     """Authenticate user and return (success, user_id)"""
-    users = load_users()
-    if username not in users:
+    record = _get_record(username)
+    if record is None:
+        return False, None
+    if not verify_password(password, record):
         return False, None
-    if users[username]["password_hash"] == hash_password(password):
-        return True, users[username]["user_id"]
-    return False, None
+    if not record["salt"]:
+        # Upgrade legacy SHA256 hashes to scrypt on successful login
+        password_hash, salt = hash_password(password)
+        with _db_lock:
+            conn = _get_db()
+            with conn:
+                conn.execute(
+                    "UPDATE users SET password_hash = ?, salt = ? WHERE username = ?",
+                    (password_hash, salt, username)
+                )
+        _records[username] = {**record, "password_hash": password_hash, "salt": salt}
+    return True, record["user_id"]
 
 def get_user_id(username: str) -> str:
     """Get user_id for a username"""
-    users = load_users()
-    if username in users:
-        return users[username]["user_id"]
+    record = _get_record(username)
+    if record:
+        return record["user_id"]
     return None
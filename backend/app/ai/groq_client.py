@@ -1,53 +1,155 @@
 """
 Groq API client for LLaMA models
 """
-from typing import Optional, List, Dict
-from groq import Groq
+from typing import Optional, List, Dict, Tuple, AsyncIterator
+from groq import AsyncGroq
 from backend.app.config import settings
-import json
+from backend.app.database.cache import LRUCache
+import asyncio
+import io
+import httpx
+import orjson
+
+
+# Prompt templates (built once at import, filled per call with str.format)
+_EXPAND_SYSTEM = {"role": "system", "content": "You are a helpful search assistant that expands queries to improve product discovery."}
+_EXPAND_TMPL = """You are a search query expansion assistant. Given a user's search query, generate an expanded version that includes synonyms, related terms, and context that would help find relevant products.
+
+Original query: {query}
+
+Generate an expanded query that:
+1. Includes synonyms and related terms
+2. Adds context about what the user might be looking for
+3. Keeps the core intent intact
+
+Expanded query:"""
+
+_RERANK_SYSTEM = {"role": "system", "content": "You are a product ranking assistant. Always respond with valid JSON."}
+_RERANK_TMPL_SHORT = """You are a product ranking assistant. Given a user query and a list of products, rank them by relevance to the query.
+
+User Query: {query}
+
+Products:
+{products_text}
+
+Return a JSON object with a "ranked_ids" array containing product IDs in order of relevance (most relevant first). Only include IDs that are relevant to the query."""
+_RERANK_TMPL_VERBOSE = _RERANK_TMPL_SHORT + """
+
+Example format: {{"ranked_ids": ["id1", "id2", "id3"]}}"""
+# The JSON response_format already constrains the output, so the example line
+# is only sent in debug mode to keep per-call uplink bytes down
+_RERANK_TMPL = _RERANK_TMPL_VERBOSE if settings.DEBUG else _RERANK_TMPL_SHORT
+_RERANK_ROW_TMPL = "{n}. ID: {id}, Title: {title}, Desc: {description}, Category: {category}, Price: ${price}, Rating: {rating}"
+_RERANK_DESC_CHARS = 80
+
+_EXPLAIN_SYSTEM = {"role": "system", "content": "You are a helpful assistant that explains product relevance to search queries."}
+_EXPLAIN_TMPL = """Explain why this product is relevant to the user's search query. Be concise (1-2 sentences).
+
+User Query: {query}
+
+Product:
+- Title: {title}
+- Description: {description}
+- Category: {category}
+- Price: ${price}
+- Rating: {rating}
+
+Explanation:"""
+_EXPLAIN_BATCH_SYSTEM = {"role": "system", "content": "You are a helpful assistant that explains product relevance to search queries. Always respond with valid JSON."}
+_EXPLAIN_BATCH_TMPL = """For each numbered row below, explain why the product is relevant to that row's user search query. Be concise (1-2 sentences per row).
+
+Rows:
+{rows_text}
+
+Return a JSON object with an "explanations" array containing exactly {count} strings, one per row, in row order.
+
+Example format: {{"explanations": ["explanation for row 1", "explanation for row 2"]}}"""
+_EXPLAIN_BATCH_ROW_TMPL = "{n}. Query: {query} | Title: {title} | Description: {description} | Category: {category} | Price: ${price} | Rating: {rating}"
+_EXPLAIN_BATCH_SIZE = 8  # Rows per request; keeps output well under max_tokens
+_EXPLAIN_FALLBACK = "This product matches your search for '{query}' based on its title, description, and category."
+
+_ATTRIBUTES_SYSTEM = {"role": "system", "content": "You are an attribute extraction assistant. Always return valid JSON."}
+_ATTRIBUTES_TMPL = """Extract key attributes from this product description. Return a JSON object with attributes like brand, material, style, color, size if mentioned.
+
+Description: {description}
+
+Return JSON with extracted attributes:"""
+
+_RERANK_CACHE_SIZE = 1024  # (query, candidate ids) -> ranked ids
+_EXPAND_CACHE_SIZE = 4096  # normalized query -> expanded query
+_EXPLAIN_CACHE_SIZE = 8192  # (normalized query, product fields) -> explanation
+_ATTRIBUTES_CACHE_SIZE = 4096  # description -> extracted attributes
+
+
+def _normalize_query(query: str) -> str:
+    """Cache key form of a query: case and whitespace differences collapse"""
+    return " ".join(query.lower().split())
+
+
+def _explain_key(query: str, product: Dict) -> Tuple:
+    """Explanation cache key; includes every product field the prompt uses"""
+    return (
+        _normalize_query(query), product['id'], product['title'], product['description'],
+        product['category'], product['price'], product['rating']
+    )
 
 
 class GroqClient:
     """Client for Groq API with LLaMA models"""
-    
+
     def __init__(self):
         if not settings.GROQ_API_KEY:
             raise ValueError("GROQ_API_KEY not set in environment")
-        self.client = Groq(api_key=settings.GROQ_API_KEY)
+        # One pooled HTTP/2 connection set shared by every call, so concurrent
+        # expand/rerank/explain requests multiplex over a warm TLS session
+        self._http_client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+            timeout=httpx.Timeout(30.0, connect=5.0)
+        )
+        self.client = AsyncGroq(api_key=settings.GROQ_API_KEY, http_client=self._http_client)
         self.model = settings.GROQ_MODEL
-    
-    def expand_query(self, query: str) -> str:
+        # Bound in-flight requests so bursts stay under Groq's rate limits
+        self._semaphore = asyncio.Semaphore(settings.GROQ_MAX_CONCURRENCY)
+        self._rerank_cache = LRUCache(_RERANK_CACHE_SIZE)
+        self._expand_cache = LRUCache(_EXPAND_CACHE_SIZE)
+        self._explain_cache = LRUCache(_EXPLAIN_CACHE_SIZE)
+        self._attributes_cache = LRUCache(_ATTRIBUTES_CACHE_SIZE)
+
+    async def create_completion(self, **kwargs):
+        """Issue a chat completion on the shared client, respecting the concurrency limit"""
+        kwargs.setdefault("model", self.model)
+        async with self._semaphore:
+            return await self.client.chat.completions.create(**kwargs)
+
+    async def expand_query(self, query: str) -> str:
         """
         Expand search query using AI to improve semantic matching
         """
-        prompt = f"""You are a search query expansion assistant. Given a user's search query, generate an expanded version that includes synonyms, related terms, and context that would help find relevant products.
+        cache_key = _normalize_query(query)
+        cached = self._expand_cache.get(cache_key)
+        if cached is not None:
+            return cached
 
-Original query: {query}
-
-Generate an expanded query that:
-1. Includes synonyms and related terms
-2. Adds context about what the user might be looking for
-3. Keeps the core intent intact
-
-Expanded query:"""
-        
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
+            response = await self.create_completion(
                 messages=[
-                    {"role": "system", "content": "You are a helpful search assistant that expands queries to improve product discovery."},
-                    {"role": "user", "content": prompt}
+                    _EXPAND_SYSTEM,
+                    {"role": "user", "content": _EXPAND_TMPL.format(query=query)}
                 ],
                 temperature=0.3,
                 max_tokens=100
             )
             expanded = response.choices[0].message.content.strip()
-            return expanded if expanded else query
+            if not expanded:
+                return query
+            self._expand_cache.put(cache_key, expanded)
+            return expanded
         except Exception as e:
             print(f"Error expanding query: {e}")
             return query
-    
-    def rerank_results(
+
+    async def rerank_results(
         self,
         query: str,
         products: List[Dict]
@@ -58,63 +160,57 @@ Expanded query:"""
         """
         if not products:
             return products
-        
-        # Format products for AI
-        products_text = "\n".join([
-            f"{i+1}. ID: {p['id']}, Title: {p['title']}, "
-            f"Description: {p['description'][:100]}..., "
-            f"Category: {p['category']}, Price: ${p['price']}, Rating: {p['rating']}"
-            for i, p in enumerate(products)
-        ])
-        
-        prompt = f"""You are a product ranking assistant. Given a user query and a list of products, rank them by relevance to the query.
 
-User Query: {query}
+        # Repeated queries over the same candidate set skip the LLM entirely
+        cache_key = (query, tuple(p['id'] for p in products))
+        ranked_ids = self._rerank_cache.get(cache_key)
+        if ranked_ids is not None:
+            return self._apply_ranking(products, ranked_ids)
 
-Products:
-{products_text}
-
-Return a JSON object with a "ranked_ids" array containing product IDs in order of relevance (most relevant first). Only include IDs that are relevant to the query.
+        # Format products for AI, writing rows straight into one buffer
+        buf = io.StringIO()
+        for i, p in enumerate(products, 1):
+            if i > 1:
+                buf.write("\n")
+            buf.write(_RERANK_ROW_TMPL.format(
+                n=i, id=p['id'], title=p['title'],
+                description=p['description'][:_RERANK_DESC_CHARS], category=p['category'],
+                price=p['price'], rating=p['rating']
+            ))
+        products_text = buf.getvalue()
 
-Example format: {{"ranked_ids": ["id1", "id2", "id3"]}}"""
-        
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
+            response = await self.create_completion(
                 messages=[
-                    {"role": "system", "content": "You are a product ranking assistant. Always respond with valid JSON."},
-                    {"role": "user", "content": prompt}
+                    _RERANK_SYSTEM,
+                    {"role": "user", "content": _RERANK_TMPL.format(query=query, products_text=products_text)}
                 ],
                 temperature=0.2,
                 max_tokens=500,
                 response_format={"type": "json_object"}
             )
-            
-            result = json.loads(response.choices[0].message.content)
+
+            result = orjson.loads(response.choices[0].message.content)
             ranked_ids = result.get("ranked_ids", [])
-            
-            # Reorder products based on AI ranking
-            id_to_product = {p['id']: p for p in products}
-            ranked_products = []
-            seen_ids = set()
-            
-            # Add ranked products
-            for pid in ranked_ids:
-                if pid in id_to_product:
-                    ranked_products.append(id_to_product[pid])
-                    seen_ids.add(pid)
-            
-            # Add remaining products
-            for p in products:
-                if p['id'] not in seen_ids:
-                    ranked_products.append(p)
-            
-            return ranked_products
+
+            self._rerank_cache.put(cache_key, ranked_ids)
+
+            return self._apply_ranking(products, ranked_ids)
         except Exception as e:
             print(f"Error reranking: {e}")
             return products
-    
-    def generate_explanation(
+
+    @staticmethod
+    def _apply_ranking(products: List[Dict], ranked_ids: List[str]) -> List[Dict]:
+        """Reorder products by AI-ranked IDs, keeping unranked ones at the end"""
+        # Popping fuses the membership check with removal, so whatever is
+        # left afterwards is exactly the unranked products in original order
+        remaining = {p['id']: p for p in products}
+        ranked_products = [remaining.pop(pid) for pid in ranked_ids if pid in remaining]
+        ranked_products.extend(remaining.values())
+        return ranked_products
+
+    async def generate_explanation(
         self,
         query: str,
         product: Dict
@@ -122,58 +218,180 @@ Example format: {{"ranked_ids": ["id1", "id2", "id3"]}}"""
         """
         Generate AI explanation for why a product was shown for a query
         """
-        prompt = f"""Explain why this product is relevant to the user's search query. Be concise (1-2 sentences).
+        cache_key = _explain_key(query, product)
+        cached = self._explain_cache.get(cache_key)
+        if cached is not None:
+            return cached
 
-User Query: {query}
-
-Product:
-- Title: {product['title']}
-- Description: {product['description']}
-- Category: {product['category']}
-- Price: ${product['price']}
-- Rating: {product['rating']}
+        prompt = _EXPLAIN_TMPL.format(
+            query=query, title=product['title'], description=product['description'],
+            category=product['category'], price=product['price'], rating=product['rating']
+        )
 
-Explanation:"""
-        
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
+            response = await self.create_completion(
                 messages=[
-                    {"role": "system", "content": "You are a helpful assistant that explains product relevance to search queries."},
+                    _EXPLAIN_SYSTEM,
                     {"role": "user", "content": prompt}
                 ],
                 temperature=0.4,
                 max_tokens=150
             )
             explanation = response.choices[0].message.content.strip()
+            self._explain_cache.put(cache_key, explanation)
             return explanation
         except Exception as e:
             print(f"Error generating explanation: {e}")
-            return f"This product matches your search for '{query}' based on its title, description, and category."
-    
-    def extract_attributes(self, description: str) -> Dict[str, str]:
+            return _EXPLAIN_FALLBACK.format(query=query)
+
+    async def generate_explanation_stream(
+        self,
+        query: str,
+        product: Dict
+    ) -> AsyncIterator[str]:
         """
-        Extract structured attributes from product description
+        Stream an AI explanation token-by-token so callers can forward text
+        as soon as the first tokens arrive instead of waiting for the full reply
         """
-        prompt = f"""Extract key attributes from this product description. Return a JSON object with attributes like brand, material, style, color, size if mentioned.
+        cache_key = _explain_key(query, product)
+        cached = self._explain_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
 
-Description: {description}
+        prompt = _EXPLAIN_TMPL.format(
+            query=query, title=product['title'], description=product['description'],
+            category=product['category'], price=product['price'], rating=product['rating']
+        )
 
-Return JSON with extracted attributes:"""
-        
+        # The Groq stream is drained by a task that owns the concurrency slot;
+        # it feeds an unbounded queue, so a slow HTTP reader never keeps the
+        # slot held (None marks the end of the stream)
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def read_stream():
+            try:
+                async with self._semaphore:
+                    stream = await self.client.chat.completions.create(
+                        model=self.model,
+                        messages=[
+                            _EXPLAIN_SYSTEM,
+                            {"role": "user", "content": prompt}
+                        ],
+                        temperature=0.4,
+                        max_tokens=150,
+                        stream=True
+                    )
+                    async for chunk in stream:
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            queue.put_nowait(delta)
+            finally:
+                queue.put_nowait(None)
+
+        reader = asyncio.create_task(read_stream())
+        emitted = False
+        parts = []
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
+            while True:
+                delta = await queue.get()
+                if delta is None:
+                    break
+                emitted = True
+                parts.append(delta)
+                yield delta
+            await reader  # Re-raises a failed stream
+            if emitted:
+                self._explain_cache.put(cache_key, "".join(parts).strip())
+        except Exception as e:
+            print(f"Error streaming explanation: {e}")
+            if not emitted:
+                yield _EXPLAIN_FALLBACK.format(query=query)
+        finally:
+            # Consumer went away mid-stream: stop reading from Groq
+            reader.cancel()
+
+    async def generate_explanations_batch(
+        self,
+        pairs: List[Tuple[str, Dict]]
+    ) -> List[str]:
+        """
+        Generate explanations for several (query, product) pairs, packing up to
+        _EXPLAIN_BATCH_SIZE rows into each request instead of one call per product.
+        Requests for separate chunks run concurrently; cached pairs are not sent.
+        """
+        explanations = [
+            self._explain_cache.get(_explain_key(query, product))
+            for query, product in pairs
+        ]
+        missing = [i for i, explanation in enumerate(explanations) if explanation is None]
+        chunks = [
+            missing[start:start + _EXPLAIN_BATCH_SIZE]
+            for start in range(0, len(missing), _EXPLAIN_BATCH_SIZE)
+        ]
+        batches = await asyncio.gather(*(
+            self._explain_chunk([pairs[i] for i in chunk]) for chunk in chunks
+        ))
+        for chunk, batch in zip(chunks, batches):
+            for i, explanation in zip(chunk, batch):
+                explanations[i] = explanation
+        return explanations
+
+    async def _explain_chunk(self, chunk: List[Tuple[str, Dict]]) -> List[str]:
+        """One JSON-mode request explaining every pair in the chunk"""
+        rows_text = "\n".join([
+            _EXPLAIN_BATCH_ROW_TMPL.format(
+                n=i + 1, query=query, title=product['title'],
+                description=product['description'], category=product['category'],
+                price=product['price'], rating=product['rating']
+            )
+            for i, (query, product) in enumerate(chunk)
+        ])
+
+        batch = []
+        try:
+            response = await self.create_completion(
                 messages=[
-                    {"role": "system", "content": "You are an attribute extraction assistant. Always return valid JSON."},
-                    {"role": "user", "content": prompt}
+                    _EXPLAIN_BATCH_SYSTEM,
+                    {"role": "user", "content": _EXPLAIN_BATCH_TMPL.format(rows_text=rows_text, count=len(chunk))}
+                ],
+                temperature=0.4,
+                max_tokens=150 * len(chunk),
+                response_format={"type": "json_object"}
+            )
+            result = orjson.loads(response.choices[0].message.content)
+            batch = [str(e).strip() for e in result.get("explanations", [])][:len(chunk)]
+            for (query, product), explanation in zip(chunk, batch):
+                self._explain_cache.put(_explain_key(query, product), explanation)
+        except Exception as e:
+            print(f"Error generating explanations batch: {e}")
+
+        # Fill any rows the model dropped with the generic fallback
+        for query, _ in chunk[len(batch):]:
+            batch.append(_EXPLAIN_FALLBACK.format(query=query))
+        return batch
+
+    async def extract_attributes(self, description: str) -> Dict[str, str]:
+        """
+        Extract structured attributes from product description
+        """
+        cached = self._attributes_cache.get(description)
+        if cached is not None:
+            return dict(cached)
+
+        try:
+            response = await self.create_completion(
+                messages=[
+                    _ATTRIBUTES_SYSTEM,
+                    {"role": "user", "content": _ATTRIBUTES_TMPL.format(description=description)}
                 ],
                 temperature=0.2,
                 max_tokens=200,
                 response_format={"type": "json_object"}
             )
-            attributes = json.loads(response.choices[0].message.content)
-            return attributes
+            attributes = orjson.loads(response.choices[0].message.content)
+            self._attributes_cache.put(description, attributes)
+            return dict(attributes)
         except Exception as e:
             print(f"Error extracting attributes: {e}")
             return {}
@@ -188,4 +406,3 @@ def get_groq_client() -> GroqClient:
     if groq_client is None:
         groq_client = GroqClient()
     return groq_client
-
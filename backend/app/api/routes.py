@@ -2,6 +2,7 @@
 API routes for the search platform
 """
 from fastapi import APIRouter, HTTPException, Header
+from fastapi.responses import StreamingResponse
 from typing import Optional
 from backend.app.models.search import SearchRequest, SearchResponse
 from backend.app.models.product import Product
@@ -11,16 +12,23 @@ from backend.app.services.behavior_tracker import behavior_tracker
 from backend.app.services.analytics_service import analytics_service
 from backend.app.models.behavior import EventType
 from datetime import datetime
-import uuid
+from functools import lru_cache
+from uuid import uuid4
 
 router = APIRouter()
 
+@lru_cache(maxsize=256)
+def _parse_iso(value: str) -> datetime:
+    """Parse an ISO date filter, memoized since dashboards resend the same ranges"""
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid ISO datetime: {value}")
+
 
 def get_or_create_session_id(session_id: Optional[str] = None) -> str:
     """Get or create session ID"""
-    if not session_id:
-        return str(uuid.uuid4())
-    return session_id
+    return session_id or uuid4().hex
 
 
 @router.post("/search", response_model=SearchResponse)
@@ -38,10 +46,18 @@ async def search(
     - **max_price**: Optional maximum price filter
     - **min_rating**: Optional minimum rating filter
     - **limit**: Maximum number of results (default: 20)
+    - **stream**: Return Server-Sent Events: ranked results as soon as they
+      are ready, then each AI explanation as it completes (default: false)
     """
     try:
         print(f"DEBUG: Search request received: {request}")
         session_id = get_or_create_session_id(x_session_id)
+        if request.stream:
+            return StreamingResponse(
+                search_service.search_stream(request, session_id, user_id=x_user_id),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache"}
+            )
         return await search_service.search(request, session_id, user_id=x_user_id)
     except Exception as e:
         import traceback
@@ -66,59 +82,31 @@ async def create_products_batch(products: list[Product]):
     return {"status": "success", "count": len(results), "product_ids": results}
 
 
-@router.post("/events/click")
-async def track_click(
-    request: dict,
-    x_session_id: Optional[str] = Header(None, alias="X-Session-ID"),
-    x_user_id: Optional[str] = Header(None, alias="X-User-ID")
-):
-    """Track product click event"""
-    product_id = request.get("product_id")
-    if not product_id:
-        raise HTTPException(status_code=400, detail="product_id is required")
-    session_id = get_or_create_session_id(x_session_id)
-    await behavior_tracker.track_event(
-        event_type=EventType.CLICK,
-        session_id=session_id,
-        product_id=product_id,
-        user_id=x_user_id
-    )
-    return {"status": "success"}
+# URL segment -> tracked event type for the product interaction endpoints
+_EVENT_MAP = {
+    "click": EventType.CLICK,
+    "add-to-cart": EventType.ADD_TO_CART,
+    "purchase": EventType.PURCHASE,
+}
 
 
-@router.post("/events/add-to-cart")
-async def track_add_to_cart(
+@router.post("/events/{event}")
+async def track_product_event(
+    event: str,
     request: dict,
     x_session_id: Optional[str] = Header(None, alias="X-Session-ID"),
     x_user_id: Optional[str] = Header(None, alias="X-User-ID")
 ):
-    """Track add to cart event"""
+    """Track a product interaction event (click, add-to-cart, purchase)"""
+    event_type = _EVENT_MAP.get(event)
+    if event_type is None:
+        raise HTTPException(status_code=404, detail=f"Unknown event type: {event}")
     product_id = request.get("product_id")
     if not product_id:
         raise HTTPException(status_code=400, detail="product_id is required")
     session_id = get_or_create_session_id(x_session_id)
     await behavior_tracker.track_event(
-        event_type=EventType.ADD_TO_CART,
-        session_id=session_id,
-        product_id=product_id,
-        user_id=x_user_id
-    )
-    return {"status": "success"}
-
-
-@router.post("/events/purchase")
-async def track_purchase(
-    request: dict,
-    x_session_id: Optional[str] = Header(None, alias="X-Session-ID"),
-    x_user_id: Optional[str] = Header(None, alias="X-User-ID")
-):
-    """Track purchase event"""
-    product_id = request.get("product_id")
-    if not product_id:
-        raise HTTPException(status_code=400, detail="product_id is required")
-    session_id = get_or_create_session_id(x_session_id)
-    await behavior_tracker.track_event(
-        event_type=EventType.PURCHASE,
+        event_type=event_type,
         session_id=session_id,
         product_id=product_id,
         user_id=x_user_id
@@ -136,6 +124,35 @@ async def get_product(product_id: str):
     return product
 
 
+@router.get("/products/{product_id}/explanation")
+async def explain_product(product_id: str, query: str):
+    """
+    Stream an AI explanation of why a product matches a query
+
+    - **query**: The search query the product was shown for
+    """
+    from backend.app.database.mysql_db import db
+    from backend.app.ai.groq_client import get_groq_client
+    product = await db.get_product(product_id)
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    try:
+        groq = get_groq_client()
+    except ValueError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return StreamingResponse(
+        groq.generate_explanation_stream(query, {
+            "id": product.id,
+            "title": product.title,
+            "description": product.description,
+            "category": product.category,
+            "price": product.price,
+            "rating": product.rating
+        }),
+        media_type="text/plain"
+    )
+
+
 @router.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -187,14 +204,17 @@ async def get_recent_activity(user_id: str):
     """Get summarized recent activity for the dashboard"""
     from backend.app.database.mysql_db import db
     
-    recent_searches = await db.get_recent_searches(user_id, limit=5)
+    recent_searches = [
+        {"query": query, "timestamp": timestamp}
+        async for query, timestamp in db.get_recent_searches(user_id, limit=5)
+    ]
     viewed = await db.get_user_interactions(user_id, interaction_type='click', limit=10)
     carts = await db.get_user_interactions(user_id, interaction_type='add_to_cart', limit=10)
     
     return {
         "recent_searches": recent_searches,
-        "recently_viewed": viewed,
-        "added_to_cart": carts
+        "recently_viewed": [i._asdict() for i in viewed],
+        "added_to_cart": [i._asdict() for i in carts]
     }
 
 
@@ -203,7 +223,7 @@ async def get_user_interactions(user_id: str, limit: int = 50):
     """Get recent interactions for a user"""
     from backend.app.database.mysql_db import db
     interactions = await db.get_user_interactions(user_id, limit=limit)
-    return interactions
+    return [i._asdict() for i in interactions]
 
 
 
@@ -238,8 +258,8 @@ async def get_query_metrics(
     - **end_date**: Optional end date filter (ISO format: YYYY-MM-DDTHH:MM:SS)
     - **min_searches**: Minimum searches to include a query (default: 1)
     """
-    start = datetime.fromisoformat(start_date) if start_date else None
-    end = datetime.fromisoformat(end_date) if end_date else None
+    start = _parse_iso(start_date) if start_date else None
+    end = _parse_iso(end_date) if end_date else None
     
     return await analytics_service.get_query_metrics(
         start_date=start,
@@ -259,8 +279,8 @@ async def get_zero_result_queries(
     - **start_date**: Optional start date filter (ISO format)
     - **end_date**: Optional end date filter (ISO format)
     """
-    start = datetime.fromisoformat(start_date) if start_date else None
-    end = datetime.fromisoformat(end_date) if end_date else None
+    start = _parse_iso(start_date) if start_date else None
+    end = _parse_iso(end_date) if end_date else None
     
     return await analytics_service.get_zero_result_queries(
         start_date=start,
@@ -4,22 +4,50 @@ Configuration management for the application
 import os
 from typing import Optional
 from pathlib import Path
-from pydantic_settings import BaseSettings
+from pydantic import Field
+from pydantic_settings import BaseSettings, SettingsConfigDict
 
 # Get the backend directory (parent of app/)
 BACKEND_DIR = Path(__file__).parent.parent
 ENV_FILE = BACKEND_DIR / ".env"
 
+# Production deployments inject configuration through the environment, so
+# skip the dotenv scan there; otherwise resolve the .env path once per process
+APP_ENV = os.environ.get("APP_ENV", "dev")
+if APP_ENV == "prod":
+    RESOLVED_ENV_FILE: Optional[str] = None
+else:
+    RESOLVED_ENV_FILE = str(ENV_FILE) if ENV_FILE.exists() else ".env"
+
 
 class Settings(BaseSettings):
     """Application settings"""
     
+    model_config = SettingsConfigDict(
+        env_file=RESOLVED_ENV_FILE,
+        env_file_encoding="utf-8",
+        case_sensitive=True,
+        frozen=True,  # Settings are read-only after startup
+        extra="ignore"
+    )
+    
     # Database - MySQL
     MYSQL_HOST: str = "127.0.0.1"
     MYSQL_PORT: int = 3306
     MYSQL_DB: str = "lenskart_search"
     MYSQL_USER: str = "root"
     MYSQL_PASSWORD: str = ""
+    MYSQL_UNIX_SOCKET: Optional[str] = None  # Used when MYSQL_HOST is local; defaults to /var/run/mysqld/mysqld.sock
+    # Pool sized to expected in-flight requests; all connections opened at startup
+    MYSQL_POOL_SIZE: int = Field(default_factory=lambda: max(10, (os.cpu_count() or 1) * 4))
+    MYSQL_TX_POOL_SIZE: int = 8  # Connections for multi-statement transactions and batch flushes
+    MYSQL_POOL_RECYCLE: int = 3600  # Seconds before an idle connection is reopened
+    MYSQL_CONNECT_TIMEOUT: int = 5
+    MYSQL_CACHE_SIZE: int = 10000  # Entries per primary-key read cache
+    MYSQL_CACHE_TTL_SECONDS: float = 60.0
+    MYSQL_WRITE_BATCH_WAIT_MS: int = 50  # Coalescing window for buffered writes
+    MYSQL_WRITE_BATCH_MAX_ROWS: int = 500  # Flush early once this many rows are buffered
+    MYSQL_WRITE_MAX_RETRIES: int = 5  # Failed flushes requeued before the rows are dropped
     
     # Legacy PostgreSQL settings (for backwards compatibility)
     POSTGRES_HOST: str = "localhost"
@@ -32,10 +60,13 @@ class Settings(BaseSettings):
     VECTOR_DB_PATH: str = "./data/vector_db"
     EMBEDDING_MODEL: str = "sentence-transformers/all-MiniLM-L6-v2"
     EMBEDDING_DIMENSION: int = 384
+    EMBEDDING_BACKEND: str = "onnx"  # "torch", "onnx" (ONNX Runtime) or "openvino"
     
     # Groq API
     GROQ_API_KEY: Optional[str] = None
     GROQ_MODEL: str = "llama-3.1-70b-versatile"  # or llama-3.3-70b-versatile
+    GROQ_MAX_CONCURRENCY: int = 48  # Max in-flight Groq requests per process
+    QUERY_EXPAND_TIMEOUT_MS: int = 800  # Search falls back to the raw query after this
     
     # Message Queue (Redis Streams)
     REDIS_HOST: str = "localhost"
@@ -67,11 +98,6 @@ class Settings(BaseSettings):
     API_HOST: str = "0.0.0.0"
     API_PORT: int = 8000
     DEBUG: bool = True
-    
-    class Config:
-        env_file = str(ENV_FILE) if ENV_FILE.exists() else ".env"
-        env_file_encoding = "utf-8"
-        case_sensitive = True
 
 
 settings = Settings()
@@ -2,11 +2,382 @@
 MySQL database connection and operations
 """
 import aiomysql
-from typing import List, Optional, Dict
+import asyncio
+from pymysql.constants import CLIENT, FIELD_TYPE
+from pymysql.converters import conversions
+from pymysql.err import ProgrammingError
+from typing import List, Optional, Dict, AsyncIterator, Tuple
 from backend.app.config import settings
-from backend.app.models.product import Product
-import json
-from datetime import datetime
+from backend.app.models.product import Product, ProductAttributes
+from backend.app.database.cache import TTLCache
+import orjson
+import itertools
+import logging
+import os
+from collections import namedtuple
+from contextlib import asynccontextmanager
+from datetime import date, datetime
+
+logger = logging.getLogger(__name__)
+
+# Bulk insert sizing: rows per statement, and a byte budget kept well under
+# the server's default 16MB max_allowed_packet
+BULK_INSERT_CHUNK_SIZE = 1000
+BULK_INSERT_MAX_BYTES = 8 * 1024 * 1024
+
+# Result decoders: DECIMAL columns come back as float instead of Decimal,
+# skipping a Decimal construction plus float() per numeric column per row
+DECODERS = {**conversions, FIELD_TYPE.DECIMAL: float, FIELD_TYPE.NEWDECIMAL: float}
+
+# Local servers are reached over their Unix socket; remote connections use
+# TCP, on which aiomysql already disables Nagle (TCP_NODELAY)
+LOCAL_MYSQL_HOSTS = ("localhost", "127.0.0.1", "::1")
+DEFAULT_MYSQL_SOCKET = "/var/run/mysqld/mysqld.sock"
+
+# Bump when _create_tables gains DDL or a migration; startup skips all DDL
+# while the database already records this version
+SCHEMA_VERSION = 4
+
+# Append-only event tables partitioned by month; partitions are created this
+# many months ahead and rolled forward daily
+TIME_PARTITIONED_TABLES = ("behavior_events", "user_interactions")
+PARTITION_MONTHS_AHEAD = 3
+PARTITION_MAINTENANCE_INTERVAL = 24 * 60 * 60
+
+# Explicit column lists for readers, so rows only carry what callers use
+PRODUCT_COLUMNS = "id, title, description, category, price, rating, attributes, image_url, created_at"
+PRODUCT_LITE_COLUMNS = "id, title, price, image_url"  # Listing pages
+BEHAVIOR_METRICS_COLUMNS = (
+    "product_id, total_clicks, total_searches, total_carts, total_purchases, "
+    "total_bounces, total_dwell_time, avg_dwell_time, ctr, conversion_rate, "
+    "bounce_rate, last_updated"
+)
+USER_PROFILE_COLUMNS = (
+    "user_id, preferred_categories, preferred_brands, search_history, "
+    "total_searches, total_clicks, total_carts, total_purchases, "
+    "recent_product_ids, created_at, last_updated"
+)
+USER_INTERACTION_COLUMNS = (
+    "ui.id, ui.user_id, ui.product_id, ui.interaction_type, ui.category, "
+    "ui.brand, ui.timestamp, ui.metadata, p.title AS product_title"
+)
+
+# Positional row type for get_user_interactions, fields in USER_INTERACTION_COLUMNS order
+Interaction = namedtuple(
+    'Interaction',
+    'id user_id product_id interaction_type category brand timestamp metadata product_title'
+)
+
+# Allowed filter_products sort keys -> ORDER BY clause (id breaks ties)
+FILTER_SORT_ORDERS = {
+    "rating": "rating DESC, id DESC",
+    "price": "price ASC, id ASC",
+    "created_at": "created_at DESC, id DESC",
+}
+
+# products LEFT JOIN product_behavior_metrics; column names don't overlap
+PRODUCT_WITH_METRICS_COLUMNS = ", ".join(
+    [f"p.{c}" for c in PRODUCT_COLUMNS.split(", ")]
+    + [f"m.{c}" for c in BEHAVIOR_METRICS_COLUMNS.split(", ")]
+)
+
+# Hot single-row lookups, built once at import and reused verbatim per call
+GET_PRODUCT_SQL = f"SELECT {PRODUCT_COLUMNS} FROM products WHERE id = %s"
+GET_PRODUCT_LITE_SQL = f"SELECT {PRODUCT_LITE_COLUMNS} FROM products WHERE id = %s"
+GET_BEHAVIOR_METRICS_SQL = f"SELECT {BEHAVIOR_METRICS_COLUMNS} FROM product_behavior_metrics WHERE product_id = %s"
+GET_USER_PROFILE_SQL = f"SELECT {USER_PROFILE_COLUMNS} FROM user_profiles WHERE user_id = %s"
+
+# Writes shared by MySQLDB and UnitOfWork
+UPDATE_USER_PROFILE_SQL = """
+    UPDATE user_profiles SET
+        preferred_categories = %s,
+        preferred_brands = %s,
+        search_history = %s,
+        total_searches = %s,
+        total_clicks = %s,
+        total_carts = %s,
+        total_purchases = %s,
+        recent_product_ids = %s,
+        last_updated = CURRENT_TIMESTAMP
+    WHERE user_id = %s
+"""
+# Prepend a new query to the bounded search history and count the search,
+# creating the profile if needed, without reading the profile back first
+RECORD_SEARCH_SQL = f"""
+    INSERT INTO user_profiles (
+        user_id, preferred_categories, preferred_brands,
+        search_history, total_searches, recent_product_ids
+    ) VALUES (%s, JSON_OBJECT(), JSON_OBJECT(), JSON_ARRAY(%s), 1, JSON_ARRAY())
+    ON DUPLICATE KEY UPDATE
+        search_history = IF(
+            JSON_CONTAINS(COALESCE(search_history, JSON_ARRAY()), JSON_QUOTE(%s)),
+            search_history,
+            JSON_REMOVE(
+                JSON_ARRAY_INSERT(COALESCE(search_history, JSON_ARRAY()), '$[0]', %s),
+                '$[{settings.MAX_SEARCH_HISTORY}]'
+            )
+        ),
+        total_searches = total_searches + 1
+"""
+INSERT_USER_INTERACTION_SQL = """
+    INSERT INTO user_interactions (
+        user_id, product_id, interaction_type,
+        category, brand, metadata
+    ) VALUES (%s, %s, %s, %s, %s, %s)
+"""
+INSERT_BEHAVIOR_EVENT_SQL = """
+    INSERT INTO behavior_events (
+        event_id, event_type, user_id, session_id,
+        product_id, query, timestamp, dwell_time, metadata
+    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+
+# Additive counters in product_behavior_metrics, bumped by bump_behavior_metrics
+METRIC_COUNTERS = (
+    'total_clicks', 'total_searches', 'total_carts',
+    'total_purchases', 'total_bounces', 'total_dwell_time'
+)
+
+# Tables written by the buffered flush, in pipeline order
+BUFFERED_WRITE_TABLES = (
+    'behavior_events', 'user_interactions',
+    'product_behavior_metrics', 'query_metrics_rollup'
+)
+
+# Additive counters in query_metrics_rollup, bumped by bump_query_metrics.
+# Each (query, day) row aggregates the events that followed that search
+# within its session.
+QUERY_ROLLUP_COUNTERS = (
+    'search_count', 'click_count', 'cart_count',
+    'purchase_count', 'total_dwell', 'dwell_count'
+)
+ROLLUP_QUERY_MAX_LENGTH = 255
+
+# One-off fill of query_metrics_rollup from existing events: every event is
+# attributed to the latest non-empty search before it in its session
+QUERY_ROLLUP_BACKFILL_SQL = f"""
+    INSERT INTO query_metrics_rollup (
+        query, day, search_count, click_count, cart_count, purchase_count,
+        total_dwell, dwell_count, first_seen, last_seen
+    )
+    SELECT
+        search_query, DATE(timestamp),
+        SUM(is_search),
+        SUM(event_type = 'click'),
+        SUM(event_type = 'add_to_cart'),
+        SUM(event_type = 'purchase'),
+        COALESCE(SUM(dwell_time), 0),
+        COUNT(dwell_time),
+        MIN(IF(is_search, timestamp, NULL)),
+        MAX(IF(is_search, timestamp, NULL))
+    FROM (
+        SELECT
+            event_type, timestamp, dwell_time, is_search,
+            LEFT(FIRST_VALUE(query) OVER (
+                PARTITION BY session_id, search_seq ORDER BY timestamp, event_id
+            ), {ROLLUP_QUERY_MAX_LENGTH}) AS search_query,
+            search_seq
+        FROM (
+            SELECT
+                event_id, event_type, session_id, query, timestamp, dwell_time,
+                (event_type = 'search' AND query IS NOT NULL AND query != '') AS is_search,
+                SUM(event_type = 'search' AND query IS NOT NULL AND query != '') OVER (
+                    PARTITION BY session_id ORDER BY timestamp, event_id
+                ) AS search_seq
+            FROM behavior_events
+        ) sequenced
+    ) attributed
+    WHERE search_seq > 0
+    GROUP BY search_query, DATE(timestamp)
+"""
+
+# Ratios maintained by MySQL from the counters (clamped to the column range)
+_INTERACTIONS_SQL = "NULLIF(total_clicks + total_carts + total_purchases, 0)"
+DERIVED_METRIC_COLUMNS = {
+    'avg_dwell_time': "GENERATED ALWAYS AS (COALESCE(total_dwell_time / NULLIF(total_clicks, 0), 0)) STORED",
+    'ctr': "GENERATED ALWAYS AS (LEAST(COALESCE(total_clicks / NULLIF(total_searches, 0), 0), 1)) STORED",
+    'conversion_rate': f"GENERATED ALWAYS AS (LEAST(COALESCE(total_purchases / {_INTERACTIONS_SQL}, 0), 1)) STORED",
+    'bounce_rate': f"GENERATED ALWAYS AS (LEAST(COALESCE(total_bounces / {_INTERACTIONS_SQL}, 0), 1)) STORED",
+}
+DERIVED_METRIC_TYPES = {
+    'avg_dwell_time': "DECIMAL(10, 2)",
+    'ctr': "DECIMAL(5, 4)",
+    'conversion_rate': "DECIMAL(5, 4)",
+    'bounce_rate': "DECIMAL(5, 4)",
+}
+
+# Brand pulled out of the attributes JSON by MySQL so brand filters use an
+# index instead of parsing JSON per row
+PRODUCT_BRAND_COLUMN = "GENERATED ALWAYS AS (JSON_UNQUOTE(JSON_EXTRACT(attributes, '$.brand'))) VIRTUAL"
+
+
+def _local_socket_path() -> Optional[str]:
+    """Unix socket to use when MySQL runs on this host (skips the TCP stack)"""
+    if settings.MYSQL_HOST not in LOCAL_MYSQL_HOSTS:
+        return None
+    path = settings.MYSQL_UNIX_SOCKET or DEFAULT_MYSQL_SOCKET
+    return path if os.path.exists(path) else None
+
+
+def _partition_bounds() -> List[datetime]:
+    """Exclusive upper bounds for this month and PARTITION_MONTHS_AHEAD months after it"""
+    now = datetime.now()
+    bounds = []
+    year, month = now.year, now.month
+    for _ in range(PARTITION_MONTHS_AHEAD + 1):
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        bounds.append(datetime(year, month, 1))
+    return bounds
+
+
+def _partition_name(bound: datetime) -> str:
+    """Name a partition after the month it holds (the month before its bound)"""
+    year, month = (bound.year - 1, 12) if bound.month == 1 else (bound.year, bound.month - 1)
+    return f"p{year}{month:02d}"
+
+
+def _partition_list(bounds: List[datetime]) -> str:
+    """Monthly RANGE partitions followed by the catch-all pmax"""
+    parts = [
+        f"PARTITION {_partition_name(b)} VALUES LESS THAN (UNIX_TIMESTAMP('{b:%Y-%m-%d}'))"
+        for b in bounds
+    ]
+    parts.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+    return "(" + ", ".join(parts) + ")"
+
+
+def _partition_clause(bounds: List[datetime]) -> str:
+    return f"PARTITION BY RANGE (UNIX_TIMESTAMP(timestamp)) {_partition_list(bounds)}"
+
+
+def _dumps(value) -> str:
+    """Serialize to JSON text; JSON columns reject binary-charset (bytes) parameters"""
+    return orjson.dumps(value).decode()
+
+
+def _profile_params(user_id: str, profile_data: Dict) -> tuple:
+    """Parameters for UPDATE_USER_PROFILE_SQL"""
+    return (
+        _dumps(profile_data.get('preferred_categories', {})),
+        _dumps(profile_data.get('preferred_brands', {})),
+        _dumps(profile_data.get('search_history', [])),
+        profile_data.get('total_searches', 0),
+        profile_data.get('total_clicks', 0),
+        profile_data.get('total_carts', 0),
+        profile_data.get('total_purchases', 0),
+        _dumps(profile_data.get('recent_product_ids', [])),
+        user_id
+    )
+
+
+def _row_to_product(row: Dict) -> Product:
+    """
+    Hydrate a Product from a products table row. Rows were validated when
+    the product was inserted, so construct without re-validating.
+    """
+    attributes = orjson.loads(row['attributes']) if row['attributes'] else {}
+    return Product.model_construct(
+        id=row['id'],
+        title=row['title'],
+        description=row['description'],
+        category=row['category'],
+        price=row['price'],
+        rating=row['rating'],
+        attributes=ProductAttributes.model_construct(**attributes),
+        image_url=row['image_url'],
+        created_at=row['created_at']
+    )
+
+
+class UnitOfWork:
+    """
+    Writes that share one connection and commit together; obtained from
+    MySQLDB.unit_of_work(). Method names mirror MySQLDB so callers can take
+    either as their writer.
+    """
+    
+    def __init__(self, db: "MySQLDB", cursor):
+        self._db = db
+        self._cursor = cursor
+        self.touched_profiles: List[str] = []
+    
+    async def insert_behavior_event(
+        self,
+        event_id: str,
+        event_type: str,
+        user_id: Optional[str],
+        session_id: str,
+        product_id: Optional[str],
+        query: Optional[str],
+        timestamp: datetime,
+        dwell_time: Optional[float],
+        metadata: Optional[Dict] = None
+    ):
+        """Record a raw behavior event"""
+        await self._cursor.execute(INSERT_BEHAVIOR_EVENT_SQL, (
+            event_id, event_type, user_id, session_id, product_id, query,
+            timestamp, dwell_time, _dumps(metadata) if metadata else None
+        ))
+    
+    async def insert_behavior_events(self, events: List[tuple]):
+        """
+        Record several raw behavior events, each a tuple in
+        insert_behavior_event's argument order (one multi-row INSERT)
+        """
+        if not events:
+            return
+        await self._cursor.executemany(INSERT_BEHAVIOR_EVENT_SQL, [
+            (*event[:8], _dumps(event[8]) if event[8] else None)
+            for event in events
+        ])
+    
+    async def get_user_profile(self, user_id: str) -> Optional[Dict]:
+        """Get user profile by user_id, including this unit's uncommitted writes"""
+        await self._cursor.execute(GET_USER_PROFILE_SQL, (user_id,))
+        row = await self._cursor.fetchone()
+        if not row:
+            return None
+        return dict(zip((column[0] for column in self._cursor.description), row))
+    
+    async def create_user_profile(self, user_id: str):
+        """Create a new user profile"""
+        self.touched_profiles.append(user_id)
+        await self._cursor.execute("""
+            INSERT IGNORE INTO user_profiles (
+                user_id, preferred_categories, preferred_brands,
+                search_history, recent_product_ids
+            ) VALUES (%s, %s, %s, %s, %s)
+        """, (user_id, _dumps({}), _dumps({}), _dumps([]), _dumps([])))
+    
+    async def add_user_interaction(
+        self,
+        user_id: str,
+        product_id: str,
+        interaction_type: str,
+        category: Optional[str] = None,
+        brand: Optional[str] = None,
+        metadata: Optional[Dict] = None
+    ):
+        """Add a user interaction record"""
+        await self._cursor.execute(INSERT_USER_INTERACTION_SQL, (
+            user_id, product_id, interaction_type, category, brand,
+            _dumps(metadata) if metadata else None
+        ))
+    
+    async def update_user_profile(self, user_id: str, profile_data: Dict):
+        """Update user profile"""
+        self.touched_profiles.append(user_id)
+        await self._cursor.execute(UPDATE_USER_PROFILE_SQL, _profile_params(user_id, profile_data))
+    
+    async def record_search(self, user_id: str, query: str):
+        """Add a query to the user's search history"""
+        self.touched_profiles.append(user_id)
+        await self._cursor.execute(RECORD_SEARCH_SQL, (user_id, query, query, query))
+    
+    async def bump_behavior_metrics(self, product_id: str, deltas: Dict):
+        """Counter deltas stay on MySQLDB's coalesced flush"""
+        await self._db.bump_behavior_metrics(product_id, deltas)
 
 
 class MySQLDB:
@@ -14,34 +385,322 @@ class MySQLDB:
     
     def __init__(self):
         self.pool: Optional[aiomysql.Pool] = None
+        self.autocommit_pool: Optional[aiomysql.Pool] = None
+        
+        # Write coalescing for high-rate telemetry: rows buffered here are
+        # flushed together as one multi-row statement and a single commit
+        self._pending_events: List[tuple] = []
+        self._pending_interactions: List[tuple] = []
+        self._pending_metric_deltas: Dict[str, Dict] = {}  # product_id -> summed counter deltas
+        self._pending_query_deltas: Dict[Tuple[str, date], Dict] = {}  # (query, day) -> summed deltas
+        self._writes_pending = asyncio.Event()
+        self._writes_full = asyncio.Event()
+        self._flush_failures = 0  # Consecutive failed flushes of the requeued rows
+        self._flush_task: Optional[asyncio.Task] = None
+        self._partition_task: Optional[asyncio.Task] = None
+        
+        # Primary-key read caches, invalidated by this process's writes
+        self._product_cache = TTLCache(settings.MYSQL_CACHE_SIZE, settings.MYSQL_CACHE_TTL_SECONDS)
+        self._profile_cache = TTLCache(settings.MYSQL_CACHE_SIZE, settings.MYSQL_CACHE_TTL_SECONDS)
     
     async def connect(self):
-        """Create connection pool"""
-        self.pool = await aiomysql.create_pool(
+        """Create connection pools"""
+        # minsize == maxsize makes create_pool open every connection up front,
+        # so the first burst of requests doesn't pay TCP/auth handshakes.
+        # Transactions (unit_of_work, batch flushes, schema changes) use pool.
+        self.pool = await self._create_pool(settings.MYSQL_TX_POOL_SIZE, autocommit=False)
+        # Reads and single-statement writes run on autocommit connections:
+        # one round trip per write instead of INSERT + COMMIT, and reads never
+        # leave a transaction open (aiomysql closes, rather than reuses, a
+        # connection released mid-transaction)
+        self.autocommit_pool = await self._create_pool(
+            settings.MYSQL_POOL_SIZE, autocommit=True
+        )
+        await self._create_tables()
+        self._flush_task = asyncio.create_task(self._flush_loop())
+        self._partition_task = asyncio.create_task(self._partition_loop())
+    
+    async def _create_pool(self, size: int, autocommit: bool) -> aiomysql.Pool:
+        """Open a fixed-size connection pool"""
+        return await aiomysql.create_pool(
             host=settings.MYSQL_HOST,
             port=settings.MYSQL_PORT,
+            unix_socket=_local_socket_path(),
             user=settings.MYSQL_USER,
             password=settings.MYSQL_PASSWORD,
             db=settings.MYSQL_DB,
-            minsize=5,
-            maxsize=20,
+            minsize=size,
+            maxsize=size,
+            pool_recycle=settings.MYSQL_POOL_RECYCLE,
+            connect_timeout=settings.MYSQL_CONNECT_TIMEOUT,
+            # aiomysql speaks only the text protocol (no COM_STMT_PREPARE), so
+            # parameters are always escaped client-side; the high-rate writers
+            # go through the coalesced multi-row flush to keep that cost per batch
             charset='utf8mb4',
-            autocommit=False
+            use_unicode=True,
+            conv=DECODERS,
+            autocommit=autocommit,
+            # The transactional pool pipelines "stmt; stmt; COMMIT" in one call
+            client_flag=0 if autocommit else CLIENT.MULTI_STATEMENTS
         )
-        await self._create_tables()
     
     async def disconnect(self):
-        """Close connection pool"""
+        """Close connection pools"""
+        if self._partition_task:
+            self._partition_task.cancel()
+            self._partition_task = None
+        if self._flush_task:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
         if self.pool:
+            await self._flush_writes()
             self.pool.close()
             await self.pool.wait_closed()
+        if self.autocommit_pool:
+            self.autocommit_pool.close()
+            await self.autocommit_pool.wait_closed()
+    
+    def pool_stats(self) -> Dict[str, int]:
+        """Current request pool occupancy, for backpressure decisions and health checks"""
+        pool = self.autocommit_pool
+        if not pool:
+            return {"size": 0, "free": 0, "in_use": 0, "max": 0}
+        return {
+            "size": pool.size,
+            "free": pool.freesize,
+            "in_use": pool.size - pool.freesize,
+            "max": pool.maxsize
+        }
+    
+    async def _flush_loop(self):
+        """Background task: flush buffered writes after a short coalescing window"""
+        wait = settings.MYSQL_WRITE_BATCH_WAIT_MS / 1000
+        while True:
+            await self._writes_pending.wait()
+            try:
+                # Flush early if a buffer fills up before the window closes
+                await asyncio.wait_for(self._writes_full.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+            self._writes_pending.clear()
+            self._writes_full.clear()
+            await self._flush_writes()
+    
+    def _signal_write(self, buffered: int):
+        """Wake the flusher, early if the buffer reached the batch size"""
+        self._writes_pending.set()
+        if buffered >= settings.MYSQL_WRITE_BATCH_MAX_ROWS:
+            self._writes_full.set()
+    
+    async def _flush_writes(self):
+        """Write all buffered events, interactions and metrics in one transaction"""
+        events, self._pending_events = self._pending_events, []
+        interactions, self._pending_interactions = self._pending_interactions, []
+        metric_deltas, self._pending_metric_deltas = self._pending_metric_deltas, {}
+        query_deltas, self._pending_query_deltas = self._pending_query_deltas, {}
+        if not events and not interactions and not metric_deltas and not query_deltas:
+            return
+        
+        max_rows = settings.MYSQL_WRITE_BATCH_MAX_ROWS
+        # Statements and parameters per table, so a failed pipelined flush
+        # can be retried (and requeued) table by table
+        groups = {table: ([], []) for table in BUFFERED_WRITE_TABLES}
+        statements, params = groups['behavior_events']
+        for start in range(0, len(events), max_rows):
+            chunk = events[start:start + max_rows]
+            placeholders = ",".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s)"] * len(chunk))
+            statements.append(f"""
+                INSERT INTO behavior_events (
+                    event_id, event_type, user_id, session_id,
+                    product_id, query, timestamp, dwell_time, metadata
+                ) VALUES {placeholders}
+            """)
+            params.extend(itertools.chain.from_iterable(chunk))
+        statements, params = groups['user_interactions']
+        for start in range(0, len(interactions), max_rows):
+            chunk = interactions[start:start + max_rows]
+            placeholders = ",".join(["(%s, %s, %s, %s, %s, %s)"] * len(chunk))
+            statements.append(f"""
+                INSERT INTO user_interactions (
+                    user_id, product_id, interaction_type,
+                    category, brand, metadata
+                ) VALUES {placeholders}
+            """)
+            params.extend(itertools.chain.from_iterable(chunk))
+        
+        # Joined against products so deltas for unknown product ids (events
+        # accept any id) are skipped instead of failing the foreign key
+        metric_rows = [
+            (product_id, *(d[c] for c in METRIC_COUNTERS))
+            for product_id, d in metric_deltas.items()
+        ]
+        statements, params = groups['product_behavior_metrics']
+        for start in range(0, len(metric_rows), max_rows):
+            chunk = metric_rows[start:start + max_rows]
+            placeholders = ",".join(["ROW(%s, %s, %s, %s, %s, %s, %s)"] * len(chunk))
+            statements.append(f"""
+                INSERT INTO product_behavior_metrics (
+                    product_id, total_clicks, total_searches, total_carts,
+                    total_purchases, total_bounces, total_dwell_time
+                )
+                SELECT d.product_id, d.total_clicks, d.total_searches, d.total_carts,
+                       d.total_purchases, d.total_bounces, d.total_dwell_time
+                FROM (VALUES {placeholders}) AS d (
+                    product_id, total_clicks, total_searches, total_carts,
+                    total_purchases, total_bounces, total_dwell_time
+                )
+                JOIN products p ON p.id = d.product_id
+                ON DUPLICATE KEY UPDATE
+                    total_clicks = product_behavior_metrics.total_clicks + d.total_clicks,
+                    total_searches = product_behavior_metrics.total_searches + d.total_searches,
+                    total_carts = product_behavior_metrics.total_carts + d.total_carts,
+                    total_purchases = product_behavior_metrics.total_purchases + d.total_purchases,
+                    total_bounces = product_behavior_metrics.total_bounces + d.total_bounces,
+                    total_dwell_time = product_behavior_metrics.total_dwell_time + d.total_dwell_time,
+                    last_updated = CURRENT_TIMESTAMP
+            """)
+            params.extend(itertools.chain.from_iterable(chunk))
+        
+        query_rows = [
+            (query, day, *(d[c] for c in QUERY_ROLLUP_COUNTERS), d['first_seen'], d['last_seen'])
+            for (query, day), d in query_deltas.items()
+        ]
+        statements, params = groups['query_metrics_rollup']
+        for start in range(0, len(query_rows), max_rows):
+            chunk = query_rows[start:start + max_rows]
+            placeholders = ",".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"] * len(chunk))
+            statements.append(f"""
+                INSERT INTO query_metrics_rollup (
+                    query, day, search_count, click_count, cart_count,
+                    purchase_count, total_dwell, dwell_count, first_seen, last_seen
+                ) VALUES {placeholders} AS new
+                ON DUPLICATE KEY UPDATE
+                    search_count = search_count + new.search_count,
+                    click_count = click_count + new.click_count,
+                    cart_count = cart_count + new.cart_count,
+                    purchase_count = purchase_count + new.purchase_count,
+                    total_dwell = total_dwell + new.total_dwell,
+                    dwell_count = dwell_count + new.dwell_count,
+                    first_seen = COALESCE(LEAST(first_seen, new.first_seen), first_seen, new.first_seen),
+                    last_seen = COALESCE(GREATEST(last_seen, new.last_seen), last_seen, new.last_seen)
+            """)
+            params.extend(itertools.chain.from_iterable(chunk))
+        requeue = {
+            'behavior_events': (events, [], {}, {}),
+            'user_interactions': ([], interactions, {}, {}),
+            'product_behavior_metrics': ([], [], metric_deltas, {}),
+            'query_metrics_rollup': ([], [], {}, query_deltas),
+        }
+        row_counts = {
+            'behavior_events': len(events),
+            'user_interactions': len(interactions),
+            'product_behavior_metrics': len(metric_rows),
+            'query_metrics_rollup': len(query_rows),
+        }
+        groups = {table: group for table, group in groups.items() if group[0]}
+        
+        try:
+            # All inserts and the COMMIT go out in one packet / round trip
+            await self._execute_pipelined(
+                [stmt for stmts, _ in groups.values() for stmt in stmts],
+                [param for _, group_params in groups.values() for param in group_params]
+            )
+            self._flush_failures = 0
+            return
+        except Exception as e:
+            logger.warning(
+                f"Flushing {sum(row_counts.values())} buffered rows failed, "
+                f"retrying per table: {e}"
+            )
+        
+        # One transaction per table, so a failing table (e.g. a constraint
+        # error) cannot roll back the others' rows
+        failed = []
+        for table, (stmts, group_params) in groups.items():
+            try:
+                await self._execute_pipelined(stmts, group_params)
+            except Exception as e:
+                failed.append(table)
+                logger.warning(f"Flushing {row_counts[table]} buffered {table} rows failed: {e}")
+        if not failed:
+            self._flush_failures = 0
+            return
+        self._flush_failures += 1
+        if self._flush_failures > settings.MYSQL_WRITE_MAX_RETRIES:
+            self._flush_failures = 0
+            logger.error(
+                f"Dropping {sum(row_counts[t] for t in failed)} buffered rows "
+                f"({', '.join(failed)}) after repeated flush failures"
+            )
+            return
+        for table in failed:
+            self._requeue_writes(*requeue[table])
+    
+    async def _execute_pipelined(self, statements: List[str], params: List):
+        """Run the statements and a COMMIT as one multi-statement round trip"""
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(";".join(statements + ["COMMIT"]), params)
+                while await cursor.nextset():
+                    pass
+    
+    def _requeue_writes(
+        self,
+        events: List[tuple],
+        interactions: List[tuple],
+        metric_deltas: Dict[str, Dict],
+        query_deltas: Dict[Tuple[str, date], Dict]
+    ):
+        """Merge rows from a failed flush back into the buffers, ahead of newer writes"""
+        self._pending_events[:0] = events
+        self._pending_interactions[:0] = interactions
+        for product_id, deltas in metric_deltas.items():
+            pending = self._pending_metric_deltas.get(product_id)
+            if pending is None:
+                self._pending_metric_deltas[product_id] = deltas
+                continue
+            for counter in METRIC_COUNTERS:
+                pending[counter] += deltas[counter]
+        for key, deltas in query_deltas.items():
+            pending = self._pending_query_deltas.get(key)
+            if pending is None:
+                self._pending_query_deltas[key] = deltas
+                continue
+            for counter in QUERY_ROLLUP_COUNTERS:
+                pending[counter] += deltas[counter]
+            pending['first_seen'] = min(
+                (t for t in (pending['first_seen'], deltas['first_seen']) if t is not None),
+                default=None
+            )
+            pending['last_seen'] = max(
+                (t for t in (pending['last_seen'], deltas['last_seen']) if t is not None),
+                default=None
+            )
+        self._writes_pending.set()
     
     async def _create_tables(self):
         """Create necessary tables"""
+        # Event tables are range-partitioned by month on timestamp (primary
+        # keys include timestamp, as partitioning requires)
+        if await self._schema_version() == SCHEMA_VERSION:
+            return
+        
+        partitions = _partition_clause(_partition_bounds())
         async with self.pool.acquire() as conn:
             async with conn.cursor() as cursor:
-                # Products table
                 await cursor.execute("""
+                    SELECT 1 FROM information_schema.tables
+                    WHERE table_schema = DATABASE() AND table_name = 'query_metrics_rollup'
+                """)
+                rollup_exists = await cursor.fetchone() is not None
+                
+                ddl = []
+                # Products table
+                ddl.append("""
                     CREATE TABLE IF NOT EXISTS products (
                         id VARCHAR(255) PRIMARY KEY,
                         title VARCHAR(500) NOT NULL,
@@ -52,14 +711,17 @@ class MySQLDB:
                         attributes JSON,
                         image_url VARCHAR(500),
                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        brand VARCHAR(255) {brand},
                         INDEX idx_category (category),
                         INDEX idx_price (price),
-                        INDEX idx_rating (rating)
-                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-                """)
+                        INDEX idx_rating (rating),
+                        INDEX idx_brand (brand),
+                        INDEX idx_cat_rating_price (category, rating, price)
+                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci ROW_FORMAT=DYNAMIC
+                """.format(brand=PRODUCT_BRAND_COLUMN))
                 
-                # Behavior metrics table
-                await cursor.execute("""
+                # Behavior metrics table (ratios are derived from the counters by MySQL)
+                ddl.append("""
                     CREATE TABLE IF NOT EXISTS product_behavior_metrics (
                         product_id VARCHAR(255) PRIMARY KEY,
                         total_clicks INT DEFAULT 0,
@@ -68,36 +730,39 @@ class MySQLDB:
                         total_purchases INT DEFAULT 0,
                         total_bounces INT DEFAULT 0,
                         total_dwell_time DECIMAL(10, 2) DEFAULT 0.0,
-                        avg_dwell_time DECIMAL(10, 2) DEFAULT 0.0,
-                        ctr DECIMAL(5, 4) DEFAULT 0.0,
-                        conversion_rate DECIMAL(5, 4) DEFAULT 0.0,
-                        bounce_rate DECIMAL(5, 4) DEFAULT 0.0,
+                        avg_dwell_time DECIMAL(10, 2) {avg_dwell_time},
+                        ctr DECIMAL(5, 4) {ctr},
+                        conversion_rate DECIMAL(5, 4) {conversion_rate},
+                        bounce_rate DECIMAL(5, 4) {bounce_rate},
                         last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
                         FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE
-                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-                """)
+                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci ROW_FORMAT=DYNAMIC
+                """.format(**DERIVED_METRIC_COLUMNS))
                 
                 # Behavior events table
-                await cursor.execute("""
+                ddl.append("""
                     CREATE TABLE IF NOT EXISTS behavior_events (
-                        event_id VARCHAR(255) PRIMARY KEY,
+                        event_id VARCHAR(255) NOT NULL,
                         event_type VARCHAR(50) NOT NULL,
                         user_id VARCHAR(255),
                         session_id VARCHAR(255) NOT NULL,
                         product_id VARCHAR(255),
                         query TEXT,
-                        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
                         dwell_time DECIMAL(10, 2),
                         metadata JSON,
-                        INDEX idx_product_id (product_id),
+                        PRIMARY KEY (event_id, timestamp),
+                        INDEX idx_product_etype (product_id, event_type),
                         INDEX idx_event_type (event_type),
-                        INDEX idx_timestamp (timestamp),
-                        INDEX idx_session_id (session_id)
-                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-                """)
+                        INDEX idx_ts_etype (timestamp, event_type),
+                        INDEX idx_session_id (session_id),
+                        INDEX idx_user_etype_ts (user_id, event_type, timestamp DESC)
+                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci ROW_FORMAT=DYNAMIC
+                    {partitions}
+                """.format(partitions=partitions))
                 
                 # User profiles table (for personalization)
-                await cursor.execute("""
+                ddl.append("""
                     CREATE TABLE IF NOT EXISTS user_profiles (
                         user_id VARCHAR(255) PRIMARY KEY,
                         preferred_categories JSON,
@@ -112,32 +777,214 @@ class MySQLDB:
                         last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
                         INDEX idx_user_id (user_id),
                         INDEX idx_last_updated (last_updated)
-                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci ROW_FORMAT=DYNAMIC
                 """)
                 
                 # User interactions table (for detailed tracking)
-                await cursor.execute("""
+                ddl.append("""
                     CREATE TABLE IF NOT EXISTS user_interactions (
-                        id INT AUTO_INCREMENT PRIMARY KEY,
+                        id INT AUTO_INCREMENT,
                         user_id VARCHAR(255) NOT NULL,
                         product_id VARCHAR(255) NOT NULL,
                         interaction_type VARCHAR(50) NOT NULL,
                         category VARCHAR(255),
                         brand VARCHAR(255),
-                        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
                         metadata JSON,
+                        PRIMARY KEY (id, timestamp),
                         INDEX idx_user_id (user_id),
                         INDEX idx_product_id (product_id),
                         INDEX idx_timestamp (timestamp),
-                        INDEX idx_interaction_type (interaction_type)
-                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+                        INDEX idx_interaction_type (interaction_type),
+                        INDEX idx_user_itype_ts (user_id, interaction_type, timestamp DESC)
+                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci ROW_FORMAT=DYNAMIC
+                    {partitions}
+                """.format(partitions=partitions))
+                
+                # Per-query, per-day analytics counters, maintained incrementally
+                # by bump_query_metrics
+                ddl.append(f"""
+                    CREATE TABLE IF NOT EXISTS query_metrics_rollup (
+                        query VARCHAR({ROLLUP_QUERY_MAX_LENGTH}) NOT NULL,
+                        day DATE NOT NULL,
+                        search_count BIGINT NOT NULL DEFAULT 0,
+                        click_count BIGINT NOT NULL DEFAULT 0,
+                        cart_count BIGINT NOT NULL DEFAULT 0,
+                        purchase_count BIGINT NOT NULL DEFAULT 0,
+                        total_dwell DOUBLE NOT NULL DEFAULT 0,
+                        dwell_count BIGINT NOT NULL DEFAULT 0,
+                        first_seen TIMESTAMP NULL,
+                        last_seen TIMESTAMP NULL,
+                        PRIMARY KEY (query, day),
+                        INDEX idx_day (day)
+                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci ROW_FORMAT=DYNAMIC
                 """)
                 
+                # All CREATE TABLEs go out in one multi-statement round trip
+                await cursor.execute(";".join(ddl))
+                while await cursor.nextset():
+                    pass
+                
+                # Indexes added after the initial schema; CREATE TABLE IF NOT EXISTS
+                # does not touch tables that already exist, so add them explicitly
+                await self._ensure_index(
+                    cursor, "behavior_events", "idx_user_etype_ts",
+                    "(user_id, event_type, timestamp DESC)"
+                )
+                # Cover the analytics scans (time-bucketed counts, per-product
+                # counts) so they read narrow index entries instead of full
+                # rows carrying query TEXT and metadata JSON
+                await self._ensure_index(
+                    cursor, "behavior_events", "idx_ts_etype", "(timestamp, event_type)"
+                )
+                await self._ensure_index(
+                    cursor, "behavior_events", "idx_product_etype", "(product_id, event_type)"
+                )
+                await self._ensure_index(
+                    cursor, "user_interactions", "idx_user_itype_ts",
+                    "(user_id, interaction_type, timestamp DESC)"
+                )
+                
+                await self._ensure_column(cursor, "products", "brand", f"VARCHAR(255) {PRODUCT_BRAND_COLUMN}")
+                await self._ensure_index(cursor, "products", "idx_brand", "(brand)")
+                await self._ensure_index(
+                    cursor, "products", "idx_cat_rating_price", "(category, rating, price)"
+                )
+                
+                if not rollup_exists:
+                    await cursor.execute(QUERY_ROLLUP_BACKFILL_SQL)
+                
+                # Older schemas stored the ratios as plain columns written by the app
+                for column, definition in DERIVED_METRIC_COLUMNS.items():
+                    await self._ensure_generated_column(
+                        cursor, "product_behavior_metrics", column,
+                        DERIVED_METRIC_TYPES[column], definition
+                    )
+                
+                await cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_versions (
+                        id TINYINT PRIMARY KEY,
+                        version INT NOT NULL
+                    ) ENGINE=InnoDB
+                """)
+                await cursor.execute("""
+                    INSERT INTO schema_versions (id, version) VALUES (1, %s) AS new
+                    ON DUPLICATE KEY UPDATE version = new.version
+                """, (SCHEMA_VERSION,))
                 await conn.commit()
     
+    async def _schema_version(self) -> int:
+        """Schema version recorded by the last _create_tables run, 0 if none"""
+        async with self.autocommit_pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                try:
+                    await cursor.execute("SELECT version FROM schema_versions LIMIT 1")
+                except ProgrammingError:
+                    return 0  # schema_versions does not exist yet
+                row = await cursor.fetchone()
+                return row[0] if row else 0
+    
+    async def _ensure_generated_column(
+        self, cursor, table: str, column: str, column_type: str, definition: str
+    ):
+        """Convert an existing plain column into a stored generated column"""
+        await cursor.execute("""
+            SELECT extra FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+        """, (table, column))
+        row = await cursor.fetchone()
+        if row and 'GENERATED' not in (row[0] or '').upper():
+            await cursor.execute(f"ALTER TABLE {table} MODIFY COLUMN {column} {column_type} {definition}")
+    
+    async def _ensure_time_partitions(self, cursor, table: str):
+        """Split upcoming months out of the catch-all partition of a partitioned table"""
+        await cursor.execute("""
+            SELECT partition_name FROM information_schema.partitions
+            WHERE table_schema = DATABASE() AND table_name = %s AND partition_name IS NOT NULL
+        """, (table,))
+        existing = {row[0] for row in await cursor.fetchall()}
+        if not existing:
+            return  # Created before partitioning was introduced; left as is
+        missing = [b for b in _partition_bounds() if _partition_name(b) not in existing]
+        if missing:
+            await cursor.execute(
+                f"ALTER TABLE {table} REORGANIZE PARTITION pmax INTO "
+                f"{_partition_list(missing)}"
+            )
+    
+    async def maintain_partitions(self):
+        """Roll monthly partitions forward; safe to call repeatedly"""
+        async with self.autocommit_pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                for table in TIME_PARTITIONED_TABLES:
+                    await self._ensure_time_partitions(cursor, table)
+    
+    async def _partition_loop(self):
+        """Background task: keep partitions created ahead of incoming data"""
+        while True:
+            try:
+                await self.maintain_partitions()
+            except Exception as e:
+                print(f"Error maintaining partitions: {e}")
+            await asyncio.sleep(PARTITION_MAINTENANCE_INTERVAL)
+    
+    async def _ensure_column(self, cursor, table: str, column: str, definition: str):
+        """Add a column to an existing table if it is missing"""
+        await cursor.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+            LIMIT 1
+        """, (table, column))
+        if not await cursor.fetchone():
+            await cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    
+    async def _ensure_index(self, cursor, table: str, index_name: str, columns: str):
+        """Create an index on an existing table if it is missing"""
+        await cursor.execute("""
+            SELECT 1 FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+            LIMIT 1
+        """, (table, index_name))
+        if not await cursor.fetchone():
+            await cursor.execute(f"ALTER TABLE {table} ADD INDEX {index_name} {columns}")
+    
+    @asynccontextmanager
+    async def unit_of_work(self) -> AsyncIterator[UnitOfWork]:
+        """
+        Run several writes on one connection with a single COMMIT, e.g.
+        event + interaction + profile for one click. Rolled back on error.
+        """
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                uow = UnitOfWork(self, cursor)
+                try:
+                    yield uow
+                    await conn.commit()
+                except BaseException:
+                    await conn.rollback()
+                    raise
+                finally:
+                    # Also drop entries re-cached by reads that ran before the commit
+                    for user_id in uow.touched_profiles:
+                        self._profile_cache.pop(user_id)
+    
+    async def _fetch_one(self, sql: str, params: tuple) -> Optional[Dict]:
+        """
+        Run a primary-key lookup on the connection's persistent DictCursor.
+        Buffered cursors read the whole result on execute, so reusing one
+        across calls leaves no state behind.
+        """
+        async with self.autocommit_pool.acquire() as conn:
+            cursor = getattr(conn, '_dict_cursor', None)
+            if cursor is None:
+                cursor = conn._dict_cursor = await conn.cursor(aiomysql.DictCursor)
+            await cursor.execute(sql, params)
+            return await cursor.fetchone()
+    
     async def insert_product(self, product: Product) -> bool:
         """Insert or update a product"""
-        async with self.pool.acquire() as conn:
+        self._product_cache.pop(product.id)
+        async with self.autocommit_pool.acquire() as conn:
             async with conn.cursor() as cursor:
                 await cursor.execute("""
                     INSERT INTO products (id, title, description, category, price, rating, attributes, image_url, created_at)
@@ -152,72 +999,155 @@ class MySQLDB:
                         image_url = new.image_url
                 """, (
                     product.id, product.title, product.description, product.category,
-                    product.price, product.rating, json.dumps(product.attributes.dict()),
+                    product.price, product.rating, _dumps(product.attributes.model_dump()),
                     product.image_url, product.created_at
                 ))
-                await conn.commit()
                 return True
     
+    async def insert_products_bulk(
+        self,
+        products: List[Product],
+        chunk_size: int = BULK_INSERT_CHUNK_SIZE
+    ) -> int:
+        """Insert or update many products with multi-row INSERT statements in one transaction"""
+        if not products:
+            return 0
+        
+        for product in products:
+            self._product_cache.pop(product.id)
+        rows = [
+            (
+                product.id, product.title, product.description, product.category,
+                product.price, product.rating, _dumps(product.attributes.model_dump()),
+                product.image_url, product.created_at
+            )
+            for product in products
+        ]
+        
+        # Split into statements bounded by both row count and estimated packet size
+        chunks = []
+        chunk, chunk_bytes = [], 0
+        for row in rows:
+            row_bytes = sum(len(str(v)) for v in row if v is not None) + 64
+            if chunk and (len(chunk) >= chunk_size or chunk_bytes + row_bytes > BULK_INSERT_MAX_BYTES):
+                chunks.append(chunk)
+                chunk, chunk_bytes = [], 0
+            chunk.append(row)
+            chunk_bytes += row_bytes
+        chunks.append(chunk)
+        
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                for chunk in chunks:
+                    placeholders = ",".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s)"] * len(chunk))
+                    await cursor.execute(f"""
+                        INSERT INTO products (id, title, description, category, price, rating, attributes, image_url, created_at)
+                        VALUES {placeholders} AS new
+                        ON DUPLICATE KEY UPDATE
+                            title = new.title,
+                            description = new.description,
+                            category = new.category,
+                            price = new.price,
+                            rating = new.rating,
+                            attributes = new.attributes,
+                            image_url = new.image_url
+                    """, list(itertools.chain.from_iterable(chunk)))
+                await conn.commit()
+        return len(rows)
+    
     async def get_product(self, product_id: str) -> Optional[Product]:
         """Get a product by ID"""
-        async with self.pool.acquire() as conn:
-            async with conn.cursor(aiomysql.DictCursor) as cursor:
+        # The cached instance is never handed out, so callers that modify
+        # their copy cannot change what later readers see
+        product = self._product_cache.get(product_id)
+        if product is not None:
+            return product.model_copy(deep=True)
+        row = await self._fetch_one(GET_PRODUCT_SQL, (product_id,))
+        if row:
+            product = _row_to_product(row)
+            self._product_cache.put(product_id, product)
+            return product.model_copy(deep=True)
+        return None
+    
+    async def iter_products_by_ids(self, product_ids: List[str]) -> AsyncIterator[Product]:
+        """Stream products by IDs from a server-side cursor, one row at a time"""
+        if not product_ids:
+            return
+        
+        async with self.autocommit_pool.acquire() as conn:
+            async with conn.cursor(aiomysql.SSDictCursor) as cursor:
+                placeholders = ','.join(['%s'] * len(product_ids))
                 await cursor.execute(
-                    "SELECT * FROM products WHERE id = %s", (product_id,)
+                    f"SELECT {PRODUCT_COLUMNS} FROM products WHERE id IN ({placeholders})",
+                    product_ids
                 )
-                row = await cursor.fetchone()
-                if row:
-                    attributes = json.loads(row['attributes']) if row['attributes'] else {}
-                    return Product(
-                        id=row['id'],
-                        title=row['title'],
-                        description=row['description'],
-                        category=row['category'],
-                        price=float(row['price']),
-                        rating=float(row['rating']),
-                        attributes=attributes,
-                        image_url=row['image_url'],
-                        created_at=row['created_at']
-                    )
-                return None
+                while True:
+                    row = await cursor.fetchone()
+                    if row is None:
+                        break
+                    yield _row_to_product(row)
     
     async def get_products_by_ids(self, product_ids: List[str]) -> List[Product]:
         """Get multiple products by IDs"""
+        return [product async for product in self.iter_products_by_ids(product_ids)]
+    
+    async def get_products_with_metrics(
+        self, product_ids: List[str]
+    ) -> List[Tuple[Product, Optional[Dict]]]:
+        """
+        Get products and their behavior metrics in one JOINed query.
+        Metrics are None for products with no recorded behavior.
+        """
         if not product_ids:
             return []
         
-        async with self.pool.acquire() as conn:
+        async with self.autocommit_pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                placeholders = ','.join(['%s'] * len(product_ids))
+                await cursor.execute(f"""
+                    SELECT {PRODUCT_WITH_METRICS_COLUMNS}
+                    FROM products p
+                    LEFT JOIN product_behavior_metrics m ON m.product_id = p.id
+                    WHERE p.id IN ({placeholders})
+                """, product_ids)
+                rows = await cursor.fetchall()
+        
+        metric_columns = BEHAVIOR_METRICS_COLUMNS.split(", ")
+        return [
+            (
+                _row_to_product(row),
+                {c: row[c] for c in metric_columns} if row['product_id'] is not None else None
+            )
+            for row in rows
+        ]
+    
+    async def get_product_lite(self, product_id: str) -> Optional[Dict]:
+        """Get the listing fields (id, title, price, image_url) of a product"""
+        return await self._fetch_one(GET_PRODUCT_LITE_SQL, (product_id,))
+    
+    async def get_products_lite_by_ids(self, product_ids: List[str]) -> List[Dict]:
+        """Get the listing fields of multiple products by IDs"""
+        if not product_ids:
+            return []
+        
+        async with self.autocommit_pool.acquire() as conn:
             async with conn.cursor(aiomysql.DictCursor) as cursor:
                 placeholders = ','.join(['%s'] * len(product_ids))
                 await cursor.execute(
-                    f"SELECT * FROM products WHERE id IN ({placeholders})",
+                    f"SELECT {PRODUCT_LITE_COLUMNS} FROM products WHERE id IN ({placeholders})",
                     product_ids
                 )
-                rows = await cursor.fetchall()
-                products = []
-                for row in rows:
-                    attributes = json.loads(row['attributes']) if row['attributes'] else {}
-                    products.append(Product(
-                        id=row['id'],
-                        title=row['title'],
-                        description=row['description'],
-                        category=row['category'],
-                        price=float(row['price']),
-                        rating=float(row['rating']),
-                        attributes=attributes,
-                        image_url=row['image_url'],
-                        created_at=row['created_at']
-                    ))
-                return products
+                return await cursor.fetchall()
     
-    async def filter_products(
-        self,
-        category: Optional[str] = None,
-        min_price: Optional[float] = None,
-        max_price: Optional[float] = None,
-        min_rating: Optional[float] = None
-    ) -> List[str]:
-        """Filter products and return IDs"""
+    @staticmethod
+    def _filter_conditions(
+        category: Optional[str],
+        min_price: Optional[float],
+        max_price: Optional[float],
+        min_rating: Optional[float],
+        brand: Optional[str]
+    ) -> Tuple[List[str], List]:
+        """Build WHERE conditions in idx_cat_rating_price column order"""
         conditions = []
         params = []
         
@@ -225,6 +1155,14 @@ class MySQLDB:
             conditions.append("category = %s")
             params.append(category)
         
+        if brand:
+            conditions.append("brand = %s")
+            params.append(brand)
+        
+        if min_rating is not None:
+            conditions.append("rating >= %s")
+            params.append(min_rating)
+        
         if min_price is not None:
             conditions.append("price >= %s")
             params.append(min_price)
@@ -233,44 +1171,70 @@ class MySQLDB:
             conditions.append("price <= %s")
             params.append(max_price)
         
-        if min_rating is not None:
-            conditions.append("rating >= %s")
-            params.append(min_rating)
-        
+        return conditions, params
+    
+    async def filter_products(
+        self,
+        category: Optional[str] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        min_rating: Optional[float] = None,
+        brand: Optional[str] = None,
+        sort_by: Optional[str] = None,
+        limit: Optional[int] = None
+    ) -> List[str]:
+        """
+        Filter products and return IDs.
+        With sort_by (a FILTER_SORT_ORDERS key) and/or limit, ordering and
+        truncation happen in SQL so only the needed ids cross the network.
+        """
+        if sort_by is not None and sort_by not in FILTER_SORT_ORDERS:
+            raise ValueError(f"Unsupported sort_by: {sort_by}")
+        conditions, params = self._filter_conditions(category, min_price, max_price, min_rating, brand)
         where_clause = " AND ".join(conditions) if conditions else "1=1"
         
-        async with self.pool.acquire() as conn:
+        sql = f"SELECT id FROM products WHERE {where_clause}"
+        if sort_by is not None:
+            sql += f" ORDER BY {FILTER_SORT_ORDERS[sort_by]}"
+        if limit is not None:
+            sql += " LIMIT %s"
+            params.append(limit)
+        
+        async with self.autocommit_pool.acquire() as conn:
             async with conn.cursor() as cursor:
-                await cursor.execute(
-                    f"SELECT id FROM products WHERE {where_clause}",
-                    params
-                )
+                await cursor.execute(sql, params)
                 rows = await cursor.fetchall()
                 return [row[0] for row in rows]
     
     async def get_behavior_metrics(self, product_id: str) -> Optional[Dict]:
         """Get behavior metrics for a product"""
-        async with self.pool.acquire() as conn:
+        return await self._fetch_one(GET_BEHAVIOR_METRICS_SQL, (product_id,))
+    
+    async def get_behavior_metrics_bulk(self, product_ids: List[str]) -> Dict[str, Dict]:
+        """Get behavior metrics for many products in one query, keyed by product_id"""
+        if not product_ids:
+            return {}
+        
+        async with self.autocommit_pool.acquire() as conn:
             async with conn.cursor(aiomysql.DictCursor) as cursor:
+                placeholders = ','.join(['%s'] * len(product_ids))
                 await cursor.execute(
-                    "SELECT * FROM product_behavior_metrics WHERE product_id = %s",
-                    (product_id,)
+                    f"SELECT {BEHAVIOR_METRICS_COLUMNS} FROM product_behavior_metrics "
+                    f"WHERE product_id IN ({placeholders})",
+                    product_ids
                 )
-                row = await cursor.fetchone()
-                if row:
-                    return dict(row)
-                return None
+                rows = await cursor.fetchall()
+        return {row['product_id']: row for row in rows}
     
     async def update_behavior_metrics(self, product_id: str, metrics: Dict):
-        """Update behavior metrics for a product"""
-        async with self.pool.acquire() as conn:
+        """Overwrite the behavior counters for a product (ratios are derived by MySQL)"""
+        async with self.autocommit_pool.acquire() as conn:
             async with conn.cursor() as cursor:
                 await cursor.execute("""
                     INSERT INTO product_behavior_metrics (
                         product_id, total_clicks, total_searches, total_carts,
-                        total_purchases, total_bounces, total_dwell_time,
-                        avg_dwell_time, ctr, conversion_rate, bounce_rate
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) AS new
+                        total_purchases, total_bounces, total_dwell_time
+                    ) VALUES (%s, %s, %s, %s, %s, %s, %s) AS new
                     ON DUPLICATE KEY UPDATE
                         total_clicks = new.total_clicks,
                         total_searches = new.total_searches,
@@ -278,34 +1242,68 @@ class MySQLDB:
                         total_purchases = new.total_purchases,
                         total_bounces = new.total_bounces,
                         total_dwell_time = new.total_dwell_time,
-                        avg_dwell_time = new.avg_dwell_time,
-                        ctr = new.ctr,
-                        conversion_rate = new.conversion_rate,
-                        bounce_rate = new.bounce_rate,
                         last_updated = CURRENT_TIMESTAMP
-                """, (
-                    product_id, metrics.get('total_clicks', 0), metrics.get('total_searches', 0),
-                    metrics.get('total_carts', 0), metrics.get('total_purchases', 0),
-                    metrics.get('total_bounces', 0), metrics.get('total_dwell_time', 0.0),
-                    metrics.get('avg_dwell_time', 0.0), metrics.get('ctr', 0.0),
-                    metrics.get('conversion_rate', 0.0), metrics.get('bounce_rate', 0.0)
-                ))
-                await conn.commit()
+                """, (product_id, *(metrics.get(c, 0) for c in METRIC_COUNTERS)))
+    
+    async def bump_behavior_metrics(self, product_id: str, deltas: Dict):
+        """
+        Add counter deltas (e.g. {'total_clicks': 1}) to a product's metrics.
+        Buffered and summed per product, then applied as one incremental upsert.
+        """
+        pending = self._pending_metric_deltas.get(product_id)
+        if pending is None:
+            pending = self._pending_metric_deltas[product_id] = dict.fromkeys(METRIC_COUNTERS, 0)
+        for counter, delta in deltas.items():
+            pending[counter] += delta
+        self._signal_write(len(self._pending_metric_deltas))
+    
+    async def increment_search_counts(self, product_ids: List[str]):
+        """
+        Count one search impression for each product; added to the buffered
+        deltas so a whole result page lands in the next flush's single upsert
+        """
+        for product_id in product_ids:
+            pending = self._pending_metric_deltas.get(product_id)
+            if pending is None:
+                pending = self._pending_metric_deltas[product_id] = dict.fromkeys(METRIC_COUNTERS, 0)
+            pending['total_searches'] += 1
+        self._signal_write(len(self._pending_metric_deltas))
+    
+    async def bump_query_metrics(self, query: str, timestamp: datetime, deltas: Dict):
+        """
+        Add counter deltas (e.g. {'click_count': 1}) to a search query's
+        rollup row for the event's day. Buffered and summed like
+        bump_behavior_metrics; a search_count delta also moves first/last seen.
+        """
+        key = (query[:ROLLUP_QUERY_MAX_LENGTH], timestamp.date())
+        pending = self._pending_query_deltas.get(key)
+        if pending is None:
+            pending = self._pending_query_deltas[key] = dict.fromkeys(QUERY_ROLLUP_COUNTERS, 0)
+            pending['first_seen'] = pending['last_seen'] = None
+        for counter, delta in deltas.items():
+            pending[counter] += delta
+        if deltas.get('search_count'):
+            if pending['first_seen'] is None or timestamp < pending['first_seen']:
+                pending['first_seen'] = timestamp
+            if pending['last_seen'] is None or timestamp > pending['last_seen']:
+                pending['last_seen'] = timestamp
+        self._signal_write(len(self._pending_query_deltas))
     
     async def get_user_profile(self, user_id: str) -> Optional[Dict]:
         """Get user profile by user_id"""
-        async with self.pool.acquire() as conn:
-            async with conn.cursor(aiomysql.DictCursor) as cursor:
-                await cursor.execute(
-                    "SELECT * FROM user_profiles WHERE user_id = %s",
-                    (user_id,)
-                )
-                row = await cursor.fetchone()
-                return dict(row) if row else None
+        profile = self._profile_cache.get(user_id)
+        if profile is not None:
+            return dict(profile)
+        row = await self._fetch_one(GET_USER_PROFILE_SQL, (user_id,))
+        if not row:
+            return None
+        self._profile_cache.put(user_id, row)
+        return dict(row)
     
     async def create_user_profile(self, user_id: str):
         """Create a new user profile"""
-        async with self.pool.acquire() as conn:
+        self._profile_cache.pop(user_id)
+        async with self.autocommit_pool.acquire() as conn:
             async with conn.cursor() as cursor:
                 await cursor.execute("""
                     INSERT INTO user_profiles (
@@ -314,41 +1312,47 @@ class MySQLDB:
                     ) VALUES (%s, %s, %s, %s, %s)
                 """, (
                     user_id,
-                    json.dumps({}),
-                    json.dumps({}),
-                    json.dumps([]),
-                    json.dumps([])
+                    _dumps({}),
+                    _dumps({}),
+                    _dumps([]),
+                    _dumps([])
                 ))
-                await conn.commit()
     
     async def update_user_profile(self, user_id: str, profile_data: Dict):
         """Update user profile"""
-        async with self.pool.acquire() as conn:
+        self._profile_cache.pop(user_id)
+        async with self.autocommit_pool.acquire() as conn:
             async with conn.cursor() as cursor:
-                await cursor.execute("""
-                    UPDATE user_profiles SET
-                        preferred_categories = %s,
-                        preferred_brands = %s,
-                        search_history = %s,
-                        total_searches = %s,
-                        total_clicks = %s,
-                        total_carts = %s,
-                        total_purchases = %s,
-                        recent_product_ids = %s,
-                        last_updated = CURRENT_TIMESTAMP
-                    WHERE user_id = %s
-                """, (
-                    json.dumps(profile_data.get('preferred_categories', {})),
-                    json.dumps(profile_data.get('preferred_brands', {})),
-                    json.dumps(profile_data.get('search_history', [])),
-                    profile_data.get('total_searches', 0),
-                    profile_data.get('total_clicks', 0),
-                    profile_data.get('total_carts', 0),
-                    profile_data.get('total_purchases', 0),
-                    json.dumps(profile_data.get('recent_product_ids', [])),
-                    user_id
-                ))
-                await conn.commit()
+                await cursor.execute(UPDATE_USER_PROFILE_SQL, _profile_params(user_id, profile_data))
+    
+    async def record_search(self, user_id: str, query: str):
+        """
+        Add a query to the user's search history (kept to MAX_SEARCH_HISTORY,
+        newest first) and count the search; applied in place by MySQL
+        """
+        self._profile_cache.pop(user_id)
+        async with self.autocommit_pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(RECORD_SEARCH_SQL, (user_id, query, query, query))
+    
+    async def insert_behavior_event(
+        self,
+        event_id: str,
+        event_type: str,
+        user_id: Optional[str],
+        session_id: str,
+        product_id: Optional[str],
+        query: Optional[str],
+        timestamp: datetime,
+        dwell_time: Optional[float],
+        metadata: Optional[Dict] = None
+    ):
+        """Record a raw behavior event (buffered and written in batches)"""
+        self._pending_events.append((
+            event_id, event_type, user_id, session_id, product_id, query,
+            timestamp, dwell_time, _dumps(metadata) if metadata else None
+        ))
+        self._signal_write(len(self._pending_events))
     
     async def add_user_interaction(
         self,
@@ -359,33 +1363,26 @@ class MySQLDB:
         brand: Optional[str] = None,
         metadata: Optional[Dict] = None
     ):
-        """Add a user interaction record"""
-        async with self.pool.acquire() as conn:
-            async with conn.cursor() as cursor:
-                await cursor.execute("""
-                    INSERT INTO user_interactions (
-                        user_id, product_id, interaction_type,
-                        category, brand, metadata
-                    ) VALUES (%s, %s, %s, %s, %s, %s)
-                """, (
-                    user_id, product_id, interaction_type,
-                    category, brand,
-                    json.dumps(metadata) if metadata else None
-                ))
-                await conn.commit()
+        """Add a user interaction record (buffered and written in batches)"""
+        self._pending_interactions.append((
+            user_id, product_id, interaction_type,
+            category, brand,
+            _dumps(metadata) if metadata else None
+        ))
+        self._signal_write(len(self._pending_interactions))
     
     async def get_user_interactions(
         self,
         user_id: str,
         limit: int = 100,
         interaction_type: Optional[str] = None
-    ) -> List[Dict]:
-        """Get user interactions"""
-        async with self.pool.acquire() as conn:
-            async with conn.cursor(aiomysql.DictCursor) as cursor:
+    ) -> List[Interaction]:
+        """Get user interactions, most recent first"""
+        async with self.autocommit_pool.acquire() as conn:
+            async with conn.cursor() as cursor:
                 if interaction_type:
-                    await cursor.execute("""
-                        SELECT ui.*, p.title as product_title 
+                    await cursor.execute(f"""
+                        SELECT {USER_INTERACTION_COLUMNS}
                         FROM user_interactions ui
                         JOIN products p ON ui.product_id = p.id
                         WHERE ui.user_id = %s AND ui.interaction_type = %s
@@ -393,8 +1390,8 @@ class MySQLDB:
                         LIMIT %s
                     """, (user_id, interaction_type, limit))
                 else:
-                    await cursor.execute("""
-                        SELECT ui.*, p.title as product_title 
+                    await cursor.execute(f"""
+                        SELECT {USER_INTERACTION_COLUMNS}
                         FROM user_interactions ui
                         JOIN products p ON ui.product_id = p.id
                         WHERE ui.user_id = %s
@@ -402,16 +1399,16 @@ class MySQLDB:
                         LIMIT %s
                     """, (user_id, limit))
                 rows = await cursor.fetchall()
-                return rows
+                return [Interaction._make(row) for row in rows]
 
     async def get_recent_searches(
         self,
         user_id: str,
         limit: int = 20
-    ) -> List[Dict]:
-        """Get recent searches with timestamps"""
-        async with self.pool.acquire() as conn:
-            async with conn.cursor(aiomysql.DictCursor) as cursor:
+    ) -> AsyncIterator[Tuple[str, datetime]]:
+        """Stream (query, timestamp) of recent searches, most recent first"""
+        async with self.autocommit_pool.acquire() as conn:
+            async with conn.cursor(aiomysql.SSCursor) as cursor:
                 await cursor.execute("""
                     SELECT query, timestamp 
                     FROM behavior_events
@@ -419,8 +1416,8 @@ class MySQLDB:
                     ORDER BY timestamp DESC
                     LIMIT %s
                 """, (user_id, limit))
-                return await cursor.fetchall()
-                return [dict(row) for row in rows]
+                async for row in cursor:
+                    yield row
 
 
 # Global instance
@@ -1,11 +1,141 @@
 """
 PostgreSQL database connection and operations
 """
+import asyncio
 import asyncpg
-from typing import List, Optional, Dict
+from datetime import datetime
+from typing import List, Optional, Dict, Tuple
 from backend.app.config import settings
 from backend.app.models.product import Product
-import json
+from backend.app.database.cache import TTLCache
+import orjson
+
+# Below this many rows executemany is cheaper than setting up a COPY
+COPY_MIN_ROWS = 100
+
+PRODUCT_COPY_COLUMNS = [
+    'id', 'title', 'description', 'category', 'price',
+    'rating', 'attributes', 'image_url', 'created_at'
+]
+INTERACTION_COPY_COLUMNS = [
+    'user_id', 'product_id', 'interaction_type', 'category', 'brand', 'metadata'
+]
+
+EVENT_COPY_COLUMNS = [
+    'event_id', 'event_type', 'user_id', 'session_id', 'product_id',
+    'query', 'timestamp', 'dwell_time', 'metadata'
+]
+
+UPSERT_PRODUCT_SQL = """
+    INSERT INTO products (id, title, description, category, price, rating, attributes, image_url, created_at)
+    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+    ON CONFLICT (id) DO UPDATE SET
+        title = EXCLUDED.title,
+        description = EXCLUDED.description,
+        category = EXCLUDED.category,
+        price = EXCLUDED.price,
+        rating = EXCLUDED.rating,
+        attributes = EXCLUDED.attributes,
+        image_url = EXCLUDED.image_url
+"""
+INSERT_INTERACTION_SQL = """
+    INSERT INTO user_interactions (
+        user_id, product_id, interaction_type, category, brand, metadata
+    ) VALUES ($1, $2, $3, $4, $5, $6)
+"""
+INSERT_EVENT_SQL = """
+    INSERT INTO behavior_events (
+        event_id, event_type, user_id, session_id, product_id,
+        query, timestamp, dwell_time, metadata
+    ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+"""
+
+# Explicit column lists: only the needed columns are sent and decoded
+PRODUCT_COLUMNS = "id, title, description, category, price, rating, attributes, image_url, created_at"
+PRODUCT_LITE_COLUMNS = "id, title, price, image_url"  # Listing pages
+METRIC_COLUMNS = (
+    'product_id', 'total_clicks', 'total_searches', 'total_carts',
+    'total_purchases', 'total_bounces', 'total_dwell_time',
+    'avg_dwell_time', 'ctr', 'conversion_rate', 'bounce_rate', 'last_updated'
+)
+BEHAVIOR_METRICS_COLUMNS = ", ".join(METRIC_COLUMNS)
+# products LEFT JOIN product_behavior_metrics; column names don't overlap
+PRODUCT_WITH_METRICS_COLUMNS = ", ".join(
+    [f"p.{c}" for c in PRODUCT_COLUMNS.split(", ")]
+    + [f"m.{c}" for c in METRIC_COLUMNS]
+)
+USER_PROFILE_COLUMNS = (
+    "user_id, preferred_categories, preferred_brands, search_history, "
+    "total_searches, total_clicks, total_carts, total_purchases, "
+    "recent_product_ids, created_at, last_updated"
+)
+USER_INTERACTION_COLUMNS = (
+    "id, user_id, product_id, interaction_type, category, brand, timestamp, metadata"
+)
+
+# Allowed filter_products sort keys -> ORDER BY clause (id breaks ties)
+FILTER_SORT_ORDERS = {
+    'rating': 'rating DESC, id DESC',
+    'price': 'price ASC, id ASC',
+    'created_at': 'created_at DESC, id DESC',
+}
+
+# behavior_events is range-partitioned by month on timestamp; partitions are
+# kept PARTITION_MONTHS_AHEAD months ahead by a daily maintenance task
+PARTITION_MONTHS_AHEAD = 3
+PARTITION_MAINTENANCE_INTERVAL = 86400
+
+# Counters bumped in place by bump_behavior_metrics; the ratios are
+# recomputed from the new totals in the same statement
+METRIC_COUNTERS = (
+    'total_clicks', 'total_searches', 'total_carts',
+    'total_purchases', 'total_bounces', 'total_dwell_time'
+)
+_INTERACTIONS_SQL = "NULLIF({total_clicks} + {total_carts} + {total_purchases}, 0)"
+DERIVED_METRIC_SQL = {
+    'avg_dwell_time': "COALESCE({total_dwell_time} / NULLIF({total_clicks}, 0), 0)",
+    'ctr': "LEAST(COALESCE({total_clicks} / NULLIF({total_searches}, 0), 0), 1)",
+    'conversion_rate': f"LEAST(COALESCE({{total_purchases}} / {_INTERACTIONS_SQL}, 0), 1)",
+    'bounce_rate': f"LEAST(COALESCE({{total_bounces}} / {_INTERACTIONS_SQL}, 0), 1)",
+}
+_NEW_TOTALS = {c: f"${i}::numeric" for i, c in enumerate(METRIC_COUNTERS, start=2)}
+_BUMPED_TOTALS = {c: f"(m.{c} + EXCLUDED.{c})::numeric" for c in METRIC_COUNTERS}
+BUMP_BEHAVIOR_METRICS_SQL = f"""
+    INSERT INTO product_behavior_metrics AS m (
+        product_id, {", ".join(METRIC_COUNTERS)}, {", ".join(DERIVED_METRIC_SQL)}
+    ) VALUES (
+        $1, {", ".join(_NEW_TOTALS.values())},
+        {", ".join(expr.format(**_NEW_TOTALS) for expr in DERIVED_METRIC_SQL.values())}
+    )
+    ON CONFLICT (product_id) DO UPDATE SET
+        {", ".join(f"{c} = m.{c} + EXCLUDED.{c}" for c in METRIC_COUNTERS)},
+        {", ".join(f"{c} = {expr.format(**_BUMPED_TOTALS)}" for c, expr in DERIVED_METRIC_SQL.items())},
+        last_updated = NOW()
+"""
+
+PRODUCT_CACHE_SIZE = 50000
+PRODUCT_CACHE_TTL_SECONDS = 60
+
+# Hot single-row statements, prepared once per connection on first use
+PREPARED_STATEMENTS = {
+    'get_product': f"SELECT {PRODUCT_COLUMNS} FROM products WHERE id = $1",
+    'get_product_lite': f"SELECT {PRODUCT_LITE_COLUMNS} FROM products WHERE id = $1",
+    'get_behavior_metrics': f"SELECT {BEHAVIOR_METRICS_COLUMNS} FROM product_behavior_metrics WHERE product_id = $1",
+    'get_user_profile': f"SELECT {USER_PROFILE_COLUMNS} FROM user_profiles WHERE user_id = $1",
+    'create_user_profile': """
+        INSERT INTO user_profiles (user_id)
+        VALUES ($1)
+        ON CONFLICT (user_id) DO NOTHING
+    """,
+}
+
+
+class _PreparedConnection(asyncpg.Connection):
+    """Connection carrying its prepared hot-path statements"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statements: Dict[str, asyncpg.prepared_stmt.PreparedStatement] = {}
 
 
 class PostgresDB:
@@ -13,6 +143,8 @@ class PostgresDB:
     
     def __init__(self):
         self.pool: Optional[asyncpg.Pool] = None
+        self._product_cache = TTLCache(PRODUCT_CACHE_SIZE, PRODUCT_CACHE_TTL_SECONDS)
+        self._partition_task: Optional[asyncio.Task] = None
     
     async def connect(self):
         """Create connection pool"""
@@ -23,12 +155,39 @@ class PostgresDB:
             password=settings.POSTGRES_PASSWORD,
             database=settings.POSTGRES_DB,
             min_size=5,
-            max_size=20
+            max_size=20,
+            connection_class=_PreparedConnection,
+            init=self._init_connection
         )
         await self._create_tables()
+        self._partition_task = asyncio.create_task(self._partition_loop())
+    
+    @staticmethod
+    async def _init_connection(conn: _PreparedConnection):
+        """Exchange JSONB in binary form, (de)serialized by orjson"""
+        # Binary JSONB is a version byte (1) followed by the JSON text
+        await conn.set_type_codec(
+            'jsonb',
+            encoder=lambda value: b'\x01' + orjson.dumps(value),
+            decoder=lambda data: orjson.loads(data[1:]),
+            schema='pg_catalog',
+            format='binary'
+        )
+    
+    @staticmethod
+    async def _statement(conn: _PreparedConnection, name: str) -> asyncpg.prepared_stmt.PreparedStatement:
+        """Prepared statement for `name` on this connection, preparing it on first use"""
+        # Prepared lazily: at pool init the tables may not exist yet
+        stmt = conn.statements.get(name)
+        if stmt is None:
+            stmt = conn.statements[name] = await conn.prepare(PREPARED_STATEMENTS[name])
+        return stmt
     
     async def disconnect(self):
         """Close connection pool"""
+        if self._partition_task:
+            self._partition_task.cancel()
+            self._partition_task = None
         if self.pool:
             await self.pool.close()
     
@@ -54,6 +213,12 @@ class PostgresDB:
             await conn.execute("CREATE INDEX IF NOT EXISTS idx_category ON products(category)")
             await conn.execute("CREATE INDEX IF NOT EXISTS idx_price ON products(price)")
             await conn.execute("CREATE INDEX IF NOT EXISTS idx_rating ON products(rating)")
+            # Category + rating + price filters resolve as one index range scan;
+            # INCLUDE (id) makes it covering for filter_products
+            await conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_products_cat_rating_price
+                ON products(category, rating DESC, price) INCLUDE (id)
+            """)
             
             # Behavior metrics table
             await conn.execute("""
@@ -73,25 +238,34 @@ class PostgresDB:
                 )
             """)
             
-            # Behavior events table (for analytics)
+            # Behavior events table (for analytics): append-only, partitioned
+            # by month (the primary key must include the partition key)
             await conn.execute("""
                 CREATE TABLE IF NOT EXISTS behavior_events (
-                    event_id VARCHAR PRIMARY KEY,
+                    event_id VARCHAR NOT NULL,
                     event_type VARCHAR NOT NULL,
                     user_id VARCHAR,
                     session_id VARCHAR NOT NULL,
                     product_id VARCHAR,
                     query TEXT,
-                    timestamp TIMESTAMP DEFAULT NOW(),
+                    timestamp TIMESTAMP NOT NULL DEFAULT NOW(),
                     dwell_time DECIMAL(10, 2),
-                    metadata JSONB
-                )
+                    metadata JSONB,
+                    PRIMARY KEY (event_id, timestamp)
+                ) PARTITION BY RANGE (timestamp)
             """)
+            await self._ensure_event_partitions(conn)
             
-            # Create indexes for behavior_events
+            # Create indexes for behavior_events. Rows arrive in timestamp
+            # order, so a BRIN index (a few kB) replaces the timestamp B-tree;
+            # event_type is too low-cardinality to be worth indexing
             await conn.execute("CREATE INDEX IF NOT EXISTS idx_product_id ON behavior_events(product_id)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_event_type ON behavior_events(event_type)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_timestamp ON behavior_events(timestamp)")
+            await conn.execute("DROP INDEX IF EXISTS idx_event_type")
+            await conn.execute("DROP INDEX IF EXISTS idx_timestamp")
+            await conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_timestamp_brin ON behavior_events
+                USING BRIN (timestamp) WITH (pages_per_range = 32)
+            """)
             await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_id ON behavior_events(user_id)")
             
             # User profiles table (for personalization)
@@ -134,45 +308,134 @@ class PostgresDB:
             await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_interactions_product_id ON user_interactions(product_id)")
             await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_interactions_timestamp ON user_interactions(timestamp)")
             await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_interactions_type ON user_interactions(interaction_type)")
+            # Match get_user_interactions' WHERE user_id ... ORDER BY timestamp DESC LIMIT
+            await conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_user_interactions_user_ts
+                ON user_interactions(user_id, timestamp DESC)
+            """)
+            await conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_user_interactions_user_type_ts
+                ON user_interactions(user_id, interaction_type, timestamp DESC)
+            """)
+    
+    async def _ensure_event_partitions(self, conn):
+        """
+        Create monthly behavior_events partitions from this month through
+        PARTITION_MONTHS_AHEAD months ahead, plus a default partition for
+        stray timestamps. Tables created before partitioning are left as is.
+        """
+        relkind = await conn.fetchval(
+            "SELECT relkind FROM pg_class WHERE oid = 'behavior_events'::regclass"
+        )
+        if relkind != 'p':
+            return
+        
+        now = datetime.now()
+        year, month = now.year, now.month
+        for _ in range(PARTITION_MONTHS_AHEAD + 1):
+            start = datetime(year, month, 1)
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+            end = datetime(year, month, 1)
+            await conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS behavior_events_p{start:%Y%m}
+                PARTITION OF behavior_events
+                FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')
+            """)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS behavior_events_default
+            PARTITION OF behavior_events DEFAULT
+        """)
+    
+    async def _partition_loop(self):
+        """Background task: keep partitions created ahead of incoming data"""
+        while True:
+            await asyncio.sleep(PARTITION_MAINTENANCE_INTERVAL)
+            try:
+                async with self.pool.acquire() as conn:
+                    await self._ensure_event_partitions(conn)
+            except Exception as e:
+                print(f"Error maintaining partitions: {e}")
     
     async def insert_product(self, product: Product) -> bool:
         """Insert or update a product"""
+        self._product_cache.pop(product.id)
         async with self.pool.acquire() as conn:
-            await conn.execute("""
-                INSERT INTO products (id, title, description, category, price, rating, attributes, image_url, created_at)
-                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
-                ON CONFLICT (id) DO UPDATE SET
-                    title = EXCLUDED.title,
-                    description = EXCLUDED.description,
-                    category = EXCLUDED.category,
-                    price = EXCLUDED.price,
-                    rating = EXCLUDED.rating,
-                    attributes = EXCLUDED.attributes,
-                    image_url = EXCLUDED.image_url
-            """, product.id, product.title, product.description, product.category,
-                product.price, product.rating, json.dumps(product.attributes.dict()),
-                product.image_url, product.created_at)
+            await conn.execute(
+                UPSERT_PRODUCT_SQL,
+                product.id, product.title, product.description, product.category,
+                product.price, product.rating, product.attributes.model_dump(),
+                product.image_url, product.created_at
+            )
             return True
     
+    async def insert_products_bulk(self, products: List[Product]) -> int:
+        """
+        Insert or update many products. Large batches are streamed with COPY
+        into a staging table and upserted with one INSERT ... SELECT.
+        """
+        # Last write wins for repeated ids (ON CONFLICT cannot touch a row twice)
+        records = list({
+            p.id: (
+                p.id, p.title, p.description, p.category, p.price, p.rating,
+                p.attributes.model_dump(), p.image_url, p.created_at
+            )
+            for p in products
+        }.values())
+        if not records:
+            return 0
+        
+        for record in records:
+            self._product_cache.pop(record[0])
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                if len(records) < COPY_MIN_ROWS:
+                    await conn.executemany(UPSERT_PRODUCT_SQL, records)
+                    return len(records)
+                
+                await conn.execute("""
+                    CREATE TEMP TABLE products_staging
+                    (LIKE products INCLUDING DEFAULTS) ON COMMIT DROP
+                """)
+                await conn.copy_records_to_table(
+                    'products_staging', records=records, columns=PRODUCT_COPY_COLUMNS
+                )
+                await conn.execute("""
+                    INSERT INTO products (id, title, description, category, price, rating, attributes, image_url, created_at)
+                    SELECT id, title, description, category, price, rating, attributes, image_url, created_at
+                    FROM products_staging
+                    ON CONFLICT (id) DO UPDATE SET
+                        title = EXCLUDED.title,
+                        description = EXCLUDED.description,
+                        category = EXCLUDED.category,
+                        price = EXCLUDED.price,
+                        rating = EXCLUDED.rating,
+                        attributes = EXCLUDED.attributes,
+                        image_url = EXCLUDED.image_url
+                """)
+        return len(records)
+    
     async def get_product(self, product_id: str) -> Optional[Product]:
         """Get a product by ID"""
+        product = self._product_cache.get(product_id)
+        if product is not None:
+            return product
         async with self.pool.acquire() as conn:
-            row = await conn.fetchrow(
-                "SELECT * FROM products WHERE id = $1", product_id
-            )
+            stmt = await self._statement(conn, 'get_product')
+            row = await stmt.fetchrow(product_id)
             if row:
-                attributes = json.loads(row['attributes']) if row['attributes'] else {}
-                return Product(
+                product = Product(
                     id=row['id'],
                     title=row['title'],
                     description=row['description'],
                     category=row['category'],
                     price=float(row['price']),
                     rating=float(row['rating']),
-                    attributes=attributes,
+                    attributes=row['attributes'] or {},
                     image_url=row['image_url'],
                     created_at=row['created_at']
                 )
+                self._product_cache.put(product_id, product)
+                return product
             return None
     
     async def get_products_by_ids(self, product_ids: List[str]) -> List[Product]:
@@ -182,11 +445,10 @@ class PostgresDB:
         
         async with self.pool.acquire() as conn:
             rows = await conn.fetch(
-                "SELECT * FROM products WHERE id = ANY($1)", product_ids
+                f"SELECT {PRODUCT_COLUMNS} FROM products WHERE id = ANY($1)", product_ids
             )
             products = []
             for row in rows:
-                attributes = json.loads(row['attributes']) if row['attributes'] else {}
                 products.append(Product(
                     id=row['id'],
                     title=row['title'],
@@ -194,20 +456,83 @@ class PostgresDB:
                     category=row['category'],
                     price=float(row['price']),
                     rating=float(row['rating']),
-                    attributes=attributes,
+                    attributes=row['attributes'] or {},
                     image_url=row['image_url'],
                     created_at=row['created_at']
                 ))
             return products
     
+    async def get_product_lite(self, product_id: str) -> Optional[Dict]:
+        """Get the listing fields (id, title, price, image_url) of a product"""
+        async with self.pool.acquire() as conn:
+            stmt = await self._statement(conn, 'get_product_lite')
+            row = await stmt.fetchrow(product_id)
+            return dict(row) if row else None
+    
+    async def get_products_lite_by_ids(self, product_ids: List[str]) -> List[Dict]:
+        """Get the listing fields of multiple products by IDs"""
+        if not product_ids:
+            return []
+        
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(
+                f"SELECT {PRODUCT_LITE_COLUMNS} FROM products WHERE id = ANY($1)", product_ids
+            )
+            return [dict(row) for row in rows]
+    
+    async def get_products_with_metrics(
+        self, product_ids: List[str]
+    ) -> List[Tuple[Product, Optional[Dict]]]:
+        """
+        Get products and their behavior metrics in one JOINed query.
+        Metrics are None for products with no recorded behavior.
+        """
+        if not product_ids:
+            return []
+        
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(f"""
+                SELECT {PRODUCT_WITH_METRICS_COLUMNS}
+                FROM products p
+                LEFT JOIN product_behavior_metrics m ON m.product_id = p.id
+                WHERE p.id = ANY($1::varchar[])
+            """, product_ids)
+        
+        results = []
+        for row in rows:
+            product = Product(
+                id=row['id'],
+                title=row['title'],
+                description=row['description'],
+                category=row['category'],
+                price=float(row['price']),
+                rating=float(row['rating']),
+                attributes=row['attributes'] or {},
+                image_url=row['image_url'],
+                created_at=row['created_at']
+            )
+            metrics = None
+            if row['product_id'] is not None:
+                metrics = {c: row[c] for c in METRIC_COLUMNS}
+            results.append((product, metrics))
+        return results
+    
     async def filter_products(
         self,
         category: Optional[str] = None,
         min_price: Optional[float] = None,
         max_price: Optional[float] = None,
-        min_rating: Optional[float] = None
+        min_rating: Optional[float] = None,
+        sort_by: Optional[str] = None,
+        limit: Optional[int] = None
     ) -> List[str]:
-        """Filter products and return IDs"""
+        """
+        Filter products and return IDs.
+        With sort_by (a FILTER_SORT_ORDERS key) and/or limit, ordering and
+        truncation happen in SQL so only the needed ids cross the network.
+        """
+        if sort_by is not None and sort_by not in FILTER_SORT_ORDERS:
+            raise ValueError(f"Unsupported sort_by: {sort_by}")
         conditions = []
         params = []
         param_idx = 1
@@ -234,24 +559,38 @@ class PostgresDB:
         
         where_clause = " AND ".join(conditions) if conditions else "1=1"
         
+        sql = f"SELECT id FROM products WHERE {where_clause}"
+        if sort_by is not None:
+            sql += f" ORDER BY {FILTER_SORT_ORDERS[sort_by]}"
+        if limit is not None:
+            sql += f" LIMIT ${param_idx}"
+            params.append(limit)
+        
         async with self.pool.acquire() as conn:
-            rows = await conn.fetch(
-                f"SELECT id FROM products WHERE {where_clause}",
-                *params
-            )
+            rows = await conn.fetch(sql, *params)
             return [row['id'] for row in rows]
     
     async def get_behavior_metrics(self, product_id: str) -> Optional[Dict]:
         """Get behavior metrics for a product"""
         async with self.pool.acquire() as conn:
-            row = await conn.fetchrow(
-                "SELECT * FROM product_behavior_metrics WHERE product_id = $1",
-                product_id
-            )
+            stmt = await self._statement(conn, 'get_behavior_metrics')
+            row = await stmt.fetchrow(product_id)
             if row:
                 return dict(row)
             return None
     
+    async def get_behavior_metrics_bulk(self, product_ids: List[str]) -> Dict[str, Dict]:
+        """Get behavior metrics for many products in one query, keyed by product_id"""
+        if not product_ids:
+            return {}
+        
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(f"""
+                SELECT {BEHAVIOR_METRICS_COLUMNS} FROM product_behavior_metrics
+                WHERE product_id = ANY($1::varchar[])
+            """, product_ids)
+        return {row['product_id']: dict(row) for row in rows}
+    
     async def update_behavior_metrics(self, product_id: str, metrics: Dict):
         """Update behavior metrics for a product"""
         async with self.pool.acquire() as conn:
@@ -279,13 +618,22 @@ class PostgresDB:
                 metrics.get('avg_dwell_time', 0.0), metrics.get('ctr', 0.0),
                 metrics.get('conversion_rate', 0.0), metrics.get('bounce_rate', 0.0))
     
+    async def bump_behavior_metrics(self, product_id: str, deltas: Dict):
+        """
+        Add counter deltas (e.g. {'total_clicks': 1}) to a product's metrics
+        with one atomic upsert; no read round trip and no lost updates
+        """
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                BUMP_BEHAVIOR_METRICS_SQL,
+                product_id, *(deltas.get(c, 0) for c in METRIC_COUNTERS)
+            )
+    
     async def get_user_profile(self, user_id: str) -> Optional[Dict]:
         """Get user profile by user_id"""
         async with self.pool.acquire() as conn:
-            row = await conn.fetchrow(
-                "SELECT * FROM user_profiles WHERE user_id = $1",
-                user_id
-            )
+            stmt = await self._statement(conn, 'get_user_profile')
+            row = await stmt.fetchrow(user_id)
             if row:
                 return dict(row)
             return None
@@ -293,11 +641,8 @@ class PostgresDB:
     async def create_user_profile(self, user_id: str) -> bool:
         """Create a new user profile"""
         async with self.pool.acquire() as conn:
-            await conn.execute("""
-                INSERT INTO user_profiles (user_id)
-                VALUES ($1)
-                ON CONFLICT (user_id) DO NOTHING
-            """, user_id)
+            stmt = await self._statement(conn, 'create_user_profile')
+            await stmt.fetchval(user_id)
             return True
     
     async def update_user_profile(self, user_id: str, profile_data: Dict) -> bool:
@@ -320,14 +665,36 @@ class PostgresDB:
                     recent_product_ids = EXCLUDED.recent_product_ids,
                     last_updated = NOW()
             """, user_id,
-                json.dumps(profile_data.get('preferred_categories', {})),
-                json.dumps(profile_data.get('preferred_brands', {})),
-                json.dumps(profile_data.get('search_history', [])),
+                profile_data.get('preferred_categories', {}),
+                profile_data.get('preferred_brands', {}),
+                profile_data.get('search_history', []),
                 profile_data.get('total_searches', 0),
                 profile_data.get('total_clicks', 0),
                 profile_data.get('total_carts', 0),
                 profile_data.get('total_purchases', 0),
-                json.dumps(profile_data.get('recent_product_ids', [])))
+                profile_data.get('recent_product_ids', []))
+            return True
+    
+    async def record_search(self, user_id: str, query: str) -> bool:
+        """
+        Add a query to the user's search history (kept to MAX_SEARCH_HISTORY,
+        newest first) and count the search; applied in place by Postgres
+        """
+        async with self.pool.acquire() as conn:
+            await conn.execute(f"""
+                INSERT INTO user_profiles (user_id, search_history, total_searches, last_updated)
+                VALUES ($1, jsonb_build_array($2::text), 1, NOW())
+                ON CONFLICT (user_id) DO UPDATE SET
+                    search_history = CASE
+                        WHEN COALESCE(user_profiles.search_history, '[]'::jsonb) ? $2
+                            THEN user_profiles.search_history
+                        ELSE (jsonb_build_array($2::text)
+                              || COALESCE(user_profiles.search_history, '[]'::jsonb))
+                             - {settings.MAX_SEARCH_HISTORY}
+                    END,
+                    total_searches = user_profiles.total_searches + 1,
+                    last_updated = NOW()
+            """, user_id, query)
             return True
     
     async def add_user_interaction(
@@ -341,14 +708,49 @@ class PostgresDB:
     ) -> bool:
         """Add a user interaction record"""
         async with self.pool.acquire() as conn:
-            await conn.execute("""
-                INSERT INTO user_interactions (
-                    user_id, product_id, interaction_type, category, brand, metadata
-                ) VALUES ($1, $2, $3, $4, $5, $6)
-            """, user_id, product_id, interaction_type, category, brand,
-                json.dumps(metadata) if metadata else None)
+            await conn.execute(
+                INSERT_INTERACTION_SQL,
+                user_id, product_id, interaction_type, category, brand,
+                metadata or None
+            )
             return True
     
+    async def insert_behavior_events_bulk(self, rows: List[tuple]) -> int:
+        """
+        Record many raw behavior events, each an (event_id, event_type, user_id,
+        session_id, product_id, query, timestamp, dwell_time, metadata) tuple
+        """
+        if not rows:
+            return 0
+        
+        records = [(*row[:8], row[8] or None) for row in rows]
+        async with self.pool.acquire() as conn:
+            if len(records) < COPY_MIN_ROWS:
+                await conn.executemany(INSERT_EVENT_SQL, records)
+            else:
+                await conn.copy_records_to_table(
+                    'behavior_events', records=records, columns=EVENT_COPY_COLUMNS
+                )
+        return len(records)
+    
+    async def add_user_interactions_bulk(self, rows: List[tuple]) -> int:
+        """
+        Add many interaction records, each a
+        (user_id, product_id, interaction_type, category, brand, metadata) tuple
+        """
+        if not rows:
+            return 0
+        
+        records = [(*row[:5], row[5] or None) for row in rows]
+        async with self.pool.acquire() as conn:
+            if len(records) < COPY_MIN_ROWS:
+                await conn.executemany(INSERT_INTERACTION_SQL, records)
+            else:
+                await conn.copy_records_to_table(
+                    'user_interactions', records=records, columns=INTERACTION_COPY_COLUMNS
+                )
+        return len(records)
+    
     async def get_user_interactions(
         self,
         user_id: str,
@@ -358,15 +760,15 @@ class PostgresDB:
         """Get user interactions, optionally filtered by type"""
         async with self.pool.acquire() as conn:
             if interaction_type:
-                rows = await conn.fetch("""
-                    SELECT * FROM user_interactions
+                rows = await conn.fetch(f"""
+                    SELECT {USER_INTERACTION_COLUMNS} FROM user_interactions
                     WHERE user_id = $1 AND interaction_type = $2
                     ORDER BY timestamp DESC
                     LIMIT $3
                 """, user_id, interaction_type, limit)
             else:
-                rows = await conn.fetch("""
-                    SELECT * FROM user_interactions
+                rows = await conn.fetch(f"""
+                    SELECT {USER_INTERACTION_COLUMNS} FROM user_interactions
                     WHERE user_id = $1
                     ORDER BY timestamp DESC
                     LIMIT $2
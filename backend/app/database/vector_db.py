@@ -1,15 +1,49 @@
 """
 Vector database using FAISS for semantic search
 """
+import asyncio
 import faiss
 import numpy as np
 import pickle
 import os
+import threading
 from typing import List, Tuple, Optional
 from sentence_transformers import SentenceTransformer
 from backend.app.config import settings
+from backend.app.database.cache import LRUCache
 import json
 
+# Embeddings are encoded in batches of this size
+EMBED_BATCH_SIZE = 64
+
+# Products are indexed in an HNSW graph so search is a graph walk instead
+# of a full scan; efSearch is raised per query to at least 2*k candidates
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+# Once SQ8_MIN_VECTORS are indexed (enough to fit the per-dimension value
+# ranges) the HNSW graph is rebuilt over 8-bit scalar-quantized vectors,
+# a quarter of the float32 footprint for well under 1% recall loss
+SQ8_MIN_VECTORS = 1000
+
+# HNSW-SQ8 still keeps every vector plus its graph links in memory; past
+# IVFPQ_MIN_VECTORS the index is rebuilt as IVF-PQ to compress it, and
+# search only visits IVFPQ_NPROBE of the lists
+IVFPQ_MIN_VECTORS = 1000000
+IVFPQ_NLIST = 1024
+IVFPQ_M = 16  # PQ sub-quantizers; must divide the embedding dimension
+IVFPQ_NBITS = 8
+IVFPQ_NPROBE = 16
+
+# Normalized query embeddings, keyed by the raw query string
+QUERY_EMBEDDING_CACHE_SIZE = 4096
+
+# Concurrent query encodes are coalesced for up to QUERY_BATCH_WINDOW_MS
+# (or QUERY_BATCH_MAX queries) into one batched forward pass
+QUERY_BATCH_WINDOW_MS = 3
+QUERY_BATCH_MAX = 32
+
 
 class VectorDB:
     """FAISS-based vector database for semantic search"""
@@ -21,11 +55,25 @@ class VectorDB:
         self.index_to_id: dict = {}  # faiss index -> product_id
         self.dimension = settings.EMBEDDING_DIMENSION
         self.db_path = settings.VECTOR_DB_PATH
+        self._pending: List[Tuple[str, str]] = []  # (product_id, text) awaiting encode
+        # Searches run in worker threads; this keeps them off a half-updated index
+        self._index_lock = threading.RLock()
+        # Read-only (1, dimension) arrays, so callers can never mutate a shared entry
+        self._query_cache = LRUCache(QUERY_EMBEDDING_CACHE_SIZE)
+        self._embed_queue: Optional[asyncio.Queue] = None  # (query, future) awaiting encode
+        self._embed_worker: Optional[asyncio.Task] = None
     
     def initialize(self):
         """Initialize the vector database"""
-        # Load embedding model
-        self.model = SentenceTransformer(settings.EMBEDDING_MODEL)
+        # Load embedding model; the ONNX Runtime backend runs the same
+        # weights through fused, vectorized kernels and keeps the encode API
+        try:
+            self.model = SentenceTransformer(
+                settings.EMBEDDING_MODEL, backend=settings.EMBEDDING_BACKEND
+            )
+        except Exception as e:
+            print(f"Warning: {settings.EMBEDDING_BACKEND} embedding backend unavailable, using torch: {e}")
+            self.model = SentenceTransformer(settings.EMBEDDING_MODEL)
         
         # Create or load FAISS index
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
@@ -40,43 +88,136 @@ class VectorDB:
                 mapping = pickle.load(f)
                 self.id_to_index = mapping['id_to_index']
                 self.index_to_id = mapping['index_to_id']
+            if isinstance(self.index, faiss.IndexFlat):
+                # Older indexes were flat (L2 or inner product) scans; vectors
+                # are normalized, so re-adding them to HNSW keeps positions
+                vectors = self.index.reconstruct_n(0, self.index.ntotal)
+                self.index = self._new_hnsw_index()
+                self.index.add(vectors)
+            self._maybe_quantize()
+            self._set_nprobe()
         else:
-            # Create new index
-            self.index = faiss.IndexFlatL2(self.dimension)
+            # Create new index (inner product on normalized vectors = cosine)
+            self.index = self._new_hnsw_index()
             self.id_to_index = {}
             self.index_to_id = {}
     
+    async def close(self):
+        """Stop the query-embedding worker"""
+        if self._embed_worker:
+            self._embed_worker.cancel()
+            try:
+                await self._embed_worker
+            except asyncio.CancelledError:
+                pass
+            self._embed_worker = None
+            self._embed_queue = None
+    
+    def _new_hnsw_index(self) -> faiss.Index:
+        """Empty inner-product HNSW index"""
+        index = faiss.IndexHNSWFlat(self.dimension, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        return index
+    
+    def _set_nprobe(self):
+        """nprobe is a search-time parameter and is not stored with the index"""
+        if isinstance(self.index, faiss.IndexIVF):
+            self.index.nprobe = IVFPQ_NPROBE
+    
     def save(self):
         """Save index and mappings to disk"""
         index_path = f"{self.db_path}.index"
         mapping_path = f"{self.db_path}.mapping"
         
-        if self.index:
-            faiss.write_index(self.index, index_path)
-            with open(mapping_path, 'wb') as f:
-                pickle.dump({
-                    'id_to_index': self.id_to_index,
-                    'index_to_id': self.index_to_id
-                }, f)
+        with self._index_lock:
+            self._flush_pending()
+            if self.index:
+                faiss.write_index(self.index, index_path)
+                with open(mapping_path, 'wb') as f:
+                    pickle.dump({
+                        'id_to_index': self.id_to_index,
+                        'index_to_id': self.index_to_id
+                    }, f)
     
     def add_product(self, product_id: str, text: str):
-        """Add a product embedding to the index"""
-        # Generate embedding
-        embedding = self.model.encode([text], convert_to_numpy=True)
-        embedding = embedding.astype('float32')
+        """Queue a product for embedding; encoded with the next batch"""
+        with self._index_lock:
+            self._pending.append((product_id, text))
+            if len(self._pending) >= EMBED_BATCH_SIZE:
+                self._flush_pending()
+    
+    def add_products_batch(self, items: List[Tuple[str, str]]):
+        """Embed and index many (product_id, text) pairs in one batched encode"""
+        with self._index_lock:
+            self._pending.extend(items)
+            self._flush_pending()
+    
+    def flush(self):
+        """Encode all queued products in one batch and add them to the index"""
+        with self._index_lock:
+            self._flush_pending()
+    
+    def _flush_pending(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
         
-        # Normalize for cosine similarity (L2 normalization)
-        faiss.normalize_L2(embedding)
+        embeddings = self.model.encode(
+            [text for _, text in pending],
+            batch_size=EMBED_BATCH_SIZE,
+            convert_to_numpy=True
+        ).astype('float32')
         
-        # Add to index
-        idx = self.index.ntotal
-        self.index.add(embedding)
+        # Normalize so inner product equals cosine similarity
+        faiss.normalize_L2(embeddings)
+        
+        start = self.index.ntotal
+        self.index.add(embeddings)
         
         # Update mappings
-        self.id_to_index[product_id] = idx
-        self.index_to_id[idx] = product_id
+        for offset, (product_id, _) in enumerate(pending):
+            self.id_to_index[product_id] = start + offset
+            self.index_to_id[start + offset] = product_id
+        
+        self._maybe_quantize()
+        self._maybe_build_ivfpq()
+    
+    def _maybe_quantize(self):
+        """Rebuild the float32 HNSW index over SQ8 codes once it can be trained"""
+        if not isinstance(self.index, faiss.IndexHNSWFlat) or self.index.ntotal < SQ8_MIN_VECTORS:
+            return
+        
+        vectors = self.index.reconstruct_n(0, self.index.ntotal)
+        index = faiss.IndexHNSWSQ(
+            self.dimension, faiss.ScalarQuantizer.QT_8bit, HNSW_M,
+            faiss.METRIC_INNER_PRODUCT
+        )
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.train(vectors)
+        index.add(vectors)  # Same order, so index positions are unchanged
+        self.index = index
+    
+    def _maybe_build_ivfpq(self):
+        """Rebuild the HNSW index as IVF-PQ once its graph is too large to keep in memory"""
+        if isinstance(self.index, faiss.IndexIVF) or self.index.ntotal < IVFPQ_MIN_VECTORS:
+            return
+        if self.dimension % IVFPQ_M:
+            return
+        
+        vectors = self.index.reconstruct_n(0, self.index.ntotal)
+        # ~39 training points per list keeps k-means well conditioned
+        nlist = min(IVFPQ_NLIST, max(1, len(vectors) // 39))
+        quantizer = faiss.IndexFlatIP(self.dimension)
+        index = faiss.IndexIVFPQ(
+            quantizer, self.dimension, nlist, IVFPQ_M, IVFPQ_NBITS,
+            faiss.METRIC_INNER_PRODUCT
+        )
+        index.train(vectors)
+        index.add(vectors)  # Same order, so index positions are unchanged
+        self.index = index
+        self._set_nprobe()
     
-    def search(
+    async def search(
         self,
         query: str,
         k: int = 20,
@@ -86,21 +227,110 @@ class VectorDB:
         Search for similar products
         Returns: List of (product_id, similarity_score) tuples
         """
-        # Generate query embedding
-        query_embedding = self.model.encode([query], convert_to_numpy=True)
-        query_embedding = query_embedding.astype('float32')
-        faiss.normalize_L2(query_embedding)
+        # Generate query embedding (cached per query string, batched with
+        # concurrent searches); the FAISS scan is CPU-bound, so it also runs
+        # off the event loop
+        query_embedding = await self._embed_async(query)
+        return await asyncio.to_thread(
+            self._search_sync, query_embedding, k, product_ids_filter
+        )
+    
+    async def _embed_async(self, query: str) -> np.ndarray:
+        """Embedding for one query, encoded together with concurrent misses"""
+        embedding = self._query_cache.get(query)
+        if embedding is not None:
+            return embedding
+        
+        loop = asyncio.get_running_loop()
+        if (self._embed_worker is None or self._embed_worker.done()
+                or self._embed_worker.get_loop() is not loop):
+            self._embed_queue = asyncio.Queue()
+            self._embed_worker = loop.create_task(self._embed_loop(self._embed_queue))
+        
+        future = loop.create_future()
+        self._embed_queue.put_nowait((query, future))
+        return await future
+    
+    async def _embed_loop(self, queue: asyncio.Queue):
+        """Background task: encode queued queries in coalesced batches"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + QUERY_BATCH_WINDOW_MS / 1000
+            while len(batch) < QUERY_BATCH_MAX:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            queries = list(dict.fromkeys(query for query, _ in batch))
+            try:
+                embeddings = await asyncio.to_thread(self._encode_queries, queries)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            for query, embedding in zip(queries, embeddings):
+                self._query_cache.put(query, embedding)
+            by_query = dict(zip(queries, embeddings))
+            for query, future in batch:
+                if not future.done():
+                    future.set_result(by_query[query])
+    
+    def _encode_queries(self, queries: List[str]) -> List[np.ndarray]:
+        """Encode and normalize queries in one forward pass"""
+        embeddings = self.model.encode(
+            queries, batch_size=QUERY_BATCH_MAX, convert_to_numpy=True
+        ).astype('float32')
+        faiss.normalize_L2(embeddings)
+        embeddings.setflags(write=False)
+        return [embeddings[i:i + 1] for i in range(len(queries))]
+    
+    def _search_sync(
+        self,
+        query_embedding: np.ndarray,
+        k: int,
+        product_ids_filter: Optional[List[str]]
+    ) -> List[Tuple[str, float]]:
+        with self._index_lock:
+            self._flush_pending()
+            return self._search_index(query_embedding, k, product_ids_filter)
+    
+    def _search_index(
+        self,
+        query_embedding: np.ndarray,
+        k: int,
+        product_ids_filter: Optional[List[str]]
+    ) -> List[Tuple[str, float]]:
+        # Restrict the search to the filtered products inside FAISS itself
+        selector = None
+        if product_ids_filter:
+            allowed = np.fromiter(
+                (self.id_to_index[p] for p in product_ids_filter if p in self.id_to_index),
+                dtype='int64'
+            )
+            if len(allowed) == 0:
+                return []
+            selector = faiss.IDSelectorBatch(allowed)
+            k = min(k, len(allowed))
         
         # Search
         k = min(k, self.index.ntotal)
         if k == 0:
             return []
         
-        distances, indices = self.index.search(query_embedding, k)
+        scores, indices = self.index.search(
+            query_embedding, k, params=self._search_params(k, selector)
+        )
         
         # Convert to product IDs and scores
         results = []
-        for i, (distance, idx) in enumerate(zip(distances[0], indices[0])):
+        for score, idx in zip(scores[0], indices[0]):
             if idx == -1:  # FAISS returns -1 for empty slots
                 continue
             
@@ -108,19 +338,27 @@ class VectorDB:
             if product_id is None:
                 continue
             
-            # Apply filter if provided
-            if product_ids_filter and product_id not in product_ids_filter:
-                continue
-            
-            # Convert L2 distance to similarity (1 - normalized distance)
-            # Since we normalized, distance is in [0, 2], similarity in [0, 1]
-            similarity = 1 - (distance / 2.0)
-            similarity = max(0.0, min(1.0, similarity))  # Clamp to [0, 1]
+            # Inner product of normalized vectors is cosine similarity
+            similarity = max(0.0, min(1.0, float(score)))  # Clamp to [0, 1]
             
             results.append((product_id, float(similarity)))
         
         return results
     
+    def _search_params(self, k: int, selector: Optional[faiss.IDSelector]) -> faiss.SearchParameters:
+        """Per-query search parameters; these override the index's own settings"""
+        if isinstance(self.index, faiss.IndexHNSW):
+            params = faiss.SearchParametersHNSW()
+            params.efSearch = max(HNSW_EF_SEARCH, 2 * k)
+        elif isinstance(self.index, faiss.IndexIVF):
+            params = faiss.SearchParametersIVF()
+            params.nprobe = IVFPQ_NPROBE
+        else:
+            params = faiss.SearchParameters()
+        if selector is not None:
+            params.sel = selector
+        return params
+    
     def remove_product(self, product_id: str):
         """Remove a product from the index (not fully supported in FAISS, mark as removed)"""
         # FAISS doesn't support deletion, so we'll mark it
@@ -2,13 +2,13 @@
 Main FastAPI application
 """
 from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
 from backend.app.api.routes import router
 from backend.app.database.mysql_db import db
 from backend.app.database.vector_db import vector_db
 from backend.app.services.behavior_tracker import behavior_tracker
 from backend.app.config import settings
 import asyncio
+from typing import Optional
 
 app = FastAPI(
     title="Lenskart AI Search Platform",
@@ -16,14 +16,70 @@ app = FastAPI(
     version="1.0.0"
 )
 
+CORS_ALLOW_METHODS = b"DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT"
+CORS_MAX_AGE = b"600"
+
+
+class AllowAllCORSMiddleware:
+    """
+    CORS for any origin, method and header, with credentials; the same
+    policy as CORSMiddleware(allow_origins=["*"], allow_credentials=True,
+    allow_methods=["*"], allow_headers=["*"]). With nothing to match, the
+    headers are appended to the raw ASGI response without building a
+    Request or MutableHeaders. In production, restrict the origins.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        origin = request_method = request_headers = None
+        for name, value in scope["headers"]:
+            if name == b"origin":
+                origin = value
+            elif name == b"access-control-request-method":
+                request_method = value
+            elif name == b"access-control-request-headers":
+                request_headers = value
+        
+        if origin is None:
+            await self.app(scope, receive, send)
+            return
+        
+        # Credentialed requests can't use "*", so the origin is echoed back
+        cors_headers = [
+            (b"access-control-allow-origin", origin),
+            (b"access-control-allow-credentials", b"true"),
+            (b"vary", b"Origin"),
+        ]
+        
+        if scope["method"] == "OPTIONS" and request_method is not None:
+            # Preflight: answer directly
+            headers = cors_headers + [
+                (b"access-control-allow-methods", CORS_ALLOW_METHODS),
+                (b"access-control-max-age", CORS_MAX_AGE),
+                (b"content-length", b"0"),
+            ]
+            if request_headers:
+                headers.append((b"access-control-allow-headers", request_headers))
+            await send({"type": "http.response.start", "status": 200, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+        
+        async def send_with_cors(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + cors_headers
+            await send(message)
+        
+        await self.app(scope, receive, send_with_cors)
+
+
 # CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # In production, specify actual origins
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+app.add_middleware(AllowAllCORSMiddleware)
 
 import logging
 import traceback
@@ -57,6 +113,10 @@ for route in app.routes:
 
 
 
+# Stream consumer started at startup, cancelled at shutdown
+_behavior_events_task: Optional[asyncio.Task] = None
+
+
 @app.on_event("startup")
 async def startup():
     """Initialize services on startup"""
@@ -67,16 +127,22 @@ async def startup():
     vector_db.initialize()
     
     # Initialize behavior tracker
-    behavior_tracker.initialize()
+    await behavior_tracker.initialize()
     
     # Start background task for processing behavior events
-    asyncio.create_task(process_behavior_events_background())
+    global _behavior_events_task
+    _behavior_events_task = asyncio.create_task(process_behavior_events_background())
 
 
 @app.on_event("shutdown")
 async def shutdown():
     """Cleanup on shutdown"""
+    # Background writers stop before the pools and Redis client they use close
+    if _behavior_events_task:
+        _behavior_events_task.cancel()
+    await behavior_tracker.close()
     await db.disconnect()
+    await vector_db.close()
     vector_db.save()
 
 
@@ -102,11 +168,15 @@ async def root():
 
 
 if __name__ == "__main__":
+    import sys
     import uvicorn
+    # uvloop/httptools ship with uvicorn[standard]; uvloop has no Windows build
     uvicorn.run(
         "backend.app.main:app",
         host=settings.API_HOST,
         port=settings.API_PORT,
-        reload=settings.DEBUG
+        reload=settings.DEBUG,
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools"
     )
 
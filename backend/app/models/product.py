@@ -1,7 +1,7 @@
 """
 Product data models
 """
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional, Dict, List
 from datetime import datetime
 
@@ -29,8 +29,8 @@ class Product(BaseModel):
     image_url: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.now)
     
-    class Config:
-        json_schema_extra = {
+    model_config = ConfigDict(
+        json_schema_extra={
             "example": {
                 "id": "prod_001",
                 "title": "Classic Aviator Sunglasses",
@@ -46,6 +46,7 @@ class Product(BaseModel):
                 }
             }
         }
+    )
 
 
 class ProductWithScore(BaseModel):
@@ -14,6 +14,7 @@ class SearchRequest(BaseModel):
     max_price: Optional[float] = None
     min_rating: Optional[float] = None
     limit: int = 20
+    stream: bool = False  # Server-Sent Events: results first, then explanations
 
 
 class SearchResponse(BaseModel):
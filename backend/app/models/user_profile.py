@@ -1,6 +1,7 @@
 """
 User profile models for personalized search
 """
+import heapq
 from pydantic import BaseModel, Field
 from typing import Optional, Dict, List
 from datetime import datetime
@@ -39,6 +40,10 @@ class UserProfile(BaseModel):
     total_carts: int = 0
     total_purchases: int = 0
     
+    # Clicks + carts + purchases, kept in step with the counters above when
+    # the profile is loaded and on each event (not stored separately)
+    total_interactions: int = 0
+    
     # Recently interacted product IDs (for similarity matching)
     recent_product_ids: List[str] = Field(default_factory=list)
     
@@ -48,30 +53,26 @@ class UserProfile(BaseModel):
     
     def has_sufficient_history(self, min_interactions: int = 3) -> bool:
         """Check if user has enough interaction history for personalization"""
-        total_interactions = (
-            self.total_clicks + 
-            self.total_carts + 
-            self.total_purchases
-        )
-        return total_interactions >= min_interactions
+        return self.total_interactions >= min_interactions
     
     def get_top_categories(self, limit: int = 5) -> List[str]:
         """Get user's top preferred categories"""
-        sorted_categories = sorted(
+        # Partial selection, O(C log limit); ties keep dict order like a stable sort
+        top_categories = heapq.nlargest(
+            limit,
             self.preferred_categories.items(),
-            key=lambda x: x[1],
-            reverse=True
+            key=lambda x: x[1]
         )
-        return [cat for cat, _ in sorted_categories[:limit]]
+        return [cat for cat, _ in top_categories]
     
     def get_top_brands(self, limit: int = 5) -> List[str]:
         """Get user's top preferred brands"""
-        sorted_brands = sorted(
+        top_brands = heapq.nlargest(
+            limit,
             self.preferred_brands.items(),
-            key=lambda x: x[1],
-            reverse=True
+            key=lambda x: x[1]
         )
-        return [brand for brand, _ in sorted_brands[:limit]]
+        return [brand for brand, _ in top_brands]
 
 
 class UserPreferenceScore(BaseModel):
@@ -1,16 +1,142 @@
 """
 Analytics service for query performance analysis
 """
-from typing import List, Optional, Dict
+import asyncio
+from typing import List, Optional, Dict, Tuple, Literal
 from datetime import datetime, timedelta
 from backend.app.database.mysql_db import db
+from backend.app.database.cache import TTLCache
 from backend.app.models.analytics import QueryMetrics, AnalyticsSummary, ProductMetrics, TimeSeriesMetric
 import aiomysql
 
+# get_product_metrics sort keys -> ORDER BY clause (product id breaks ties)
+PRODUCT_METRIC_SORT_ORDERS = {
+    'appearances': 'appearances DESC, p.id',
+    'views': 'view_count DESC, p.id',
+    'purchases': 'purchase_count DESC, p.id',
+}
+
+# Recently computed summaries, shared by dashboards polling the same range
+SUMMARY_CACHE_SIZE = 256
+SUMMARY_CACHE_TTL_SECONDS = 30
+
+
+def _minute_bucket(value: Optional[datetime]) -> Optional[datetime]:
+    """Truncate to the minute so near-identical polling ranges share a cache key"""
+    return value.replace(second=0, microsecond=0) if value else None
+
 
 class AnalyticsService:
     """Service for aggregating and analyzing query performance"""
     
+    def __init__(self):
+        self._summary_cache = TTLCache(SUMMARY_CACHE_SIZE, SUMMARY_CACHE_TTL_SECONDS)
+    
+    @staticmethod
+    def _rollup_date_filter(
+        start_date: Optional[datetime],
+        end_date: Optional[datetime]
+    ) -> Tuple[str, list]:
+        """Build the WHERE clause selecting rollup days (index range scan on idx_day)"""
+        conditions = ["1=1"]
+        params = []
+        
+        if start_date:
+            conditions.append("day >= %s")
+            params.append(start_date.date())
+        
+        if end_date:
+            conditions.append("day <= %s")
+            params.append(end_date.date())
+        
+        return " AND ".join(conditions), params
+    
+    async def _fetch_query_metrics(
+        self,
+        start_date: Optional[datetime],
+        end_date: Optional[datetime],
+        min_searches: int = 1,
+        having: Optional[str] = None,
+        order_by: str = "search_count DESC",
+        limit: Optional[int] = None
+    ) -> List[QueryMetrics]:
+        """Aggregate per-query rows from the rollup, filtered and ordered in SQL"""
+        where_clause, params = self._rollup_date_filter(start_date, end_date)
+        params.append(min_searches)
+        having_clause = "search_count >= %s"
+        if having:
+            having_clause += f" AND ({having})"
+        limit_clause = ""
+        if limit is not None:
+            limit_clause = "LIMIT %s"
+            params.append(limit)
+        
+        async with db.autocommit_pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                # Each rollup row holds a query's counts for one day; events are
+                # attributed to the latest search in their session
+                await cursor.execute(f"""
+                    SELECT 
+                        query,
+                        SUM(search_count) as search_count,
+                        SUM(click_count) as click_count,
+                        SUM(cart_count) as cart_count,
+                        SUM(purchase_count) as purchase_count,
+                        SUM(total_dwell) as total_dwell,
+                        SUM(dwell_count) as dwell_count,
+                        MIN(first_seen) as first_seen,
+                        MAX(last_seen) as last_seen
+                    FROM query_metrics_rollup
+                    WHERE {where_clause}
+                    GROUP BY query
+                    HAVING {having_clause}
+                    ORDER BY {order_by}
+                    {limit_clause}
+                """, params)
+                
+                rows = await cursor.fetchall()
+            
+        # Rows are typed by the driver and every field is set explicitly,
+        # so the models are built without validation
+        query_metrics = []
+        
+        for row in rows:
+            search_count = int(row['search_count'])
+            click_count = int(row['click_count'] or 0)
+            cart_count = int(row['cart_count'] or 0)
+            purchase_count = int(row['purchase_count'] or 0)
+            dwell_count = int(row['dwell_count'] or 0)
+            total_dwell = float(row['total_dwell']) if row['total_dwell'] else 0.0
+            
+            # Calculate average dwell time
+            avg_dwell = (total_dwell / dwell_count) if dwell_count > 0 else 0.0
+            
+            # Calculate CTR
+            ctr = (click_count / search_count) if search_count > 0 else 0.0
+            
+            # Calculate Conversion Rate (purchases per interaction session)
+            total_interactions = click_count + cart_count + purchase_count
+            conversion_rate = (purchase_count / total_interactions) if total_interactions > 0 else 0.0
+            
+            # Zero results estimation: searches not followed by a click
+            zero_result_sessions = max(0, search_count - click_count)
+
+            query_metrics.append(QueryMetrics.model_construct(
+                query=row['query'],
+                total_searches=search_count,
+                total_clicks=click_count,
+                total_carts=cart_count,
+                total_purchases=purchase_count,
+                zero_results_count=zero_result_sessions,
+                ctr=ctr,
+                conversion_rate=conversion_rate,
+                avg_dwell_time=avg_dwell,
+                first_seen=row['first_seen'],
+                last_seen=row['last_seen']
+            ))
+        
+        return query_metrics
+    
     async def get_query_metrics(
         self,
         start_date: Optional[datetime] = None,
@@ -18,7 +144,7 @@ class AnalyticsService:
         min_searches: int = 1
     ) -> List[QueryMetrics]:
         """
-        Aggregate query metrics from behavior events
+        Aggregate query metrics from the per-day query rollup
         
         Computes:
         - Total searches per query
@@ -27,103 +153,101 @@ class AnalyticsService:
         - Conversion rate per query
         - Zero-result queries
         - Average dwell time
+        
+        The rollup is kept per day, so date bounds select whole days.
         """
-        async with db.pool.acquire() as conn:
+        return await self._fetch_query_metrics(start_date, end_date, min_searches)
+    
+    async def get_overall_totals(
+        self,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None
+    ) -> Dict[str, int]:
+        """Totals across all searched queries, reduced in SQL"""
+        where_clause, params = self._rollup_date_filter(start_date, end_date)
+        
+        async with db.autocommit_pool.acquire() as conn:
             async with conn.cursor(aiomysql.DictCursor) as cursor:
-                # Optimized query: Calculate all metrics in a single pass using session-based joins
-                # We use a CTE or subquery to find all search sessions and then join other actions
-                
-                # Build date filter conditions for search events
-                conditions = ["e1.event_type = 'search'", "e1.query IS NOT NULL", "e1.query != ''"]
-                params = []
-                
-                if start_date:
-                    conditions.append("e1.timestamp >= %s")
-                    params.append(start_date)
-                
-                if end_date:
-                    conditions.append("e1.timestamp <= %s")
-                    params.append(end_date)
-                
-                where_clause = " AND ".join(conditions)
-                params.append(min_searches)
-
-                # This query aggregates metrics by query across sessions
                 await cursor.execute(f"""
                     SELECT 
-                        e1.query,
-                        COUNT(DISTINCT e1.event_id) as search_count,
-                        COUNT(DISTINCT CASE WHEN e2.event_type = 'click' THEN e2.event_id END) as click_count,
-                        COUNT(DISTINCT CASE WHEN e2.event_type = 'add_to_cart' THEN e2.event_id END) as cart_count,
-                        COUNT(DISTINCT CASE WHEN e2.event_type = 'purchase' THEN e2.event_id END) as purchase_count,
-                        COUNT(DISTINCT e1.session_id) as total_sessions,
-                        SUM(CASE WHEN e2.dwell_time IS NOT NULL THEN e2.dwell_time ELSE 0 END) as total_dwell,
-                        COUNT(CASE WHEN e2.dwell_time IS NOT NULL THEN 1 END) as dwell_count,
-                        MIN(e1.timestamp) as first_seen,
-                        MAX(e1.timestamp) as last_seen
-                    FROM behavior_events e1
-                    LEFT JOIN behavior_events e2 ON e1.session_id = e2.session_id 
-                    WHERE {where_clause}
-                    GROUP BY e1.query
-                    HAVING search_count >= %s
-                    ORDER BY search_count DESC
+                        COUNT(*) as total_queries,
+                        COALESCE(SUM(search_count), 0) as total_searches,
+                        COALESCE(SUM(click_count), 0) as total_clicks,
+                        COALESCE(SUM(cart_count), 0) as total_carts,
+                        COALESCE(SUM(purchase_count), 0) as total_conversions,
+                        COALESCE(SUM(search_count > click_count), 0) as zero_result_queries
+                    FROM (
+                        SELECT 
+                            query,
+                            SUM(search_count) as search_count,
+                            SUM(click_count) as click_count,
+                            SUM(cart_count) as cart_count,
+                            SUM(purchase_count) as purchase_count
+                        FROM query_metrics_rollup
+                        WHERE {where_clause}
+                        GROUP BY query
+                        HAVING search_count >= 1
+                    ) per_query
                 """, params)
                 
-                rows = await cursor.fetchall()
-            
-                query_metrics = []
-                
-                for row in rows:
-                    search_count = row['search_count']
-                    click_count = row['click_count'] or 0
-                    cart_count = row['cart_count'] or 0
-                    purchase_count = row['purchase_count'] or 0
-                    dwell_count = row['dwell_count'] or 0
-                    total_dwell = float(row['total_dwell']) if row['total_dwell'] else 0.0
-                    
-                    # Calculate average dwell time
-                    avg_dwell = (total_dwell / dwell_count) if dwell_count > 0 else 0.0
-                    
-                    # Calculate CTR
-                    ctr = (click_count / search_count) if search_count > 0 else 0.0
-                    
-                    # Calculate Conversion Rate (purchases per interaction session)
-                    total_interactions = click_count + cart_count + purchase_count
-                    conversion_rate = (purchase_count / total_interactions) if total_interactions > 0 else 0.0
-                    
-                    # Zero results estimation: Sessions with search but no clicks
-                    # In this grouped context, we approximate it since a full subquery is expensive
-                    # We can refine this if needed, but for large scale, statistical CTR is usually sufficient
-                    zero_result_sessions = max(0, search_count - click_count)
-
-                    query_metrics.append(QueryMetrics(
-                        query=row['query'],
-                        total_searches=search_count,
-                        total_clicks=click_count,
-                        total_carts=cart_count,
-                        total_purchases=purchase_count,
-                        zero_results_count=zero_result_sessions,
-                        ctr=ctr,
-                        conversion_rate=conversion_rate,
-                        avg_dwell_time=avg_dwell,
-                        first_seen=row['first_seen'],
-                        last_seen=row['last_seen']
-                    ))
-            
-            return query_metrics
-            
+                row = await cursor.fetchone()
+        
+        return {key: int(value or 0) for key, value in row.items()}
+    
+    async def get_top_queries(
+        self,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        limit: int = 50
+    ) -> List[QueryMetrics]:
+        """Queries with the highest search volume"""
+        return await self._fetch_query_metrics(
+            start_date, end_date, limit=limit
+        )
+    
+    async def get_poor_performing(
+        self,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        limit: int = 50
+    ) -> List[QueryMetrics]:
+        """
+        Queries with low CTR, zero-result sessions, or low conversion,
+        worst CTR first and then lowest conversion
+        """
+        ctr = "SUM(click_count) / SUM(search_count)"
+        conversion_rate = (
+            "COALESCE(SUM(purchase_count) / "
+            "NULLIF(SUM(click_count) + SUM(cart_count) + SUM(purchase_count), 0), 0)"
+        )
+        return await self._fetch_query_metrics(
+            start_date,
+            end_date,
+            having=(
+                f"{ctr} < 0.1"  # CTR below 10%
+                " OR search_count > click_count"  # Has zero result sessions
+                f" OR (search_count > 5 AND {conversion_rate} < 0.05)"  # Low conversion with enough searches
+            ),
+            order_by=f"{ctr} ASC, {conversion_rate} DESC, search_count DESC",
+            limit=limit
+        )
+    
     async def get_product_metrics(
         self,
         start_date: Optional[datetime] = None,
         end_date: Optional[datetime] = None,
-        limit: int = 20
+        limit: int = 20,
+        sort_by: Literal['appearances', 'views', 'purchases'] = 'appearances'
     ) -> List[ProductMetrics]:
-        """Aggregate product metrics from behavior events"""
-        async with db.pool.acquire() as conn:
+        """Aggregate product metrics from behavior events, top `limit` by `sort_by`"""
+        order_by = PRODUCT_METRIC_SORT_ORDERS.get(sort_by)
+        if order_by is None:
+            raise ValueError(f"Unsupported sort_by: {sort_by}")
+        async with db.autocommit_pool.acquire() as conn:
             async with conn.cursor(aiomysql.DictCursor) as cursor:
                 # We combine data from behavior_events (for raw interaction counts)
                 # and product_behavior_metrics (for aggregated impressions/searches)
-                await cursor.execute("""
+                await cursor.execute(f"""
                     SELECT 
                         p.id as product_id, 
                         p.title as product_title, 
@@ -136,9 +260,9 @@ class AnalyticsService:
                     LEFT JOIN product_behavior_metrics m ON p.id = m.product_id
                     GROUP BY p.id, p.title, m.total_searches
                     HAVING appearances > 0 OR view_count > 0 OR cart_count > 0 OR purchase_count > 0
-                    ORDER BY appearances DESC
+                    ORDER BY {order_by}
                     LIMIT %s
-                """, (limit * 2,))
+                """, (limit,))
                 
                 rows = await cursor.fetchall()
                 
@@ -147,7 +271,7 @@ class AnalyticsService:
                     total_actions = row['view_count'] + row['cart_count'] + row['purchase_count']
                     ctr = (row['view_count'] / row['appearances']) if row['appearances'] > 0 else 0.0
                     
-                    results.append(ProductMetrics(
+                    results.append(ProductMetrics.model_construct(
                         product_id=str(row['product_id']),
                         title=row['product_title'],
                         appearances=int(row['appearances']),
@@ -167,13 +291,17 @@ class AnalyticsService:
         interval: str = 'hour' # 'hour' or 'day'
     ) -> List[TimeSeriesMetric]:
         """Aggregate CTR over time from behavior events"""
-        async with db.pool.acquire() as conn:
+        async with db.autocommit_pool.acquire() as conn:
             async with conn.cursor(aiomysql.DictCursor) as cursor:
-                py_date_format = '%Y-%m-%d %H:00:00' if interval == 'hour' else '%Y-%m-%d'
-                sql_date_format = py_date_format.replace('%', '%%')
+                # Buckets come back as DATETIME values, so no parsing per row
+                if interval == 'hour':
+                    bucket_sql = "FROM_UNIXTIME(UNIX_TIMESTAMP(timestamp) DIV 3600 * 3600)"
+                else:
+                    bucket_sql = "CAST(DATE(timestamp) AS DATETIME)"
                 
-                # Build date filter conditions
-                conditions = ["timestamp IS NOT NULL"]
+                # Build date filter conditions (range scan on idx_ts_etype,
+                # which also covers event_type)
+                conditions = ["event_type IN ('search', 'click')"]
                 params = []
                 
                 if start_date:
@@ -189,7 +317,7 @@ class AnalyticsService:
                 # We need search counts and click counts grouped by time
                 await cursor.execute(f"""
                     SELECT 
-                        DATE_FORMAT(timestamp, '{sql_date_format}') as time_bucket,
+                        {bucket_sql} as time_bucket,
                         SUM(CASE WHEN event_type = 'search' THEN 1 ELSE 0 END) as searches,
                         SUM(CASE WHEN event_type = 'click' THEN 1 ELSE 0 END) as clicks
                     FROM behavior_events
@@ -202,9 +330,8 @@ class AnalyticsService:
                 rows = await cursor.fetchall()
                 results = []
                 for row in rows:
-                    timestamp = datetime.strptime(row['time_bucket'], py_date_format)
                     ctr = (row['clicks'] / row['searches']) if row['searches'] > 0 else 0.0
-                    results.append(TimeSeriesMetric(timestamp=timestamp, value=ctr))
+                    results.append(TimeSeriesMetric.model_construct(timestamp=row['time_bucket'], value=ctr))
                 
                 return results
 
@@ -218,15 +345,63 @@ class AnalyticsService:
     ) -> AnalyticsSummary:
         """
         Get overall analytics summary with top queries and poor performers
+        
+        Summaries are cached for SUMMARY_CACHE_TTL_SECONDS, keyed by the date
+        range truncated to the minute, so polling dashboards share results.
         """
-        # Get all query metrics
-        all_metrics = await self.get_query_metrics(
-            start_date=start_date,
-            end_date=end_date,
-            min_searches=1
+        key = (_minute_bucket(start_date), _minute_bucket(end_date), limit)
+        summary = self._summary_cache.get(key)
+        if summary is None:
+            summary = await self._compute_analytics_summary(start_date, end_date, limit)
+            self._summary_cache.put(key, summary)
+        return summary
+    
+    async def _compute_analytics_summary(
+        self,
+        start_date: Optional[datetime],
+        end_date: Optional[datetime],
+        limit: int
+    ) -> AnalyticsSummary:
+        """Run the summary queries and assemble the result"""
+        # Aggregates and top-K lists are reduced in SQL; all six queries are
+        # independent, so they run concurrently on separate pool connections
+        (
+            totals, top_queries, poor_performing,
+            top_viewed, top_converted, ctr_over_time
+        ) = await asyncio.gather(
+            self.get_overall_totals(
+                start_date=start_date,
+                end_date=end_date
+            ),
+            self.get_top_queries(
+                start_date=start_date,
+                end_date=end_date,
+                limit=limit
+            ),
+            self.get_poor_performing(
+                start_date=start_date,
+                end_date=end_date,
+                limit=limit
+            ),
+            self.get_product_metrics(
+                start_date=start_date,
+                end_date=end_date,
+                limit=limit,
+                sort_by='views'
+            ),
+            self.get_product_metrics(
+                start_date=start_date,
+                end_date=end_date,
+                limit=limit,
+                sort_by='purchases'
+            ),
+            self.get_ctr_over_time(
+                start_date=start_date,
+                end_date=end_date
+            )
         )
         
-        if not all_metrics:
+        if not totals['total_queries']:
             return AnalyticsSummary(
                 total_queries=0,
                 total_searches=0,
@@ -240,56 +415,17 @@ class AnalyticsService:
             )
         
         # Calculate overall metrics
-        total_queries = len(all_metrics)
-        total_searches = sum(m.total_searches for m in all_metrics)
-        total_clicks = sum(m.total_clicks for m in all_metrics)
-        total_carts = sum(m.total_carts for m in all_metrics)
-        total_conversions = sum(m.total_purchases for m in all_metrics)
+        total_searches = totals['total_searches']
+        total_clicks = totals['total_clicks']
+        total_carts = totals['total_carts']
+        total_conversions = totals['total_conversions']
         overall_ctr = (total_clicks / total_searches) if total_searches > 0 else 0.0
         total_interactions = total_clicks + total_carts + total_conversions
 
         overall_conversion_rate = (total_conversions / total_interactions) if total_interactions > 0 else 0.0
-        zero_result_queries = len([m for m in all_metrics if m.zero_results_count > 0])
-        
-        # Top queries (by search volume)
-        top_queries = sorted(
-            all_metrics,
-            key=lambda x: x.total_searches,
-            reverse=True
-        )[:limit]
-        
-        # Poor performing queries (low CTR, high zero results, or low conversion)
-        poor_performing = [
-            m for m in all_metrics
-            if (
-                m.ctr < 0.1 or  # CTR below 10%
-                m.zero_results_count > 0 or  # Has zero result sessions
-                (m.total_searches > 5 and m.conversion_rate < 0.05)  # Low conversion with enough searches
-            )
-        ]
-        poor_performing = sorted(
-            poor_performing,
-            key=lambda x: (x.ctr, -x.conversion_rate),  # Sort by low CTR, then low conversion
-        )[:limit]
-        
-        # Get product metrics
-        product_metrics = await self.get_product_metrics(
-            start_date=start_date,
-            end_date=end_date,
-            limit=limit
-        )
-        
-        top_viewed = sorted(product_metrics, key=lambda x: x.views, reverse=True)[:limit]
-        top_converted = sorted(product_metrics, key=lambda x: x.purchases, reverse=True)[:limit]
-        
-        # Get CTR over time
-        ctr_over_time = await self.get_ctr_over_time(
-            start_date=start_date,
-            end_date=end_date
-        )
         
         return AnalyticsSummary(
-            total_queries=total_queries,
+            total_queries=totals['total_queries'],
             total_searches=total_searches,
             total_clicks=total_clicks,
             total_carts=total_carts,
@@ -297,7 +433,7 @@ class AnalyticsService:
             overall_ctr=overall_ctr,
 
             overall_conversion_rate=overall_conversion_rate,
-            zero_result_queries=zero_result_queries,
+            zero_result_queries=totals['zero_result_queries'],
             top_queries=top_queries,
             poor_performing_queries=poor_performing,
             top_viewed_products=top_viewed,
@@ -313,12 +449,9 @@ class AnalyticsService:
         end_date: Optional[datetime] = None
     ) -> List[QueryMetrics]:
         """Get queries that resulted in zero clicks"""
-        all_metrics = await self.get_query_metrics(
-            start_date=start_date,
-            end_date=end_date,
-            min_searches=1
+        return await self._fetch_query_metrics(
+            start_date, end_date, having="search_count > click_count"
         )
-        return [m for m in all_metrics if m.zero_results_count > 0]
 
 
 # Global instance
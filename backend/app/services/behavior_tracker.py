@@ -1,38 +1,107 @@
 """
 User behavior tracking service with async event processing and user profile updates
 """
-import redis
-import json
+from redis import asyncio as aioredis
+import orjson
 import uuid
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 from backend.app.config import settings
 from backend.app.models.behavior import BehaviorEvent, EventType
 from backend.app.database.mysql_db import db
+from backend.app.database.cache import TTLCache
 import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Last search query per session, so later events in the session can be
+# attributed to the search that led to them. Kept in Redis (shared by all
+# workers, survives restarts); the in-process cache is used without Redis.
+SESSION_QUERY_CACHE_SIZE = 100000
+SESSION_QUERY_TTL_SECONDS = 1800
+SESSION_QUERY_KEY_PREFIX = "session_query:"
+
+# Signed-in users' events are written in batches, together with their
+# profile updates, once this many are buffered or on the flush interval
+EVENT_BATCH_SIZE = 100
+EVENT_FLUSH_INTERVAL_MS = 200
+
+# Approximate cap on the Redis stream (MAXLEN ~ trims whole radix-tree nodes)
+STREAM_MAXLEN = 1_000_000
+
+# Event type -> query_metrics_rollup counter it increments
+QUERY_ROLLUP_EVENT_COUNTERS = {
+    EventType.SEARCH: 'search_count',
+    EventType.CLICK: 'click_count',
+    EventType.ADD_TO_CART: 'cart_count',
+    EventType.PURCHASE: 'purchase_count',
+}
+
+# Stream event_type value -> product_behavior_metrics counter it increments
+PRODUCT_METRIC_EVENT_COUNTERS = {
+    EventType.CLICK.value: 'total_clicks',
+    EventType.SEARCH.value: 'total_searches',
+    EventType.ADD_TO_CART.value: 'total_carts',
+    EventType.PURCHASE.value: 'total_purchases',
+    EventType.BOUNCE.value: 'total_bounces',
+}
+
+
+def _event_row(event: BehaviorEvent) -> tuple:
+    """behavior_events insert parameters for one event"""
+    return (
+        event.event_id, event.event_type.value, event.user_id,
+        event.session_id, event.product_id, event.query,
+        event.timestamp, event.dwell_time, event.metadata
+    )
 
 
 class BehaviorTracker:
     """Tracks user behavior events asynchronously"""
     
     def __init__(self):
-        self.redis_client: Optional[redis.Redis] = None
+        self.redis_client: Optional[aioredis.Redis] = None
         self.stream_name = "behavior_events"
+        self._session_queries = TTLCache(SESSION_QUERY_CACHE_SIZE, SESSION_QUERY_TTL_SECONDS)
+        self._pending: List[BehaviorEvent] = []
+        self._pending_stream: List[dict] = []  # Stream entries awaiting XADD
+        self._flush_lock = asyncio.Lock()
+        self._buffer_full = asyncio.Event()  # Wakes the flush loop early
+        self._flush_task: Optional[asyncio.Task] = None
     
-    def initialize(self):
+    async def initialize(self):
         """Initialize Redis connection"""
         try:
-            self.redis_client = redis.Redis(
+            self.redis_client = aioredis.Redis(
                 host=settings.REDIS_HOST,
                 port=settings.REDIS_PORT,
                 db=settings.REDIS_DB,
                 decode_responses=True
             )
             # Test connection
-            self.redis_client.ping()
+            await self.redis_client.ping()
         except Exception as e:
             print(f"Warning: Redis not available, using in-memory queue: {e}")
             self.redis_client = None
+        
+        # Periodic flush of buffered events
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+    
+    async def close(self):
+        """Stop the flush loop, write what is still buffered and close Redis"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush_events()
+        if self.redis_client:
+            await self.redis_client.aclose()
+            self.redis_client = None
     
     async def track_event(
         self,
@@ -57,73 +126,165 @@ class BehaviorTracker:
             metadata=metadata
         )
         
-        # Publish to Redis Stream (non-blocking)
+        # Publish to Redis Stream; entries are buffered and sent in one
+        # pipelined round trip per flush
         if self.redis_client:
-            try:
-                self.redis_client.xadd(
-                    self.stream_name,
-                    {
-                        "event_id": event.event_id,
-                        "event_type": event.event_type.value,
-                        "user_id": event.user_id or "",
-                        "session_id": event.session_id,
-                        "product_id": event.product_id or "",
-                        "query": event.query or "",
-                        "timestamp": event.timestamp.isoformat(),
-                        "dwell_time": str(event.dwell_time) if event.dwell_time else "",
-                        "metadata": json.dumps(event.metadata) if event.metadata else ""
-                    }
-                )
-            except Exception as e:
-                print(f"Error publishing to Redis: {e}")
+            self._pending_stream.append({
+                "event_id": event.event_id,
+                "event_type": event.event_type.value,
+                "user_id": event.user_id or "",
+                "session_id": event.session_id,
+                "product_id": event.product_id or "",
+                "query": event.query or "",
+                "timestamp": event.timestamp.isoformat(),
+                "dwell_time": str(event.dwell_time) if event.dwell_time else "",
+                "metadata": orjson.dumps(event.metadata).decode() if event.metadata else ""
+            })
         
-        # Also store directly in MySQL for reliability
-        # This is async but we don't wait for it
-        asyncio.create_task(self._store_event_in_db(event))
+        await self._update_query_rollup(event)
         
-        # Update user profile asynchronously (if user_id is present)
+        # Also store in MySQL for reliability. Anonymous events go to the
+        # database's write buffer; events with a user_id are buffered here and
+        # written together with their profile updates in one transaction.
         if event.user_id:
-            asyncio.create_task(self._update_user_profile_from_event(event))
+            self._pending.append(event)
+        else:
+            await db.insert_behavior_event(
+                event.event_id, event.event_type.value, event.user_id,
+                event.session_id, event.product_id, event.query,
+                event.timestamp, event.dwell_time, event.metadata
+            )
+        
+        if max(len(self._pending), len(self._pending_stream)) >= EVENT_BATCH_SIZE:
+            self._buffer_full.set()
     
-    async def _store_event_in_db(self, event: BehaviorEvent):
-        """Store event in MySQL"""
-        try:
-            async with db.pool.acquire() as conn:
-                async with conn.cursor() as cursor:
-                    await cursor.execute("""
-                        INSERT INTO behavior_events (
-                            event_id, event_type, user_id, session_id,
-                            product_id, query, timestamp, dwell_time, metadata
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    """, (
-                        event.event_id, event.event_type.value, event.user_id,
-                        event.session_id, event.product_id, event.query,
-                        event.timestamp, event.dwell_time,
-                        json.dumps(event.metadata) if event.metadata else None
-                    ))
-                    await conn.commit()
-        except Exception as e:
-            print(f"Error storing event in DB: {e}")
+    async def _update_query_rollup(self, event: BehaviorEvent):
+        """Count the event against the session's latest search query"""
+        if event.event_type == EventType.SEARCH:
+            if not event.query:
+                return
+            await self._set_session_query(event.session_id, event.query)
+            query = event.query
+        else:
+            query = await self._get_session_query(event.session_id)
+            if query is None:
+                return
+        
+        deltas = {}
+        counter = QUERY_ROLLUP_EVENT_COUNTERS.get(event.event_type)
+        if counter:
+            deltas[counter] = 1
+        if event.dwell_time is not None:
+            deltas['total_dwell'] = event.dwell_time
+            deltas['dwell_count'] = 1
+        if deltas:
+            await db.bump_query_metrics(query, event.timestamp, deltas)
     
-    async def _update_user_profile_from_event(self, event: BehaviorEvent):
-        """Update user profile based on behavior event"""
-        try:
+    async def _set_session_query(self, session_id: str, query: str):
+        """Remember the session's latest search query"""
+        if self.redis_client:
+            try:
+                await self.redis_client.set(
+                    SESSION_QUERY_KEY_PREFIX + session_id, query,
+                    ex=SESSION_QUERY_TTL_SECONDS
+                )
+                return
+            except Exception as e:
+                logger.warning(f"Redis session query write failed: {e}")
+        self._session_queries.put(session_id, query)
+    
+    async def _get_session_query(self, session_id: str) -> Optional[str]:
+        """The session's latest search query, if it searched recently"""
+        if self.redis_client:
+            try:
+                return await self.redis_client.get(SESSION_QUERY_KEY_PREFIX + session_id)
+            except Exception as e:
+                logger.warning(f"Redis session query read failed: {e}")
+        return self._session_queries.get(session_id)
+    
+    async def _flush_loop(self):
+        """
+        Background task: flush buffered events every EVENT_FLUSH_INTERVAL_MS,
+        or as soon as a buffer reaches EVENT_BATCH_SIZE
+        """
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self._buffer_full.wait(), timeout=EVENT_FLUSH_INTERVAL_MS / 1000
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._buffer_full.clear()
+            await self.flush_events()
+    
+    async def flush_events(self):
+        """
+        Publish buffered stream entries, then store buffered events in MySQL
+        and apply their profile updates in one transaction (one per event if
+        the batch fails)
+        """
+        async with self._flush_lock:
+            entries, self._pending_stream = self._pending_stream, []
+            events, self._pending = self._pending, []
+            if entries and self.redis_client:
+                try:
+                    async with self.redis_client.pipeline(transaction=False) as pipe:
+                        for fields in entries:
+                            pipe.xadd(
+                                self.stream_name, fields,
+                                maxlen=STREAM_MAXLEN, approximate=True
+                            )
+                        await pipe.execute()
+                except Exception as e:
+                    print(f"Error publishing to Redis: {e}")
+            if not events:
+                return
             from backend.app.services.user_profile_service import user_profile_service
             
-            # Get product if available
-            product = None
-            if event.product_id:
-                product = await db.get_product(event.product_id)
+            try:
+                # Read the products before taking the transaction's connection
+                product_ids = list({event.product_id for event in events if event.product_id})
+                products = {
+                    product.id: product
+                    for product in await db.get_products_by_ids(product_ids)
+                } if product_ids else {}
+                
+                async with db.unit_of_work() as uow:
+                    await uow.insert_behavior_events([_event_row(event) for event in events])
+                    # In event order, so several events from one user build on
+                    # each other's uncommitted profile writes
+                    for event in events:
+                        await user_profile_service.update_profile_from_event(
+                            user_id=event.user_id,
+                            event_type=event.event_type.value,
+                            product=products.get(event.product_id),
+                            query=event.query,
+                            uow=uow
+                        )
+                return
+            except Exception as e:
+                logger.warning(
+                    f"Storing {len(events)} buffered events failed, retrying one at a time: {e}"
+                )
             
-            # Update profile
-            await user_profile_service.update_profile_from_event(
-                user_id=event.user_id,
-                event_type=event.event_type.value,
-                product=product,
-                query=event.query
-            )
-        except Exception as e:
-            print(f"Error updating user profile from event: {e}")
+            # One transaction per event, so a single bad event or profile
+            # update cannot discard the rest of the batch
+            for event in events:
+                try:
+                    product = (
+                        await db.get_product(event.product_id) if event.product_id else None
+                    )
+                    async with db.unit_of_work() as uow:
+                        await uow.insert_behavior_events([_event_row(event)])
+                        await user_profile_service.update_profile_from_event(
+                            user_id=event.user_id,
+                            event_type=event.event_type.value,
+                            product=product,
+                            query=event.query,
+                            uow=uow
+                        )
+                except Exception as e:
+                    logger.error(f"Error storing event {event.event_id} in DB: {e}")
     
     async def process_events_batch(self):
         """Process events from Redis Stream and update metrics"""
@@ -132,7 +293,7 @@ class BehaviorTracker:
         
         try:
             # Read events from stream
-            messages = self.redis_client.xread({self.stream_name: "0"}, count=100, block=0)
+            messages = await self.redis_client.xread({self.stream_name: "0"}, count=100, block=0)
             
             for stream, events in messages:
                 for event_id, data in events:
@@ -149,69 +310,22 @@ class BehaviorTracker:
         if not product_id or not event_type:
             return
         
-        # Get current metrics
-        metrics = await db.get_behavior_metrics(product_id)
-        if not metrics:
-            metrics = {
-                'total_clicks': 0,
-                'total_searches': 0,
-                'total_carts': 0,
-                'total_purchases': 0,
-                'total_bounces': 0,
-                'total_dwell_time': 0.0
-            }
-        
-        # Update metrics
-        if event_type == EventType.CLICK.value:
-            metrics['total_clicks'] = metrics.get('total_clicks', 0) + 1
-        elif event_type == EventType.SEARCH.value:
-            metrics['total_searches'] = metrics.get('total_searches', 0) + 1
-        elif event_type == EventType.ADD_TO_CART.value:
-            metrics['total_carts'] = metrics.get('total_carts', 0) + 1
-        elif event_type == EventType.PURCHASE.value:
-            metrics['total_purchases'] = metrics.get('total_purchases', 0) + 1
-        elif event_type == EventType.BOUNCE.value:
-            metrics['total_bounces'] = metrics.get('total_bounces', 0) + 1
+        # Counter deltas; MySQL adds them in place and derives the ratios
+        deltas = {}
+        counter = PRODUCT_METRIC_EVENT_COUNTERS.get(event_type)
+        if counter:
+            deltas[counter] = 1
         
         # Update dwell time
         dwell_time = event_data.get('dwell_time')
         if dwell_time:
             try:
-                dt = float(dwell_time)
-                metrics['total_dwell_time'] = metrics.get('total_dwell_time', 0.0) + dt
+                deltas['total_dwell_time'] = float(dwell_time)
             except:
                 pass
         
-        # Calculate derived metrics
-        total_interactions = (
-            metrics.get('total_clicks', 0) +
-            metrics.get('total_carts', 0) +
-            metrics.get('total_purchases', 0)
-        )
-        
-        if metrics.get('total_searches', 0) > 0:
-            metrics['ctr'] = metrics.get('total_clicks', 0) / metrics.get('total_searches', 1)
-        else:
-            metrics['ctr'] = 0.0
-        
-        if total_interactions > 0:
-            metrics['conversion_rate'] = metrics.get('total_purchases', 0) / total_interactions
-        else:
-            metrics['conversion_rate'] = 0.0
-        
-        if total_interactions > 0:
-            metrics['bounce_rate'] = metrics.get('total_bounces', 0) / total_interactions
-        else:
-            metrics['bounce_rate'] = 0.0
-        
-        total_clicks = metrics.get('total_clicks', 0)
-        if total_clicks > 0:
-            metrics['avg_dwell_time'] = metrics.get('total_dwell_time', 0.0) / total_clicks
-        else:
-            metrics['avg_dwell_time'] = 0.0
-        
-        # Save updated metrics
-        await db.update_behavior_metrics(product_id, metrics)
+        if deltas:
+            await db.bump_behavior_metrics(product_id, deltas)
 
 
 # Global instance
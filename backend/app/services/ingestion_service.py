@@ -1,11 +1,20 @@
 """
 Product ingestion service
 """
+import asyncio
 from typing import List
 from backend.app.models.product import Product
 from backend.app.database.mysql_db import db
 from backend.app.database.vector_db import vector_db
 
+# Product attributes appended to the embedding text as "label: value"
+EMBEDDING_ATTRIBUTE_FIELDS = (
+    ("brand", "brand"),
+    ("color", "color"),
+    ("material", "material"),
+    ("style", "style"),
+)
+
 
 class IngestionService:
     """Service for ingesting products into the system"""
@@ -31,12 +40,27 @@ class IngestionService:
         return product.id
     
     async def ingest_products_batch(self, products: List[Product]) -> List[str]:
-        """Ingest multiple products"""
-        product_ids = []
-        for product in products:
-            product_id = await self.ingest_product(product)
-            product_ids.append(product_id)
-        return product_ids
+        """
+        Ingest multiple products:
+        1. Store in MySQL with multi-row inserts in one transaction
+        2. Embed all products in one batched encode and add them to the vector DB
+        3. Save the vector DB once for the whole batch
+        """
+        if not products:
+            return []
+        
+        await db.insert_products_bulk(products)
+        
+        items = [
+            (product.id, self._create_embedding_text(product))
+            for product in products
+        ]
+        
+        # Encoding and saving are CPU/disk bound, so keep them off the event loop
+        await asyncio.to_thread(vector_db.add_products_batch, items)
+        await asyncio.to_thread(vector_db.save)
+        
+        return [product.id for product in products]
     
     def _create_embedding_text(self, product: Product) -> str:
         """Create text for embedding generation"""
@@ -47,14 +71,12 @@ class IngestionService:
         ]
         
         # Add attributes
-        if product.attributes.brand:
-            parts.append(f"brand: {product.attributes.brand}")
-        if product.attributes.color:
-            parts.append(f"color: {product.attributes.color}")
-        if product.attributes.material:
-            parts.append(f"material: {product.attributes.material}")
-        if product.attributes.style:
-            parts.append(f"style: {product.attributes.style}")
+        attributes = product.attributes
+        parts.extend(
+            f"{label}: {value}"
+            for name, label in EMBEDDING_ATTRIBUTE_FIELDS
+            if (value := getattr(attributes, name))
+        )
         
         return " ".join(parts)
 
@@ -6,10 +6,17 @@ from backend.app.models.user_profile import UserProfile
 from backend.app.models.product import Product
 from backend.app.ai.groq_client import get_groq_client
 from backend.app.config import settings
+import asyncio
 import logging
+import orjson
 
 logger = logging.getLogger(__name__)
 
+# Products scored per refine_preference_signals completion, and the output
+# tokens budgeted for each one's JSON entry
+REFINE_CHUNK_SIZE = 25
+REFINE_TOKENS_PER_PRODUCT = 20
+
 
 class PersonalizationService:
     """Service for AI-assisted personalization (optional enhancement)"""
@@ -39,12 +46,11 @@ User Profile:
 - Top Categories: {', '.join(top_categories) if top_categories else 'None yet'}
 - Top Brands: {', '.join(top_brands) if top_brands else 'None yet'}
 - Recent Searches: {', '.join(recent_searches) if recent_searches else 'None yet'}
-- Total Interactions: {profile.total_clicks + profile.total_carts + profile.total_purchases}
+- Total Interactions: {profile.total_interactions}
 
 Generate a 2-3 sentence summary of this user's shopping interests and preferences."""
             
-            response = groq.client.chat.completions.create(
-                model=groq.model,
+            response = await groq.create_completion(
                 messages=[
                     {"role": "system", "content": "You are a user behavior analyst. Provide concise, insightful summaries."},
                     {"role": "user", "content": prompt}
@@ -68,21 +74,49 @@ Generate a 2-3 sentence summary of this user's shopping interests and preference
         """
         Use AI to refine preference scores for products
         Returns a dict of product_id -> refined_score
+        
+        Products are scored REFINE_CHUNK_SIZE per completion, with the chunks
+        requested concurrently
         """
         if not self.groq_available or not products:
             return None
         
         try:
             groq = get_groq_client()
-            
-            # Prepare data
-            top_categories = profile.get_top_categories(3)
-            top_brands = profile.get_top_brands(3)
-            
+        except Exception as e:
+            logger.warning(f"AI preference refinement failed: {e}")
+            return None
+        
+        top_categories = profile.get_top_categories(3)
+        top_brands = profile.get_top_brands(3)
+        chunks = [
+            products[i:i + REFINE_CHUNK_SIZE]
+            for i in range(0, len(products), REFINE_CHUNK_SIZE)
+        ]
+        chunk_scores = await asyncio.gather(*(
+            self._refine_chunk(groq, top_categories, top_brands, chunk)
+            for chunk in chunks
+        ))
+        
+        refined_scores = {}
+        for scores in chunk_scores:
+            if scores:
+                refined_scores.update(scores)
+        return refined_scores or None
+    
+    async def _refine_chunk(
+        self,
+        groq,
+        top_categories: List[str],
+        top_brands: List[str],
+        products: List[Product]
+    ) -> Optional[Dict[str, float]]:
+        """Score one chunk of products in a single JSON completion"""
+        try:
             products_text = "\n".join([
                 f"- ID: {p.id}, Title: {p.title}, Category: {p.category}, "
                 f"Brand: {p.attributes.brand if hasattr(p.attributes, 'brand') else 'N/A'}"
-                for p in products[:10]  # Limit to top 10 for API efficiency
+                for p in products
             ])
             
             prompt = f"""Given a user's preferences and a list of products, rate how well each product matches the user's interests on a scale of 0.0 to 1.0.
@@ -97,20 +131,17 @@ Products:
 Return a JSON object with product IDs as keys and preference scores (0.0-1.0) as values.
 Example: {{"product_1": 0.85, "product_2": 0.65}}"""
             
-            response = groq.client.chat.completions.create(
-                model=groq.model,
+            response = await groq.create_completion(
                 messages=[
                     {"role": "system", "content": "You are a product recommendation expert. Always respond with valid JSON."},
                     {"role": "user", "content": prompt}
                 ],
                 temperature=0.2,
-                max_tokens=300,
+                max_tokens=REFINE_TOKENS_PER_PRODUCT * len(products) + 50,
                 response_format={"type": "json_object"}
             )
             
-            import json
-            refined_scores = json.loads(response.choices[0].message.content)
-            return refined_scores
+            return orjson.loads(response.choices[0].message.content)
             
         except Exception as e:
             logger.warning(f"AI preference refinement failed: {e}")
@@ -151,8 +182,7 @@ Product:
 
 Return only a single number between 0.0 and 1.0 representing the preference score."""
             
-            response = groq.client.chat.completions.create(
-                model=groq.model,
+            response = await groq.create_completion(
                 messages=[
                     {"role": "system", "content": "You are a product recommendation expert. Respond with only a number."},
                     {"role": "user", "content": prompt}
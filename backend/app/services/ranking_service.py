@@ -1,6 +1,7 @@
 """
 Learning-based ranking service with personalization
 """
+import numpy as np
 from typing import List, Dict, Optional
 from backend.app.config import settings
 from backend.app.database.mysql_db import db
@@ -31,7 +32,9 @@ class RankingService:
     async def rank_products(
         self,
         products_with_semantic_scores: List[tuple],  # (product, semantic_score)
-        user_id: Optional[str] = None  # Optional user ID for personalization
+        user_id: Optional[str] = None,  # Optional user ID for personalization
+        metrics_by_id: Optional[Dict[str, Optional[Dict]]] = None,  # Prefetched behavior metrics
+        limit: Optional[int] = None  # Only build results for the top `limit`
     ) -> List[ProductWithScore]:
         """
         Rank products using semantic + behavior + personalization scores
@@ -53,6 +56,7 @@ class RankingService:
         # Check if personalization should be applied
         use_personalization = False
         user_preference_weight = 0.0
+        profile = None
         
         if self.enable_personalization and user_id:
             try:
@@ -67,59 +71,74 @@ class RankingService:
             except Exception as e:
                 logger.warning(f"Error checking personalization for user {user_id}: {e}")
         
-        for product, semantic_score in products_with_semantic_scores:
-            # Get behavior metrics
-            metrics = await db.get_behavior_metrics(product.id)
-            
-            if metrics:
-                # Normalize metrics to [0, 1]
-                ctr = float(metrics.get('ctr', 0.0))
-                conversion_rate = float(metrics.get('conversion_rate', 0.0))
-                bounce_rate = float(metrics.get('bounce_rate', 0.0))
-                
-                # Clamp to [0, 1]
-                ctr = min(1.0, ctr)
-                conversion_rate = min(1.0, conversion_rate)
-                bounce_rate = min(1.0, bounce_rate)
-                
-                # Calculate behavior score
-                behavior_score = (
-                    self.ctr_weight * ctr +
-                    self.conversion_weight * conversion_rate -
-                    self.bounce_penalty * bounce_rate
+        if not products_with_semantic_scores:
+            return results
+        
+        # Score the candidate set column-wise (one array per signal) so the
+        # ranking math runs as a few vectorized passes instead of per product
+        products = [product for product, _ in products_with_semantic_scores]
+        semantic_scores = np.fromiter(
+            (score for _, score in products_with_semantic_scores),
+            dtype=np.float64,
+            count=len(products_with_semantic_scores)
+        )
+        
+        # Get behavior metrics (prefetched with the products when available,
+        # otherwise one bulk query for the whole candidate set)
+        if metrics_by_id is None:
+            metrics_by_id = await db.get_behavior_metrics_bulk([product.id for product in products])
+        metrics_list = [metrics_by_id.get(product.id) for product in products]
+        
+        has_metrics = np.array([bool(metrics) for metrics in metrics_list])
+        # Columns: ctr, conversion_rate, bounce_rate; clamped to at most 1
+        rates = np.array([
+            (
+                float(metrics.get('ctr', 0.0)),
+                float(metrics.get('conversion_rate', 0.0)),
+                float(metrics.get('bounce_rate', 0.0))
+            ) if metrics else (0.0, 0.0, 0.0)
+            for metrics in metrics_list
+        ], dtype=np.float64)
+        np.minimum(rates, 1.0, out=rates)
+        
+        # Calculate behavior score, clamped to [0, 1]; neutral 0.5 for
+        # products with no behavior data yet
+        behavior_scores = np.clip(
+            rates @ np.array([self.ctr_weight, self.conversion_weight, -self.bounce_penalty]),
+            0.0, 1.0
+        )
+        behavior_scores[~has_metrics] = 0.5
+        
+        # Calculate user preference scores
+        user_preference_scores = np.zeros(len(products))
+        if use_personalization:
+            try:
+                user_preference_scores = user_profile_service.calculate_user_preference_scores(
+                    profile, products
                 )
-                # Clamp to [0, 1]
-                behavior_score = max(0.0, min(1.0, behavior_score))
-            else:
-                # No behavior data yet, use neutral score
-                behavior_score = 0.5
-                ctr = 0.0
-                conversion_rate = 0.0
-                bounce_rate = 0.0
-            
-            # Calculate user preference score
-            user_preference_score = 0.0
-            if use_personalization:
-                try:
-                    pref_score = await user_profile_service.calculate_user_preference_score(
-                        user_id, product
-                    )
-                    user_preference_score = pref_score.final_preference_score
-                except Exception as e:
-                    logger.warning(f"Error calculating preference score: {e}")
-            
-            # Calculate final score with personalization
-            final_score = (
-                self.semantic_weight * semantic_score +
-                self.behavior_weight * behavior_score +
-                user_preference_weight * user_preference_score
-            )
+            except Exception as e:
+                logger.warning(f"Error calculating preference scores: {e}")
+        
+        # Calculate final scores with personalization
+        final_scores = (
+            self.semantic_weight * semantic_scores +
+            self.behavior_weight * behavior_scores +
+            user_preference_weight * user_preference_scores
+        )
+        
+        # Sort by final score (descending); stable, so ties keep input order.
+        # Result objects and breakdowns are only built for the kept prefix.
+        order = np.argsort(-final_scores, kind='stable')
+        if limit is not None:
+            order = order[:limit]
+        for i in order:
+            ctr, conversion_rate, bounce_rate = rates[i].tolist()
             
             # Create score breakdown
             score_breakdown = {
-                "semantic_score": semantic_score,
-                "behavior_score": behavior_score,
-                "user_preference_score": user_preference_score,
+                "semantic_score": float(semantic_scores[i]),
+                "behavior_score": float(behavior_scores[i]),
+                "user_preference_score": float(user_preference_scores[i]),
                 "ctr": ctr,
                 "conversion_rate": conversion_rate,
                 "bounce_rate": bounce_rate,
@@ -130,16 +149,13 @@ class RankingService:
             }
             
             results.append(ProductWithScore(
-                product=product,
-                semantic_score=semantic_score,
-                behavior_score=behavior_score,
-                final_score=final_score,
+                product=products[i],
+                semantic_score=float(semantic_scores[i]),
+                behavior_score=float(behavior_scores[i]),
+                final_score=float(final_scores[i]),
                 score_breakdown=score_breakdown
             ))
         
-        # Sort by final score (descending)
-        results.sort(key=lambda x: x.final_score, reverse=True)
-        
         return results
     
     def get_ranking_explanation(self) -> str:
@@ -1,8 +1,9 @@
 """
 Contextual search service
 """
+import asyncio
 import time
-from typing import List, Optional
+from typing import AsyncIterator, Dict, List, Optional
 from backend.app.models.search import SearchRequest, SearchResponse
 from backend.app.models.product import ProductWithScore
 from backend.app.database.vector_db import vector_db
@@ -11,6 +12,7 @@ from backend.app.services.ranking_service import ranking_service
 from backend.app.services.behavior_tracker import behavior_tracker
 from backend.app.ai.groq_client import get_groq_client
 from backend.app.config import settings
+import orjson
 import uuid
 
 
@@ -19,6 +21,26 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+EXPLAINED_RESULTS = 5  # AI explanations are generated for the top results only
+
+
+def _explanation_input(result: ProductWithScore) -> Dict:
+    """Product fields the explanation prompts use"""
+    return {
+        "id": result.product.id,
+        "title": result.product.title,
+        "description": result.product.description,
+        "category": result.product.category,
+        "price": result.product.price,
+        "rating": result.product.rating
+    }
+
+
+def _sse_event(payload: Dict) -> bytes:
+    """Encode one Server-Sent Events message"""
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+
 class SearchService:
     """Main search service orchestrating all components"""
     
@@ -39,157 +61,171 @@ class SearchService:
         """
         try:
             start_time = time.time()
+            response = await self._search_ranked(request, session_id, user_id, start_time)
             
-            # Track search event with user_id
-            from backend.app.models.behavior import EventType
-            await behavior_tracker.track_event(
-                event_type=EventType.SEARCH,
-                session_id=session_id,
-                query=request.query,
-                user_id=user_id
-            )
-            
-            # Step 1: Query expansion using Groq
-            expanded_query = request.query
+            # Step 8: Generate AI explanations for top results
             try:
                 groq = get_groq_client()
-                expanded_query = groq.expand_query(request.query)
+                top_results = response.results[:EXPLAINED_RESULTS]
+                explanations = await groq.generate_explanations_batch([
+                    (request.query, _explanation_input(result))
+                    for result in top_results
+                ])
+                for result, explanation in zip(top_results, explanations):
+                    result.ai_explanation = explanation
             except Exception as e:
-                logger.warning(f"Query expansion failed: {e}")
-            
-            # Step 2: Apply structured filters to get candidate product IDs
-            filtered_ids = await db.filter_products(
-                category=request.category,
-                min_price=request.min_price,
-                max_price=request.max_price,
-                min_rating=request.min_rating
-            )
-            
-            # Step 3: Semantic search in vector DB (with filter)
-            # If filtered_ids is empty list, search all products (pass None)
-            product_ids_filter = filtered_ids if filtered_ids else None
-            semantic_results = vector_db.search(
-                query=expanded_query,
-                k=settings.TOP_K_FOR_AI_RERANK,
-                product_ids_filter=product_ids_filter
-            )
-            
-            if not semantic_results:
-                return SearchResponse(
-                    query=request.query,
-                    expanded_query=expanded_query,
-                    results=[],
-                    total_results=0,
-                    search_time_ms=(time.time() - start_time) * 1000,
-                    filters_applied={
-                        "category": request.category,
-                        "min_price": request.min_price,
-                        "max_price": request.max_price,
-                        "min_rating": request.min_rating
-                    }
-                )
-            
-            # Step 4: Get full product objects
-            product_ids = [pid for pid, _ in semantic_results]
-            products = await db.get_products_by_ids(product_ids)
+                logger.warning(f"Explanation generation failed: {e}")
             
-            # Create mapping: product_id -> (product, semantic_score)
-            id_to_product = {p.id: p for p in products}
-            products_with_scores = [
-                (id_to_product[pid], score)
-                for pid, score in semantic_results
-                if pid in id_to_product
-            ]
+            response.search_time_ms = (time.time() - start_time) * 1000
+            return response
+        except Exception as e:
+            logger.error(f"Search failed: {e}", exc_info=True)
+            raise e
+    
+    async def search_stream(
+        self,
+        request: SearchRequest,
+        session_id: str,
+        user_id: Optional[str] = None
+    ) -> AsyncIterator[bytes]:
+        """
+        Server-Sent Events variant of search: one "results" event as soon as
+        ranking is done (no explanations yet), then "explanation_delta" events
+        as each top result's explanation tokens arrive, one "explanation"
+        event with the full text as each finishes, then "done"
+        """
+        start_time = time.time()
+        try:
+            response = await self._search_ranked(request, session_id, user_id, start_time)
+        except Exception as e:
+            logger.error(f"Search failed: {e}", exc_info=True)
+            yield _sse_event({"type": "error", "detail": str(e)})
+            return
+        yield _sse_event({"type": "results", **response.model_dump(mode="json")})
+        
+        try:
+            groq = get_groq_client()
+        except Exception as e:
+            logger.warning(f"Explanation generation failed: {e}")
+            groq = None
+        if groq is not None:
+            # Each top result's explanation streams token by token; the
+            # producers share one queue so deltas are forwarded in arrival
+            # order, and None marks a finished explanation
+            queue: asyncio.Queue = asyncio.Queue()
             
-            # Step 5: AI-based re-ranking (optional, for top results)
-            if len(products_with_scores) > 10:
+            async def explain(result: ProductWithScore):
+                parts = []
                 try:
-                    groq = get_groq_client()
-                    # Prepare products for AI
-                    products_for_ai = [
-                        {
-                            "id": p.id,
-                            "title": p.title,
-                            "description": p.description,
-                            "category": p.category,
-                            "price": p.price,
-                            "rating": p.rating
-                        }
-                        for p, _ in products_with_scores[:settings.TOP_K_FOR_AI_RERANK]
-                    ]
-                    
-                    # AI re-rank
-                    reranked = groq.rerank_results(expanded_query, products_for_ai)
-                    
-                    # Update order based on AI ranking
-                    reranked_ids = {p['id']: i for i, p in enumerate(reranked)}
-                    products_with_scores.sort(
-                        key=lambda x: reranked_ids.get(x[0].id, 999)
-                    )
-                except Exception as e:
-                    logger.warning(f"AI re-ranking failed: {e}")
-            
-            # Step 6: Learning-based ranking (with personalization)
-            ranked_results = await ranking_service.rank_products(products_with_scores, user_id=user_id)
+                    async for delta in groq.generate_explanation_stream(
+                        request.query, _explanation_input(result)
+                    ):
+                        parts.append(delta)
+                        await queue.put((result, delta))
+                finally:
+                    result.ai_explanation = "".join(parts).strip()
+                    await queue.put((result, None))
             
-            # Step 7: Limit results
-            ranked_results = ranked_results[:request.limit]
-            
-            # Step 7.5: Track product impressions (total_searches) in background
-            async def track_impressions(results: List[ProductWithScore]):
-                for res in results:
-                    try:
-                        # Get current metrics or initialize
-                        metrics = await db.get_behavior_metrics(res.product.id)
-                        if not metrics:
-                            metrics = {
-                                'total_clicks': 0,
-                                'total_searches': 0,
-                                'total_carts': 0,
-                                'total_purchases': 0,
-                                'total_bounces': 0,
-                                'total_dwell_time': 0.0,
-                                'avg_dwell_time': 0.0,
-                                'ctr': 0.0,
-                                'conversion_rate': 0.0,
-                                'bounce_rate': 0.0
-                            }
-                        metrics['total_searches'] += 1
-                        await db.update_behavior_metrics(res.product.id, metrics)
-                    except Exception as e:
-                        logger.warning(f"Failed to track impression for {res.product.id}: {e}")
-
-            import asyncio
-            asyncio.create_task(track_impressions(ranked_results))
-
-            
-            # Step 8: Generate AI explanations for top results
+            top_results = response.results[:EXPLAINED_RESULTS]
+            tasks = [asyncio.create_task(explain(result)) for result in top_results]
             try:
-                groq = get_groq_client()
-                for result in ranked_results[:5]:  # Explain top 5
-                    explanation = groq.generate_explanation(
-                        request.query,
-                        {
+                remaining = len(tasks)
+                while remaining:
+                    result, delta = await queue.get()
+                    if delta is None:
+                        remaining -= 1
+                        yield _sse_event({
+                            "type": "explanation",
                             "id": result.product.id,
-                            "title": result.product.title,
-                            "description": result.product.description,
-                            "category": result.product.category,
-                            "price": result.product.price,
-                            "rating": result.product.rating
-                        }
-                    )
-                    result.ai_explanation = explanation
+                            "text": result.ai_explanation
+                        })
+                    else:
+                        yield _sse_event({
+                            "type": "explanation_delta",
+                            "id": result.product.id,
+                            "text": delta
+                        })
+            finally:
+                # Client disconnected mid-stream: stop the remaining LLM calls
+                for task in tasks:
+                    task.cancel()
+        
+        yield _sse_event({
+            "type": "done",
+            "search_time_ms": (time.time() - start_time) * 1000
+        })
+    
+    async def _search_ranked(
+        self,
+        request: SearchRequest,
+        session_id: str,
+        user_id: Optional[str],
+        start_time: float
+    ) -> SearchResponse:
+        """Steps 1-7 of search: the ranked, limited results without explanations"""
+        # Track search event with user_id
+        from backend.app.models.behavior import EventType
+        await behavior_tracker.track_event(
+            event_type=EventType.SEARCH,
+            session_id=session_id,
+            query=request.query,
+            user_id=user_id
+        )
+        
+        # Step 1: Query expansion using Groq
+        async def expand_query() -> str:
+            try:
+                groq = get_groq_client()
+                # Shielded so a slow expansion still finishes (and is cached
+                # for the next search) while this search moves on without it
+                return await asyncio.wait_for(
+                    asyncio.shield(groq.expand_query(request.query)),
+                    timeout=settings.QUERY_EXPAND_TIMEOUT_MS / 1000
+                )
+            except asyncio.TimeoutError:
+                logger.warning("Query expansion timed out, using the raw query")
+                return request.query
             except Exception as e:
-                logger.warning(f"Explanation generation failed: {e}")
-            
-            search_time = (time.time() - start_time) * 1000
-            
+                logger.warning(f"Query expansion failed: {e}")
+                return request.query
+        
+        # Step 2: Apply structured filters to get candidate product IDs
+        # (independent of expansion, so both round trips run concurrently).
+        # Every match is kept: results are ranked by semantic and behavior
+        # scores, not rating, so no rating-ordered cap applies here.
+        # Without any filter every product is a candidate, so skip the query.
+        async def filter_candidates() -> List[str]:
+            if (request.category is None and request.min_price is None
+                    and request.max_price is None and request.min_rating is None):
+                return []
+            return await db.filter_products(
+                category=request.category,
+                min_price=request.min_price,
+                max_price=request.max_price,
+                min_rating=request.min_rating
+            )
+        
+        expanded_query, filtered_ids = await asyncio.gather(
+            expand_query(),
+            filter_candidates()
+        )
+        
+        # Step 3: Semantic search in vector DB (with filter)
+        # If filtered_ids is empty list, search all products (pass None)
+        product_ids_filter = filtered_ids if filtered_ids else None
+        semantic_results = await vector_db.search(
+            query=expanded_query,
+            k=settings.TOP_K_FOR_AI_RERANK,
+            product_ids_filter=product_ids_filter
+        )
+        
+        if not semantic_results:
             return SearchResponse(
                 query=request.query,
                 expanded_query=expanded_query,
-                results=ranked_results,
-                total_results=len(ranked_results),
-                search_time_ms=search_time,
+                results=[],
+                total_results=0,
+                search_time_ms=(time.time() - start_time) * 1000,
                 filters_applied={
                     "category": request.category,
                     "min_price": request.min_price,
@@ -197,9 +233,79 @@ class SearchService:
                     "min_rating": request.min_rating
                 }
             )
+        
+        # Step 4: Get full product objects and their behavior metrics in one query
+        product_ids = [pid for pid, _ in semantic_results]
+        
+        # Create mapping: product_id -> (product, semantic_score)
+        id_to_product = {}
+        metrics_by_id = {}
+        for product, metrics in await db.get_products_with_metrics(product_ids):
+            id_to_product[product.id] = product
+            metrics_by_id[product.id] = metrics
+        products_with_scores = [
+            (id_to_product[pid], score)
+            for pid, score in semantic_results
+            if pid in id_to_product
+        ]
+        
+        # Step 5: AI-based re-ranking (optional, for top results)
+        if len(products_with_scores) > 10:
+            try:
+                groq = get_groq_client()
+                # Prepare products for AI
+                products_for_ai = [
+                    {
+                        "id": p.id,
+                        "title": p.title,
+                        "description": p.description,
+                        "category": p.category,
+                        "price": p.price,
+                        "rating": p.rating
+                    }
+                    for p, _ in products_with_scores[:settings.TOP_K_FOR_AI_RERANK]
+                ]
+                
+                # AI re-rank
+                reranked = await groq.rerank_results(expanded_query, products_for_ai)
+                
+                # Update order based on AI ranking
+                reranked_ids = {p['id']: i for i, p in enumerate(reranked)}
+                products_with_scores.sort(
+                    key=lambda x: reranked_ids.get(x[0].id, 999)
+                )
+            except Exception as e:
+                logger.warning(f"AI re-ranking failed: {e}")
+        
+        # Step 6: Learning-based ranking (with personalization)
+        # Step 7: Limit results (only the top request.limit are materialized)
+        ranked_results = await ranking_service.rank_products(
+            products_with_scores,
+            user_id=user_id,
+            metrics_by_id=metrics_by_id,
+            limit=request.limit
+        )
+        
+        # Step 7.5: Track product impressions (total_searches); buffered and
+        # written by the database's background flush
+        try:
+            await db.increment_search_counts([res.product.id for res in ranked_results])
         except Exception as e:
-            logger.error(f"Search failed: {e}", exc_info=True)
-            raise e
+            logger.warning(f"Failed to track impressions: {e}")
+        
+        return SearchResponse(
+            query=request.query,
+            expanded_query=expanded_query,
+            results=ranked_results,
+            total_results=len(ranked_results),
+            search_time_ms=(time.time() - start_time) * 1000,
+            filters_applied={
+                "category": request.category,
+                "min_price": request.min_price,
+                "max_price": request.max_price,
+                "min_rating": request.min_rating
+            }
+        )
 
 
 # Global instance
@@ -1,19 +1,44 @@
 """
 User profile service for personalized search
 """
+from collections import deque
 from typing import Optional, Dict, List
 from datetime import datetime
-import json
+import numpy as np
+import orjson
 from backend.app.models.user_profile import (
     UserProfile, UserInteraction, UserPreferenceScore, UserProfileSummary
 )
 from backend.app.models.product import Product
-from backend.app.database.mysql_db import db
+from backend.app.models.behavior import EventType
+from backend.app.database.mysql_db import db, UnitOfWork
 from backend.app.config import settings
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Event type value -> UserProfile interaction counter it increments
+PROFILE_EVENT_COUNTERS = {
+    EventType.CLICK.value: 'total_clicks',
+    EventType.ADD_TO_CART.value: 'total_carts',
+    EventType.PURCHASE.value: 'total_purchases',
+}
+
+
+def score_candidates(
+    category_scores: np.ndarray,
+    brand_scores: np.ndarray,
+    interaction_scores: np.ndarray,
+    weights: tuple = (0.4, 0.3, 0.3)
+) -> np.ndarray:
+    """Weighted preference score for a whole candidate set at once"""
+    category_weight, brand_weight, interaction_weight = weights
+    return (
+        category_weight * category_scores +
+        brand_weight * brand_scores +
+        interaction_weight * interaction_scores
+    )
+
 
 class UserProfileService:
     """Service for managing user profiles and calculating preference scores"""
@@ -26,29 +51,38 @@ class UserProfileService:
         self.max_search_history = settings.MAX_SEARCH_HISTORY
         self.max_recent_products = settings.MAX_RECENT_PRODUCTS
     
-    async def get_or_create_profile(self, user_id: str) -> UserProfile:
-        """Get existing profile or create a new one"""
+    async def get_or_create_profile(
+        self,
+        user_id: str,
+        uow: Optional[UnitOfWork] = None
+    ) -> UserProfile:
+        """Get existing profile or create a new one (inside `uow` when given)"""
+        store = uow or db
         try:
-            profile_data = await db.get_user_profile(user_id)
+            profile_data = await store.get_user_profile(user_id)
             
             if profile_data:
+                total_clicks = profile_data.get('total_clicks', 0)
+                total_carts = profile_data.get('total_carts', 0)
+                total_purchases = profile_data.get('total_purchases', 0)
                 # Parse JSON fields
                 return UserProfile(
                     user_id=profile_data['user_id'],
-                    preferred_categories=json.loads(profile_data.get('preferred_categories', '{}')),
-                    preferred_brands=json.loads(profile_data.get('preferred_brands', '{}')),
-                    search_history=json.loads(profile_data.get('search_history', '[]')),
+                    preferred_categories=orjson.loads(profile_data.get('preferred_categories', '{}')),
+                    preferred_brands=orjson.loads(profile_data.get('preferred_brands', '{}')),
+                    search_history=orjson.loads(profile_data.get('search_history', '[]')),
                     total_searches=profile_data.get('total_searches', 0),
-                    total_clicks=profile_data.get('total_clicks', 0),
-                    total_carts=profile_data.get('total_carts', 0),
-                    total_purchases=profile_data.get('total_purchases', 0),
-                    recent_product_ids=json.loads(profile_data.get('recent_product_ids', '[]')),
+                    total_clicks=total_clicks,
+                    total_carts=total_carts,
+                    total_purchases=total_purchases,
+                    total_interactions=total_clicks + total_carts + total_purchases,
+                    recent_product_ids=orjson.loads(profile_data.get('recent_product_ids', '[]')),
                     created_at=profile_data.get('created_at', datetime.now()),
                     last_updated=profile_data.get('last_updated', datetime.now())
                 )
             else:
                 # Create new profile
-                await db.create_user_profile(user_id)
+                await store.create_user_profile(user_id)
                 return UserProfile(user_id=user_id)
         except Exception as e:
             logger.error(f"Error getting/creating profile for user {user_id}: {e}")
@@ -60,18 +94,28 @@ class UserProfileService:
         user_id: str,
         event_type: str,
         product: Optional[Product] = None,
-        query: Optional[str] = None
+        query: Optional[str] = None,
+        uow: Optional[UnitOfWork] = None
     ):
-        """Update user profile based on behavior event"""
+        """Update user profile based on behavior event (inside `uow` when given)"""
+        writer = uow or db
         try:
-            profile = await self.get_or_create_profile(user_id)
+            if not product:
+                # Searches only touch the bounded history and a counter, which
+                # the database updates in place without a profile round trip
+                if query and event_type == 'search':
+                    await writer.record_search(user_id, query)
+                return
+            
+            profile = await self.get_or_create_profile(user_id, uow)
             
             # Update search history
             if query and event_type == 'search':
                 if query not in profile.search_history:
-                    profile.search_history.insert(0, query)
-                    # Keep only recent searches
-                    profile.search_history = profile.search_history[:self.max_search_history]
+                    # Newest first; the bounded deque drops the oldest search
+                    search_history = deque(profile.search_history, maxlen=self.max_search_history)
+                    search_history.appendleft(query)
+                    profile.search_history = list(search_history)
                 profile.total_searches += 1
             
             # Update interaction counts and preferences
@@ -89,19 +133,18 @@ class UserProfileService:
                 
                 # Update recent products
                 if product.id not in profile.recent_product_ids:
-                    profile.recent_product_ids.insert(0, product.id)
-                    profile.recent_product_ids = profile.recent_product_ids[:self.max_recent_products]
+                    recent_product_ids = deque(profile.recent_product_ids, maxlen=self.max_recent_products)
+                    recent_product_ids.appendleft(product.id)
+                    profile.recent_product_ids = list(recent_product_ids)
                 
                 # Update interaction counts
-                if event_type == 'click':
-                    profile.total_clicks += 1
-                elif event_type == 'add_to_cart':
-                    profile.total_carts += 1
-                elif event_type == 'purchase':
-                    profile.total_purchases += 1
+                counter = PROFILE_EVENT_COUNTERS.get(event_type)
+                if counter:
+                    setattr(profile, counter, getattr(profile, counter) + 1)
+                    profile.total_interactions += 1
                 
                 # Store interaction in database
-                await db.add_user_interaction(
+                await writer.add_user_interaction(
                     user_id=user_id,
                     product_id=product.id,
                     interaction_type=event_type,
@@ -120,7 +163,7 @@ class UserProfileService:
                 'total_purchases': profile.total_purchases,
                 'recent_product_ids': profile.recent_product_ids
             }
-            await db.update_user_profile(user_id, profile_data)
+            await writer.update_user_profile(user_id, profile_data)
             
         except Exception as e:
             logger.error(f"Error updating profile for user {user_id}: {e}")
@@ -185,22 +228,66 @@ class UserProfileService:
                 final_preference_score=0.0
             )
     
+    def calculate_user_preference_scores(
+        self,
+        profile: UserProfile,
+        products: List[Product]
+    ) -> np.ndarray:
+        """
+        Preference scores for many products against an already loaded
+        profile; same formula as calculate_user_preference_score
+        """
+        if not products or not profile.has_sufficient_history(self.min_interactions):
+            return np.zeros(len(products))
+        
+        # Affinity normalized by the user's strongest category / brand
+        max_category_count = max(profile.preferred_categories.values(), default=1) or 1
+        category_scores = np.fromiter(
+            (profile.preferred_categories.get(product.category, 0) for product in products),
+            dtype=np.float64,
+            count=len(products)
+        ) / max_category_count
+        
+        max_brand_count = max(profile.preferred_brands.values(), default=1) or 1
+        brand_scores = np.fromiter(
+            (
+                profile.preferred_brands.get(getattr(product.attributes, 'brand', None), 0)
+                for product in products
+            ),
+            dtype=np.float64,
+            count=len(products)
+        ) / max_brand_count
+        
+        # Recency of past interactions: e^(-position/20), 0 if never seen
+        positions = {}
+        for position, product_id in enumerate(profile.recent_product_ids):
+            positions.setdefault(product_id, position)
+        recent_positions = np.fromiter(
+            (positions.get(product.id, -1) for product in products),
+            dtype=np.float64,
+            count=len(products)
+        )
+        interaction_scores = np.where(
+            recent_positions >= 0, np.exp(-recent_positions / 20.0), 0.0
+        )
+        
+        return score_candidates(
+            category_scores,
+            brand_scores,
+            interaction_scores,
+            weights=(self.category_weight, self.brand_weight, self.interaction_weight)
+        )
+    
     async def get_profile_summary(self, user_id: str) -> UserProfileSummary:
         """Get a summary of user profile for API responses"""
         try:
             profile = await self.get_or_create_profile(user_id)
             
-            total_interactions = (
-                profile.total_clicks +
-                profile.total_carts +
-                profile.total_purchases
-            )
-            
             return UserProfileSummary(
                 user_id=user_id,
                 top_categories=profile.get_top_categories(5),
                 top_brands=profile.get_top_brands(5),
-                total_interactions=total_interactions,
+                total_interactions=profile.total_interactions,
                 total_searches=profile.total_searches,
                 total_clicks=profile.total_clicks,
                 total_carts=profile.total_carts,
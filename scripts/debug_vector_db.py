@@ -1,4 +1,5 @@
 
+import asyncio
 import sys
 import os
 
@@ -29,7 +30,7 @@ except Exception as e:
 
 print("\nTesting Search...")
 try:
-    results = vector_db.search("sunglasses")
+    results = asyncio.run(vector_db.search("sunglasses"))
     print(f"Search Results: {results}")
 except Exception as e:
     print(f"\n[ERROR] Search FAILED: {e}")
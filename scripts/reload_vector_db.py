@@ -41,7 +41,7 @@ async def reload_embeddings():
     
     # Test search
     print("\nTesting search...")
-    results = vector_db.search("sunglasses", k=3)
+    results = await vector_db.search("sunglasses", k=3)
     print(f"Found {len(results)} results for 'sunglasses'")
     for pid, score in results:
         print(f"  - {pid}: {score:.3f}")
@@ -14,14 +14,18 @@ print(f"Project root: {project_root}")
 print(f"Working directory: {os.getcwd()}")
 print("\n" + "="*50)
 
-# Start uvicorn
+# Start uvicorn on the C-accelerated event loop and HTTP parser
+# (uvloop has no Windows build, so fall back to asyncio there)
+loop = "asyncio" if sys.platform == "win32" else "uvloop"
 try:
     subprocess.run([
         sys.executable, "-m", "uvicorn",
         "backend.app.main:app",
         "--reload",
         "--host", "0.0.0.0",
-        "--port", "8000"
+        "--port", "8000",
+        "--loop", loop,
+        "--http", "httptools"
     ], cwd=project_root)
 except KeyboardInterrupt:
     print("\nServer stopped.")
@@ -27,7 +27,7 @@ async def test():
     
     # Test search
     print(f"\n3. Testing vector search...")
-    results = vector_db.search("sunglasses", k=5)
+    results = await vector_db.search("sunglasses", k=5)
     print(f"   Found {len(results)} results")
     if results:
         for pid, score in results[:3]: